@@ -0,0 +1,202 @@
+import datetime
+import logging
+import re
+import time
+
+from config import TZ_BJ, RANK_ARCHIVE_DB
+from core import redis
+from balance import RANK_METRICS, RANK_FOLD_LOOKBACK, RANK_RATE_MIN_GAMES, _PERIOD_FMT, rank_key
+from sqlstore import SqliteStore
+
+# ==============================
+# 排行榜归档：已收盘的日/周/月榜快照进 SQLite，Redis 里的榜单 key 只需短期保留
+# ==============================
+
+# 归档后把 Redis 里的周/月汇总缩短到这个 TTL（留给收盘战报等当周读取）
+RANK_ARCHIVED_TTL = 86400 * 7
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rank_archive (
+    period_type  TEXT NOT NULL,
+    period_key   TEXT NOT NULL,
+    uid          TEXT NOT NULL,
+    points       REAL NOT NULL DEFAULT 0,
+    gross_wins   REAL NOT NULL DEFAULT 0,
+    gross_losses REAL NOT NULL DEFAULT 0,
+    wins         INTEGER NOT NULL DEFAULT 0,
+    losses       INTEGER NOT NULL DEFAULT 0,
+    draws        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period_type, period_key, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_rank_archive_points ON rank_archive (period_type, period_key, points);
+CREATE INDEX IF NOT EXISTS idx_rank_archive_gross_wins ON rank_archive (period_type, period_key, gross_wins);
+CREATE INDEX IF NOT EXISTS idx_rank_archive_gross_losses ON rank_archive (period_type, period_key, gross_losses);
+CREATE TABLE IF NOT EXISTS rank_archive_periods (
+    period_type TEXT NOT NULL,
+    period_key  TEXT NOT NULL,
+    players     INTEGER NOT NULL,
+    archived_at INTEGER NOT NULL,
+    PRIMARY KEY (period_type, period_key)
+);
+CREATE TABLE IF NOT EXISTS rank_archive_meta (
+    name  TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_INSERT_SQL = (
+    "INSERT OR REPLACE INTO rank_archive "
+    "(period_type, period_key, uid, points, gross_wins, gross_losses, wins, losses, draws) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# 排序列白名单，拼进 SQL 前必须命中
+_ORDER_COLUMNS = {"points", "gross_wins", "gross_losses"}
+
+archive_store = SqliteStore(RANK_ARCHIVE_DB, _SCHEMA)
+
+
+def parse_archive_period(text: str) -> tuple[str, str] | None:
+    """20260101 / 2026-01-01 → 日榜；202601 / 2026-01 → 月榜；2026-W03 → 周榜（与 %Y-%W 一致）"""
+    text = text.strip().upper()
+    m = re.fullmatch(r"(\d{4})-?W(\d{1,2})", text)
+    if m:
+        return "weekly", f"{m.group(1)}-{int(m.group(2)):02d}"
+    digits = text.replace("-", "").replace(".", "").replace("/", "")
+    if re.fullmatch(r"\d{8}", digits):
+        try:
+            datetime.datetime.strptime(digits, "%Y%m%d")
+        except ValueError:
+            return None
+        return "daily", digits
+    if re.fullmatch(r"\d{6}", digits) and 1 <= int(digits[4:]) <= 12:
+        return "monthly", digits
+    return None
+
+
+def _period_start(prefix: str, d: datetime.date) -> datetime.date:
+    """d 所在周期的第一天"""
+    key = d.strftime(_PERIOD_FMT[prefix])
+    while (d - datetime.timedelta(days=1)).strftime(_PERIOD_FMT[prefix]) == key:
+        d -= datetime.timedelta(days=1)
+    return d
+
+
+def _closed_candidates(today: datetime.date = None, since: datetime.date = None) -> list:
+    """回看窗口内所有已收盘的 (周期类型, 周期 key)，当前周期排除在外；
+    开始于 since（归档上线日）之前的周期数据不完整，不归档"""
+    today = today or datetime.datetime.now(TZ_BJ).date()
+    current = {prefix: today.strftime(fmt) for prefix, fmt in _PERIOD_FMT.items()}
+    seen = {}
+    for offset in range(1, RANK_FOLD_LOOKBACK + 1):
+        d = today - datetime.timedelta(days=offset)
+        for prefix, fmt in _PERIOD_FMT.items():
+            key = d.strftime(fmt)
+            if key == current[prefix] or (prefix, key) in seen:
+                continue
+            if since and _period_start(prefix, d) < since:
+                continue
+            seen[(prefix, key)] = None
+    return list(seen)
+
+
+def _archive_since(conn, today: str) -> str:
+    """首次运行时记下上线日（YYYYmmdd），之后原样返回"""
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO rank_archive_meta (name, value) VALUES ('since', ?)", (today,))
+    return conn.execute("SELECT value FROM rank_archive_meta WHERE name = 'since'").fetchone()[0]
+
+
+def _source_base(period_type: str, period_key: str) -> str:
+    if period_type == "daily":
+        return f"daily:{period_key}"
+    return f"{period_type}_closed:{period_key}"
+
+
+async def _snapshot_rows(period_type: str, period_key: str) -> list:
+    base = _source_base(period_type, period_key)
+    pipe = redis.pipeline(transaction=False)
+    for metric in RANK_METRICS:
+        pipe.zrange(rank_key(metric, base), 0, -1, withscores=True)
+    results = await pipe.execute()
+
+    stats = {}
+    for i, pairs in enumerate(results):
+        for uid, score in pairs:
+            stats.setdefault(uid, [0.0] * len(RANK_METRICS))[i] = score
+    return [
+        (period_type, period_key, uid, round(p, 2), round(gw, 2), round(gl, 2), int(w), int(l), int(d))
+        for uid, (p, gw, gl, w, l, d) in stats.items()
+    ]
+
+
+def _write_period(conn, period_type: str, period_key: str, rows: list):
+    with conn:
+        conn.execute("DELETE FROM rank_archive WHERE period_type = ? AND period_key = ?", (period_type, period_key))
+        conn.executemany(_INSERT_SQL, rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO rank_archive_periods (period_type, period_key, players, archived_at) VALUES (?, ?, ?, ?)",
+            (period_type, period_key, len(rows), int(time.time())),
+        )
+
+
+async def archive_closed_rank_periods() -> int:
+    """把已收盘且未归档的日/周/月榜写入 SQLite；须在 fold_closed_rank_days 之后调用，幂等"""
+    today = datetime.datetime.now(TZ_BJ).date()
+    since = await archive_store.run(_archive_since, today.strftime("%Y%m%d"))
+    since = datetime.datetime.strptime(since, "%Y%m%d").date()
+    done = set(await archive_store.query("SELECT period_type, period_key FROM rank_archive_periods"))
+    archived = 0
+    for period_type, period_key in _closed_candidates(today, since):
+        if (period_type, period_key) in done:
+            continue
+        rows = await _snapshot_rows(period_type, period_key)
+        await archive_store.run(_write_period, period_type, period_key, rows)
+        archived += 1
+        if period_type != "daily":
+            # 日榜还要服务区间榜，保留原 TTL；周/月汇总已落盘，缩短保留
+            base = _source_base(period_type, period_key)
+            pipe = redis.pipeline(transaction=False)
+            for metric in RANK_METRICS:
+                pipe.expire(rank_key(metric, base), RANK_ARCHIVED_TTL)
+            await pipe.execute()
+        logging.info(f"[rank_archive] 归档 {period_type}:{period_key} {len(rows)} 人")
+    return archived
+
+
+async def list_archived_periods(limit: int = 10) -> list:
+    return await archive_store.query(
+        "SELECT period_type, period_key, players FROM rank_archive_periods ORDER BY archived_at DESC, period_key DESC LIMIT ?",
+        (limit,),
+    )
+
+
+async def is_period_archived(period_type: str, period_key: str) -> bool:
+    rows = await archive_store.query(
+        "SELECT 1 FROM rank_archive_periods WHERE period_type = ? AND period_key = ?", (period_type, period_key)
+    )
+    return bool(rows)
+
+
+async def query_archive_top(period_type: str, period_key: str, column: str, desc: bool = True, limit: int = 5) -> list:
+    """按指定列取某期前 N 名，返回 [(uid, score), ...]；走 (period_type, period_key, column) 索引"""
+    if column not in _ORDER_COLUMNS:
+        raise ValueError(column)
+    order = "DESC" if desc else "ASC"
+    return await archive_store.query(
+        f"SELECT uid, {column} FROM rank_archive WHERE period_type = ? AND period_key = ? "
+        f"ORDER BY {column} {order}, uid LIMIT ?",
+        (period_type, period_key, limit),
+    )
+
+
+async def query_archive_win_rate(period_type: str, period_key: str, desc: bool = True, limit: int = 5) -> list:
+    """胜率榜，排序规则与 Redis 胜率索引一致；返回 [(uid, wins, losses, draws), ...]"""
+    order = "DESC" if desc else "ASC"
+    tiebreak = "wins + losses + draws DESC, wins DESC" if desc else "wins + losses + draws DESC, losses DESC"
+    return await archive_store.query(
+        "SELECT uid, wins, losses, draws FROM rank_archive "
+        "WHERE period_type = ? AND period_key = ? AND wins + losses + draws >= ? "
+        f"ORDER BY (wins * 10000) / (wins + losses + draws) {order}, {tiebreak}, uid LIMIT ?",
+        (period_type, period_key, RANK_RATE_MIN_GAMES, limit),
+    )
@@ -0,0 +1,300 @@
+import datetime
+import hashlib
+import logging
+import time
+
+from config import BACKUP_DB, TZ_BJ
+from core import redis
+from balance import BACKUP_DIRTY_KEY
+from sqlstore import SqliteStore
+
+# ==============================
+# 增量备份：单个 WAL 模式的 SQLite 历史库，每个用户按版本追加变更行，可按任一版本恢复
+# ==============================
+
+BACKUP_BATCH = 500
+# 恢复点保留天数；更早的版本只保留能还原最早保留点所需的行
+BACKUP_RETENTION_DAYS = 7
+# 全量兜底间隔：除了脏集合，也定期扫一遍全部余额，只写与库中最新版本不同的行
+BACKUP_FULL_INTERVAL = 86400
+
+_PROCESSING_KEY = f"{BACKUP_DIRTY_KEY}:processing"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    version  INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts       INTEGER NOT NULL,
+    kind     TEXT NOT NULL,
+    users    INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_history (
+    uid          TEXT NOT NULL,
+    version      INTEGER NOT NULL,
+    balance      REAL NOT NULL,
+    name         TEXT NOT NULL,
+    last_checkin TEXT NOT NULL,
+    streak       INTEGER NOT NULL,
+    PRIMARY KEY (uid, version)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_history_version ON user_history (version);
+"""
+
+# 某版本时刻每个用户的状态 = 版本号不超过它的最新一行
+_STATE_AT_SQL = """
+SELECT h.uid, h.balance, h.name, h.last_checkin, h.streak
+FROM user_history h
+JOIN (SELECT uid, MAX(version) AS v FROM user_history WHERE version <= ? GROUP BY uid) m
+  ON h.uid = m.uid AND h.version = m.v
+"""
+
+# 取出脏集合：并入处理中集合（上次中断的也一并重做），之后的 SADD 落到新的脏集合
+_TAKE_DIRTY_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SUNIONSTORE', KEYS[2], KEYS[2], KEYS[1])
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('SCARD', KEYS[2])
+"""
+
+backup_store = SqliteStore(BACKUP_DB, _SCHEMA)
+_take_dirty_script = redis.register_script(_TAKE_DIRTY_LUA)
+
+
+async def _read_backup_batch(uids: list) -> list:
+    """一批用户一次 pipeline：余额 GET、名字 HMGET、签到 HGETALL"""
+    pipe = redis.pipeline(transaction=False)
+    for uid in uids:
+        pipe.get(f"user_balance:{uid}")
+    pipe.hmget("user_names", uids)
+    for uid in uids:
+        pipe.hgetall(f"user_data:{uid}")
+    res = await pipe.execute()
+    bals, names, datas = res[:len(uids)], res[len(uids)], res[len(uids) + 1:]
+    return [
+        (uid, round(float(bal or 20000.0), 2), name or "未知玩家", u_data.get("last_checkin", ""), int(u_data.get("streak", 0)))
+        for uid, bal, name, u_data in zip(uids, bals, names, datas)
+    ]
+
+
+def _write_changed(conn, version: int, rows: list) -> int:
+    """只写与库中最新版本不同的行，返回写入条数"""
+    placeholders = ",".join("?" * len(rows))
+    latest = {
+        r[0]: r for r in conn.execute(
+            f"SELECT h.uid, h.balance, h.name, h.last_checkin, h.streak FROM user_history h "
+            f"WHERE h.uid IN ({placeholders}) AND h.version = "
+            f"(SELECT MAX(version) FROM user_history WHERE uid = h.uid)",
+            [r[0] for r in rows],
+        )
+    }
+    changed = [(uid, version, bal, name, lc, st) for uid, bal, name, lc, st in rows
+               if latest.get(uid) != (uid, bal, name, lc, st)]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO user_history VALUES (?, ?, ?, ?, ?, ?)", changed)
+    return len(changed)
+
+
+def _begin_snapshot(conn, kind: str) -> tuple:
+    """新建版本，返回 (version, kind)；kind=auto 时按距上次全量的时间决定全量或增量"""
+    last_full = conn.execute("SELECT MAX(ts) FROM snapshots WHERE kind = 'full' AND complete = 1").fetchone()[0]
+    if kind == "auto":
+        kind = "full" if not last_full or time.time() - last_full >= BACKUP_FULL_INTERVAL else "incr"
+    with conn:
+        cur = conn.execute("INSERT INTO snapshots (ts, kind) VALUES (?, ?)", (int(time.time()), kind))
+    return cur.lastrowid, kind
+
+
+def _finish_snapshot(conn, version: int, users: int):
+    with conn:
+        conn.execute("UPDATE snapshots SET users = ?, complete = 1 WHERE version = ?", (users, version))
+
+
+def _prune_history(conn, cutoff_ts: int):
+    """删掉保留期外的恢复点：保证最早保留的版本仍能完整还原"""
+    row = conn.execute("SELECT MIN(version) FROM snapshots WHERE complete = 1 AND ts >= ?", (cutoff_ts,)).fetchone()
+    keep_from = row[0]
+    if keep_from is None:
+        return
+    with conn:
+        conn.execute(
+            "DELETE FROM user_history WHERE version < ? AND EXISTS ("
+            "SELECT 1 FROM user_history h2 WHERE h2.uid = user_history.uid "
+            "AND h2.version > user_history.version AND h2.version <= ?)",
+            (keep_from, keep_from),
+        )
+        conn.execute("DELETE FROM snapshots WHERE version < ?", (keep_from,))
+
+
+async def _backup_uids(version: int, uid_iter) -> tuple:
+    """按批读取并写入，返回 (扫描人数, 写入条数)"""
+    scanned = written = 0
+    batch = []
+    async for uid in uid_iter:
+        batch.append(uid)
+        if len(batch) >= BACKUP_BATCH:
+            written += await backup_store.run(_write_changed, version, await _read_backup_batch(batch))
+            scanned += len(batch)
+            batch = []
+    if batch:
+        written += await backup_store.run(_write_changed, version, await _read_backup_batch(batch))
+        scanned += len(batch)
+    return scanned, written
+
+
+async def _all_uids():
+    async for key in redis.scan_iter("user_balance:*", count=BACKUP_BATCH):
+        yield key.split(":", 1)[1]
+
+
+async def _dirty_uids():
+    async for uid in redis.sscan_iter(_PROCESSING_KEY, count=BACKUP_BATCH):
+        yield uid
+
+
+async def perform_backup(kind: str = "auto") -> int:
+    """整点备份：默认只写脏集合里的用户，距上次全量超过 BACKUP_FULL_INTERVAL 时全量比对一次。返回写入条数"""
+    await _take_dirty_script(keys=[BACKUP_DIRTY_KEY, _PROCESSING_KEY])
+    version, kind = await backup_store.run(_begin_snapshot, kind)
+    scanned, written = await _backup_uids(version, _all_uids() if kind == "full" else _dirty_uids())
+    # 写完才清处理中集合；中途失败下次会连同新脏集合一起重做
+    await redis.delete(_PROCESSING_KEY)
+    await backup_store.run(_finish_snapshot, version, written)
+    cutoff = int(time.time()) - BACKUP_RETENTION_DAYS * 86400
+    await backup_store.run(_prune_history, cutoff)
+    logging.info(f"✅ SQLite {'全量' if kind == 'full' else '增量'}备份完成：版本 {version}，检查 {scanned} 人，写入 {written} 条变更")
+    return written
+
+
+async def list_restore_points(limit: int = 10) -> list:
+    """[(version, ts, kind, users), ...]，新的在前"""
+    return await backup_store.query(
+        "SELECT version, ts, kind, users FROM snapshots WHERE complete = 1 ORDER BY version DESC LIMIT ?", (limit,)
+    )
+
+
+async def get_restore_point(version: int = None) -> tuple | None:
+    """指定版本（或最新）的恢复点信息 (version, ts, kind, users)"""
+    if version is None:
+        rows = await list_restore_points(1)
+    else:
+        rows = await backup_store.query(
+            "SELECT version, ts, kind, users FROM snapshots WHERE complete = 1 AND version = ?", (version,)
+        )
+    return rows[0] if rows else None
+
+
+async def load_restore_point(version: int) -> list:
+    """还原到某版本时刻的全部用户：[(uid, balance, name, last_checkin, streak), ...]，按 uid 排序供归并对比"""
+    return await backup_store.query(_STATE_AT_SQL + " ORDER BY h.uid", (version,))
+
+
+def _canonical(row: tuple, with_checkin: bool) -> str:
+    uid, bal, name, last_checkin, streak = row
+    base = f"{uid}\t{float(bal):.2f}\t{name}"
+    return f"{base}\t{last_checkin}\t{int(streak)}" if with_checkin else base
+
+
+async def restore_users(rows: list, progress=None) -> int:
+    """按批 pipeline 写回，同一 pipeline 把 uid 记入脏集合，下一次增量备份会记录恢复后的余额；
+    progress(done, total) 每批回调一次"""
+    total = len(rows)
+    for i in range(0, total, BACKUP_BATCH):
+        batch = rows[i:i + BACKUP_BATCH]
+        pipe = redis.pipeline(transaction=False)
+        for uid, bal, name, last_checkin, streak in batch:
+            pipe.set(f"user_balance:{uid}", bal)
+            if last_checkin or streak:
+                pipe.hset(f"user_data:{uid}", mapping={"last_checkin": last_checkin, "streak": str(streak)})
+        pipe.hset("user_names", mapping={uid: name for uid, _, name, _, _ in batch})
+        pipe.sadd(BACKUP_DIRTY_KEY, *[uid for uid, *_ in batch])
+        await pipe.execute()
+        if progress:
+            await progress(min(i + BACKUP_BATCH, total), total)
+    return total
+
+
+async def verify_restore(rows: list) -> tuple:
+    """写回后逐批读回比对，返回 (是否一致, 期望校验和, 实际校验和, 不一致的 uid 列表前 10 个)
+
+    签到字段只在备份里有值时才参与比对（恢复时没有值就不会写）
+    """
+    expected, actual = hashlib.sha256(), hashlib.sha256()
+    mismatched = []
+    for i in range(0, len(rows), BACKUP_BATCH):
+        batch = rows[i:i + BACKUP_BATCH]
+        live = await _read_backup_batch([r[0] for r in batch])
+        for want, got in zip(batch, live):
+            with_checkin = bool(want[3] or want[4])
+            a, b = _canonical(want, with_checkin), _canonical(got, with_checkin)
+            expected.update(a.encode() + b"\n")
+            actual.update(b.encode() + b"\n")
+            if a != b and len(mismatched) < 10:
+                mismatched.append(want[0])
+    e, a = expected.hexdigest(), actual.hexdigest()
+    return e == a, e, a, mismatched
+
+
+def merge_restore_uids(backup_rows: list, live_uids: list):
+    """两个按 uid 有序的序列归并，依次产出 ("create", 备份行) / ("keep", uid) / ("both", 备份行)"""
+    i = j = 0
+    while i < len(backup_rows) or j < len(live_uids):
+        if j >= len(live_uids) or (i < len(backup_rows) and backup_rows[i][0] < live_uids[j]):
+            yield "create", backup_rows[i]
+            i += 1
+        elif i >= len(backup_rows) or live_uids[j] < backup_rows[i][0]:
+            yield "keep", live_uids[j]
+            j += 1
+        else:
+            yield "both", backup_rows[i]
+            i += 1
+            j += 1
+
+
+async def diff_restore_point(version: int) -> dict:
+    """预演：备份与线上做有序归并对比，不写 Redis
+
+    返回 新增（仅备份有）/ 保留（仅线上有，恢复不会动）/ 覆盖 / 相同 的人数、余额净变化和变化最大的几位
+    """
+    backup_rows = await load_restore_point(version)
+    live_uids = sorted([key.split(":", 1)[1] async for key in redis.scan_iter("user_balance:*", count=BACKUP_BATCH)])
+    result = {"create": 0, "keep": 0, "changed": 0, "same": 0, "delta": 0.0, "top": []}
+
+    # 两个有序序列归并；同时出现的 uid 攒批读线上值
+    pending = []
+
+    async def compare(pending_rows):
+        live = await _read_backup_batch([r[0] for r in pending_rows])
+        for want, got in zip(pending_rows, live):
+            with_checkin = bool(want[3] or want[4])
+            if _canonical(want, with_checkin) == _canonical(got, with_checkin):
+                result["same"] += 1
+                continue
+            result["changed"] += 1
+            delta = round(float(want[1]) - got[1], 2)
+            result["delta"] += delta
+            result["top"].append((abs(delta), want[0], got[1], float(want[1])))
+
+    for kind, row in merge_restore_uids(backup_rows, live_uids):
+        if kind == "create":
+            result["create"] += 1
+            result["delta"] += float(row[1])
+        elif kind == "keep":
+            result["keep"] += 1
+        else:
+            pending.append(row)
+            if len(pending) >= BACKUP_BATCH:
+                await compare(pending)
+                pending = []
+    if pending:
+        await compare(pending)
+
+    result["top"] = [row[1:] for row in sorted(result["top"], reverse=True)[:5]]
+    result["delta"] = round(result["delta"], 2)
+    return result
+
+
+def format_restore_point(point: tuple) -> str:
+    version, ts, kind, users = point
+    t = datetime.datetime.fromtimestamp(ts, TZ_BJ).strftime("%Y-%m-%d %H:%M")
+    return f"#{version} {t} {'全量' if kind == 'full' else '增量'}（{users} 条变更）"
@@ -1,13 +1,21 @@
 import datetime
+import json
 
 from config import TZ_BJ
 from core import redis
 
 
+# 余额变动的用户记入此集合，整点备份只写这些人（Lua 里直接改余额的脚本同样要 SADD）
+BACKUP_DIRTY_KEY = "backup_dirty"
+
+
 async def get_or_init_balance(uid: str) -> float:
     key = f"user_balance:{uid}"
     if not await redis.exists(key):
-        await redis.set(key, 20000.0)
+        pipe = redis.pipeline(transaction=False)
+        pipe.set(key, 20000.0)
+        pipe.sadd(BACKUP_DIRTY_KEY, uid)
+        await pipe.execute()
         return 20000.0
     return round(float(await redis.get(key)), 2)
 
@@ -16,7 +24,10 @@ async def update_balance(uid: str, amount: float) -> float:
     if amount == 0:
         return await get_or_init_balance(uid)
     await get_or_init_balance(uid)
-    val = await redis.incrbyfloat(f"user_balance:{uid}", round(amount, 2))
+    pipe = redis.pipeline(transaction=False)
+    pipe.incrbyfloat(f"user_balance:{uid}", round(amount, 2))
+    pipe.sadd(BACKUP_DIRTY_KEY, uid)
+    val, _ = await pipe.execute()
     return round(val, 2)
 
 
@@ -25,6 +36,372 @@ def get_period_keys():
     return now.strftime("%Y%m%d"), now.strftime("%Y-%W"), now.strftime("%Y%m")
 
 
+# ==============================
+# 排行榜：结算写当天 key 与周/月的积分、胜率索引；周/月榜由「已收盘视图 + 当天 key」查询时合并
+# ==============================
+
+RANK_METRICS = ("points", "gross_wins", "gross_losses", "wins", "losses", "draws")
+# 日榜保留策略：日榜 key 保留 35 天，任意区间榜只能查这个窗口内的日期；更早的榜单走 SQLite 归档（archive.py）
+RANK_DAILY_RETENTION_DAYS = 35
+RANK_TTL = 86400 * RANK_DAILY_RETENTION_DAYS
+RANK_VIEW_TTL = 300
+# 周/月已收盘视图只随收盘（rank_fold_gen）和日期变化，可以留久一些
+RANK_CLOSED_VIEW_TTL = 3600
+# 回看窗口不能超过日榜保留期，否则汇总标记过期后会拿空日榜重复汇总
+RANK_FOLD_LOOKBACK = 33
+RANK_RATE_MIN_GAMES = 3
+
+# 周期格式与 get_period_keys 一一对应
+_PERIOD_FMT = {"daily": "%Y%m%d", "weekly": "%Y-%W", "monthly": "%Y%m"}
+
+# 胜率复合分：胜率（万分位）> 总局数 > 胜场/负场，score 越小越靠前，同分按 uid 升序
+# 用 string.format('%.0f') 传分值，避免 Lua 默认 14 位有效数字截断
+# rate_upsert 约定 KEYS[1..5] = wins, losses, draws, rate_top, rate_low
+_RATE_FN_LUA = """
+local function rate_set(top, low, uid, w, l, d, min_games)
+    local total = w + l + d
+    if total < min_games then
+        redis.call('ZREM', top, uid)
+        redis.call('ZREM', low, uid)
+        return 0
+    end
+    local bp = math.floor(w * 10000 / total)
+    redis.call('ZADD', top, string.format('%.0f', -(bp * 1e10 + total * 1e5 + w)), uid)
+    redis.call('ZADD', low, string.format('%.0f', bp * 1e10 + (99999 - total) * 1e5 + (99999 - l)), uid)
+    return 1
+end
+
+local function rate_upsert(uid, min_games)
+    local w = tonumber(redis.call('ZSCORE', KEYS[1], uid) or '0')
+    local l = tonumber(redis.call('ZSCORE', KEYS[2], uid) or '0')
+    local d = tonumber(redis.call('ZSCORE', KEYS[3], uid) or '0')
+    return rate_set(KEYS[4], KEYS[5], uid, w, l, d, min_games)
+end
+"""
+
+# 单个玩家结算：当天按日榜计数，周/月按 user_stats 里已累加好的胜负平（须在 record_user_rollup 之后调用）
+# KEYS[1..5] = 当天 wins, losses, draws, rate_top, rate_low；KEYS[6] = user_stats；
+# KEYS[7..8] / KEYS[9..10] = 周 / 月的 rate_top, rate_low；ARGV = uid, 最少局数, TTL, 周 key, 月 key
+_WIN_RATE_LUA = _RATE_FN_LUA + """
+rate_upsert(ARGV[1], tonumber(ARGV[2]))
+redis.call('EXPIRE', KEYS[4], ARGV[3])
+redis.call('EXPIRE', KEYS[5], ARGV[3])
+local periods = {{'week', ARGV[4], 7}, {'month', ARGV[5], 9}}
+for _, p in ipairs(periods) do
+    local name, i = p[1], p[3]
+    if redis.call('HGET', KEYS[6], name) == p[2] then
+        local s = redis.call('HMGET', KEYS[6], name .. '_w', name .. '_l', name .. '_d')
+        rate_set(KEYS[i], KEYS[i + 1], ARGV[1], tonumber(s[1] or '0'), tonumber(s[2] or '0'),
+                 tonumber(s[3] or '0'), tonumber(ARGV[2]))
+        redis.call('EXPIRE', KEYS[i], ARGV[3])
+        redis.call('EXPIRE', KEYS[i + 1], ARGV[3])
+    end
+end
+return 1
+"""
+
+# 整个集合重建（区间视图、启动补建当天索引）：ARGV = 最少局数, TTL
+_WIN_RATE_ALL_LUA = _RATE_FN_LUA + """
+redis.call('DEL', KEYS[4], KEYS[5])
+local seen = {}
+for k = 1, 3 do
+    for _, uid in ipairs(redis.call('ZRANGE', KEYS[k], 0, -1)) do
+        if not seen[uid] then
+            seen[uid] = true
+            rate_upsert(uid, tonumber(ARGV[1]))
+        end
+    end
+end
+redis.call('EXPIRE', KEYS[4], ARGV[2])
+redis.call('EXPIRE', KEYS[5], ARGV[2])
+return 1
+"""
+
+# 收盘汇总：标记位抢到才执行，把某一天各指标并入所属周/月的汇总 key，重复调用不会重复累加
+# KEYS[1] = 标记位，之后每 2 个为 (汇总 key, 当天 key)；ARGV = TTL
+_FOLD_LUA = """
+if not redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return 0
+end
+for i = 2, #KEYS, 2 do
+    redis.call('ZUNIONSTORE', KEYS[i], 2, KEYS[i], KEYS[i + 1])
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return 1
+"""
+
+# 个人汇总：user_stats:{uid} 按日/周/月记录盈亏（分）与胜负平，周期 key 变了先清零；同时维护真实连胜/连败
+# KEYS = user_stats, user_recent；ARGV = 盈亏（分）, 日 key, 周 key, 月 key, 对局摘要 JSON, 保留局数, TTL
+_USER_ROLLUP_LUA = """
+local cents = tonumber(ARGV[1])
+local res = 'd'
+if cents > 0 then res = 'w' elseif cents < 0 then res = 'l' end
+local periods = {{'day', ARGV[2]}, {'week', ARGV[3]}, {'month', ARGV[4]}}
+for _, p in ipairs(periods) do
+    local name, key = p[1], p[2]
+    if redis.call('HGET', KEYS[1], name) ~= key then
+        redis.call('HSET', KEYS[1], name, key, name .. '_cents', 0, name .. '_w', 0, name .. '_l', 0, name .. '_d', 0)
+    end
+    redis.call('HINCRBY', KEYS[1], name .. '_cents', cents)
+    redis.call('HINCRBY', KEYS[1], name .. '_' .. res, 1)
+end
+local streak = tonumber(redis.call('HGET', KEYS[1], 'streak') or '0')
+if cents > 0 then
+    if streak > 0 then streak = streak + 1 else streak = 1 end
+elseif cents < 0 then
+    if streak < 0 then streak = streak - 1 else streak = -1 end
+else
+    streak = 0
+end
+redis.call('HSET', KEYS[1], 'streak', streak)
+if streak > tonumber(redis.call('HGET', KEYS[1], 'best_streak') or '0') then
+    redis.call('HSET', KEYS[1], 'best_streak', streak)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+redis.call('LPUSH', KEYS[2], ARGV[5])
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[6]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[7])
+return streak
+"""
+
+_win_rate_script = redis.register_script(_WIN_RATE_LUA)
+_win_rate_all_script = redis.register_script(_WIN_RATE_ALL_LUA)
+_fold_script = redis.register_script(_FOLD_LUA)
+_user_rollup_script = redis.register_script(_USER_ROLLUP_LUA)
+
+USER_RECENT_GAMES = 10
+
+
+def rank_key(metric: str, base: str) -> str:
+    """base 形如 daily:20260101 / live:weekly:2026-01 / view:weekly:2026-01 / weekly_closed:2026-01"""
+    return f"rank_{metric}:{base}"
+
+
+def live_base(prefix: str, period_key: str) -> str:
+    """结算时直接维护的周/月 key：积分（/dice_me 排名）与胜率索引"""
+    return f"live:{prefix}:{period_key}"
+
+
+def _win_rate_keys(base: str) -> list:
+    return [rank_key("wins", base), rank_key("losses", base), rank_key("draws", base),
+            f"rank_rate_top:{base}", f"rank_rate_low:{base}"]
+
+
+async def record_rank_result(uid: str, profit: float):
+    """结算写榜：当天各指标 + 周/月积分一次 pipeline，随后刷新当天与周/月胜率索引
+
+    周/月胜率取自 user_stats，须在 record_user_rollup 之后调用
+    """
+    daily_k, weekly_k, monthly_k = get_period_keys()
+    base = f"daily:{daily_k}"
+    pipe = redis.pipeline(transaction=False)
+    pipe.zincrby(rank_key("points", base), profit, uid)
+    if profit > 0:
+        pipe.zincrby(rank_key("gross_wins", base), profit, uid)
+        pipe.zincrby(rank_key("wins", base), 1, uid)
+    elif profit < 0:
+        pipe.zincrby(rank_key("gross_losses", base), abs(profit), uid)
+        pipe.zincrby(rank_key("losses", base), 1, uid)
+    else:
+        pipe.zincrby(rank_key("draws", base), 1, uid)
+    for metric in RANK_METRICS:
+        pipe.expire(rank_key(metric, base), RANK_TTL)
+    for prefix, key in (("weekly", weekly_k), ("monthly", monthly_k)):
+        pipe.zincrby(rank_key("points", live_base(prefix, key)), profit, uid)
+        pipe.expire(rank_key("points", live_base(prefix, key)), RANK_TTL)
+    await pipe.execute()
+    keys = _win_rate_keys(base) + [f"user_stats:{uid}"]
+    keys += _win_rate_keys(live_base("weekly", weekly_k))[3:] + _win_rate_keys(live_base("monthly", monthly_k))[3:]
+    await _win_rate_script(keys=keys, args=[uid, RANK_RATE_MIN_GAMES, RANK_TTL, weekly_k, monthly_k])
+
+
+async def record_user_rollup(uid: str, profit_cents: int, summary: dict):
+    """结算写个人汇总与最近对局，/dice_me 只读这两个 key，不扫描榜单"""
+    daily_k, weekly_k, monthly_k = get_period_keys()
+    await _user_rollup_script(
+        keys=[f"user_stats:{uid}", f"user_recent:{uid}"],
+        args=[profit_cents, daily_k, weekly_k, monthly_k,
+              json.dumps(summary, ensure_ascii=False), USER_RECENT_GAMES, RANK_TTL],
+    )
+
+
+def period_days(prefix: str, period_key: str, today: datetime.date = None) -> list:
+    """当前周期内截至今天的所有日期（YYYYmmdd），按时间倒序"""
+    today = today or datetime.datetime.now(TZ_BJ).date()
+    days = []
+    d = today
+    while d.strftime(_PERIOD_FMT[prefix]) == period_key and len(days) < 31:
+        days.append(d.strftime("%Y%m%d"))
+        d -= datetime.timedelta(days=1)
+    return days
+
+
+def parse_rank_day(text: str) -> datetime.date | None:
+    """解析 20260101 / 2026-01-01 / 2026.01.01"""
+    digits = text.replace("-", "").replace(".", "").replace("/", "")
+    try:
+        return datetime.datetime.strptime(digits, "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def range_period_key(start: datetime.date, end: datetime.date) -> str:
+    return f"{start.strftime('%Y%m%d')}-{end.strftime('%Y%m%d')}"
+
+
+def range_days(period_key: str) -> list:
+    start_s, end_s = period_key.split("-")
+    start = datetime.datetime.strptime(start_s, "%Y%m%d").date()
+    end = datetime.datetime.strptime(end_s, "%Y%m%d").date()
+    return [(start + datetime.timedelta(days=i)).strftime("%Y%m%d") for i in range((end - start).days + 1)]
+
+
+def range_is_closed(period_key: str) -> bool:
+    """区间已全部收盘（不含今天）：日榜不会再变，视图与渲染缓存不必跟随 rank_gen"""
+    return period_key.split("-")[1] < get_period_keys()[0]
+
+
+def _fold_marker(prefix: str, day: str) -> str:
+    return f"rank_folded:{prefix}:{day}"
+
+
+async def fold_closed_rank_days() -> int:
+    """把最近 RANK_FOLD_LOOKBACK 天内已收盘、尚未汇总的日榜并入周/月汇总；幂等，可随时补跑"""
+    today = datetime.datetime.now(TZ_BJ).date()
+    folded = 0
+    for offset in range(1, RANK_FOLD_LOOKBACK + 1):
+        d = today - datetime.timedelta(days=offset)
+        day = d.strftime("%Y%m%d")
+        for prefix in ("weekly", "monthly"):
+            closed_base = f"{prefix}_closed:{d.strftime(_PERIOD_FMT[prefix])}"
+            keys = [_fold_marker(prefix, day)]
+            for metric in RANK_METRICS:
+                keys += [rank_key(metric, closed_base), rank_key(metric, f"daily:{day}")]
+            folded += int(await _fold_script(keys=keys, args=[RANK_TTL]))
+    if folded:
+        # 汇总变了，周/月已收盘视图随之失效；合并后的总数不变，榜单渲染缓存不必失效
+        await redis.incr("rank_fold_gen")
+    return folded
+
+
+async def ensure_rank_view(prefix: str, period_key: str) -> str:
+    """返回可直接读取的 base：日榜就是当天 key；周/月为已收盘部分的视图；区间榜为整段视图
+
+    周/月视图 = 收盘汇总 + 本周期内未汇总的往日，不含今天，按（rank_fold_gen, 日期）失效，
+    结算不会让它重建；今天的数据由 rank_sources / merged_top 查询时合并。
+    区间榜 period_key 形如 20260101-20260115，直接由日榜并集得到；已收盘的区间不随 rank_gen 失效
+    """
+    if prefix == "daily":
+        return f"daily:{period_key}"
+    base = f"view:{prefix}:{period_key}"
+    today = get_period_keys()[0]
+    if prefix != "range":
+        gen, built = await redis.mget("rank_fold_gen", f"rank_view_gen:{base}")
+        gen, ttl = f"{gen or '0'}:{today}", RANK_CLOSED_VIEW_TTL
+    elif range_is_closed(period_key):
+        gen, built, ttl = "static", await redis.get(f"rank_view_gen:{base}"), RANK_VIEW_TTL
+    else:
+        gen, built = await redis.mget("rank_gen", f"rank_view_gen:{base}")
+        gen, ttl = gen or "0", RANK_VIEW_TTL
+    if built == gen:
+        return base
+
+    if prefix == "range":
+        closed_sources, days = [], range_days(period_key)
+    else:
+        closed_sources = [f"{prefix}_closed:{period_key}"]
+        days = [day for day in period_days(prefix, period_key) if day != today]
+        pipe = redis.pipeline(transaction=False)
+        for day in days:
+            pipe.exists(_fold_marker(prefix, day))
+        days = [day for day, done in zip(days, await pipe.execute()) if not done]
+
+    pipe = redis.pipeline(transaction=False)
+    for metric in RANK_METRICS:
+        sources = [rank_key(metric, b) for b in closed_sources] + [rank_key(metric, f"daily:{d}") for d in days]
+        pipe.zunionstore(rank_key(metric, base), sources)
+        pipe.expire(rank_key(metric, base), ttl)
+    await pipe.execute()
+    if prefix == "range":
+        # 周/月胜率索引结算时已维护（live:*），只有区间榜需要整段重建
+        await _win_rate_all_script(keys=_win_rate_keys(base), args=[RANK_RATE_MIN_GAMES, ttl])
+    await redis.set(f"rank_view_gen:{base}", gen, ex=ttl)
+    return base
+
+
+async def rank_sources(prefix: str, period_key: str) -> list:
+    """各指标相加即为整个周期的 base 列表：周/月为 [已收盘视图, 今天]，其余只有一个"""
+    base = await ensure_rank_view(prefix, period_key)
+    today = get_period_keys()[0]
+    if prefix in ("weekly", "monthly") and today in period_days(prefix, period_key):
+        return [base, f"daily:{today}"]
+    return [base]
+
+
+def rate_base(prefix: str, period_key: str) -> str:
+    """胜率索引所在的 base；周/月用结算时维护的 live key（ensure_rank_view 之后调用）"""
+    if prefix in ("weekly", "monthly"):
+        return live_base(prefix, period_key)
+    return f"daily:{period_key}" if prefix == "daily" else f"view:{prefix}:{period_key}"
+
+
+async def merged_top(metric: str, sources: list, k: int, desc: bool = True) -> list:
+    """多个 base 同一指标相加后的前 k 名 [(uid, score)]
+
+    sources[0] 可以很大，其余（今天）只含当天玩过的人：不在其中的人总分就是 sources[0] 的分数，
+    所以 sources[0] 只需取前 k + 当天人数 名，结果是精确的
+    """
+    read = redis.zrevrange if desc else redis.zrange
+    if len(sources) == 1:
+        return await read(rank_key(metric, sources[0]), 0, k - 1, withscores=True)
+    extra = {}
+    for base in sources[1:]:
+        for uid, score in await redis.zrange(rank_key(metric, base), 0, -1, withscores=True):
+            extra[uid] = extra.get(uid, 0) + score
+    big = rank_key(metric, sources[0])
+    merged = dict(await read(big, 0, k + len(extra) - 1, withscores=True))
+    if extra:
+        pipe = redis.pipeline(transaction=False)
+        for uid in extra:
+            pipe.zscore(big, uid)
+        for (uid, score), base_score in zip(extra.items(), await pipe.execute()):
+            merged[uid] = float(base_score or 0) + score
+    return sorted(merged.items(), key=lambda x: x[1], reverse=desc)[:k]
+
+
+async def rate_counts(prefix: str, period_key: str, uids: list) -> dict:
+    """胜率榜上玩家的 (胜, 负, 平)，与胜率索引同源：周/月读 user_stats，其余读日榜 / 区间视图"""
+    pipe = redis.pipeline(transaction=False)
+    if prefix in ("weekly", "monthly"):
+        field = "week" if prefix == "weekly" else "month"
+        for uid in uids:
+            pipe.hmget(f"user_stats:{uid}", field, f"{field}_w", f"{field}_l", f"{field}_d")
+        rows = [r[1:] if r[0] == period_key else (0, 0, 0) for r in await pipe.execute()]
+    else:
+        wins, losses, draws = _win_rate_keys(rate_base(prefix, period_key))[:3]
+        for uid in uids:
+            pipe.zscore(wins, uid)
+            pipe.zscore(losses, uid)
+            pipe.zscore(draws, uid)
+        scores = await pipe.execute()
+        rows = [scores[3 * i:3 * i + 3] for i in range(len(uids))]
+    return {uid: tuple(int(float(x or 0)) for x in row) for uid, row in zip(uids, rows)}
+
+
+async def rebuild_win_rate_index():
+    """启动时为当天补建胜率索引、为本周/本月补建积分 key（兼容升级前已有的战绩），已建过的跳过"""
+    daily_k, weekly_k, monthly_k = get_period_keys()
+    keys = _win_rate_keys(f"daily:{daily_k}")
+    if not await redis.exists(keys[3], keys[4]):
+        await _win_rate_all_script(keys=keys, args=[RANK_RATE_MIN_GAMES, RANK_TTL])
+    for prefix, key in (("weekly", weekly_k), ("monthly", monthly_k)):
+        live = rank_key("points", live_base(prefix, key))
+        if await redis.exists(live):
+            continue
+        await redis.zunionstore(live, [rank_key("points", b) for b in await rank_sources(prefix, key)])
+        await redis.expire(live, RANK_TTL)
+
+
 async def release_user_locks(players: list):
     if not players:
         return
@@ -0,0 +1,87 @@
+"""红包雨抢领吞吐压测（只依赖本地 Redis，不连 Telegram）
+
+用法：
+    python bench_rain.py --users 5000 --shares 3000 --concurrency 200
+
+默认连 127.0.0.1:6379 的 db 15，压测结束清理所有生成的 key；不要指向生产库。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+os.environ.setdefault("REDIS_DB", "15")
+os.environ.setdefault("BOT_TOKEN", "1:bench")
+os.environ.setdefault("BOT_ID", "1")
+os.environ.setdefault("SUPER_ADMIN_ID", "1")
+os.environ.setdefault("ADMIN_IDS", "1")
+
+from core import redis  # noqa: E402
+from rain import (seed_rain_wave, claim_rain, flush_rain_credits, rain_key,  # noqa: E402
+                  rain_credit_key, rain_board_key, rain_names_key, rain_wave_keys)
+
+
+async def run(users: int, shares: int, amount: float, concurrency: int):
+    rain_id = f"bench{int(time.time())}"
+    await redis.hset(rain_key(rain_id), mapping={"claimed": "0", "claimed_cents": "0"})
+    rp_id = await seed_rain_wave(rain_id, 0, int(round(amount * 100)), shares, ttl=600)
+
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    results = {}
+
+    async def one(i: int):
+        uid = f"bench_{rain_id}_{i}"
+        async with sem:
+            t0 = time.perf_counter()
+            status, _ = await claim_rain(rain_id, rp_id, uid, f"u{i}")
+            latencies.append(time.perf_counter() - t0)
+        results[status] = results.get(status, 0) + 1
+
+    # 每个用户连点两次，验证去重
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i % users) for i in range(users * 2)))
+    elapsed = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    credited = await flush_rain_credits(rain_id)
+    flush_elapsed = time.perf_counter() - t1
+
+    claimed_amount = int(await redis.hget(rain_key(rain_id), "claimed_cents")) / 100
+    uids = [f"bench_{rain_id}_{i}" for i in range(users)]
+    balances = await redis.mget([f"user_balance:{u}" for u in uids])
+    paid = sum(float(b) - 20000 for b in balances if b is not None)
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"请求 {total} 次，耗时 {elapsed:.2f}s，吞吐 {total / elapsed:.0f} 次/秒（{total / elapsed * 60:.0f} 次/分钟）")
+    print(f"延迟 p50={statistics.median(latencies) * 1000:.2f}ms p99={latencies[int(total * 0.99) - 1] * 1000:.2f}ms")
+    print(f"结果分布 {results}")
+    print(f"批量入账 {credited} 人，耗时 {flush_elapsed * 1000:.0f}ms")
+    ok = results.get("ok", 0) == min(users, shares) and abs(paid - claimed_amount) < 0.01
+    print(f"校验：领取 {results.get('ok', 0)} 份，入账 {paid:.2f}，统计 {claimed_amount:.2f} -> {'通过' if ok else '失败'}")
+
+    keys = [rain_key(rain_id), rain_credit_key(rain_id), rain_board_key(rain_id), rain_names_key(rain_id)]
+    keys += rain_wave_keys(rp_id)
+    keys += [f"user_balance:{u}" for u in uids]
+    for j in range(0, len(keys), 500):
+        await redis.delete(*keys[j:j + 500])
+    await redis.aclose()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="红包雨抢领吞吐压测")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--shares", type=int, default=3000)
+    parser.add_argument("--amount", type=float, default=100000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.users, args.shares, args.amount, args.concurrency))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import time
 from aiogram import F, Router
 from aiogram.filters import Command
 from aiohttp import web
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 
 from config import (
     LAST_FIX_DESC,
@@ -19,15 +19,25 @@ from config import (
     WEBHOOK_HOST,
     WEBHOOK_PORT,
     WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_STATS_PATH,
 )
 from core import bot, dp, redis, CleanTextFilter
 from utils import delete_msgs, delete_msg_by_id, pin_in_topic
-from balance import update_balance
-from tasks import daily_backup_task, daily_report_task, noon_event_task, weekly_help_task
-from redpack import redpack_expiry_watcher, attempt_claim_pw_redpack, refresh_dice_panel
+from balance import update_balance, rebuild_win_rate_index
+import tasks  # noqa: F401  注册定时任务
+from scheduler import scheduler_task
+from leader import leader_lease_task, release_leadership
+from broadcast import broadcast_resume_task
+from dispatch import QueuedRequestHandler
+from ingress import ALLOWED_UPDATES, IngressMiddleware, IngressFilter, classify_update
+from redpack import (redpack_expiry_ticker, attempt_claim_pw_redpack, cancel_redpack_expiry,
+                     unregister_pw_redpack, rebuild_pw_indexes, pw_index_key, forget_dice_panel,
+                     drain_redpack, pw_hints_listener)
+from rain import recover_rain_credits, rain_ticker
+from history import history_writer_task, flush_game_history
 from game_settle import process_dice_value
 from game import refund_game
-from handlers import router as handlers_router, TopicRestrictionMiddleware
+from handlers import router as handlers_router, TopicRestrictionMiddleware, in_maintenance
 
 # ==============================
 # ⏬ 绝对兜底的全局黑洞 ⏬
@@ -36,6 +46,8 @@ from handlers import router as handlers_router, TopicRestrictionMiddleware
 blackhole_router = Router()
 blackhole_router.message.middleware(TopicRestrictionMiddleware(silent=True))
 blackhole_router.callback_query.middleware(TopicRestrictionMiddleware(silent=True))
+# 不挂 MaintenanceMiddleware：/dice_maintain、/dice_compensate 必须在维护期可用，
+# 口令红包与手动骰子在各自 handler 里检查维护标记
 
 
 async def _compensation_cleanup(chat_id: int, msg_id: int, delay: float, redis_key: str):
@@ -113,8 +125,7 @@ async def handle_maintain_cmd(message):
         if not meta:
             await redis.srem("active_pw_rps", rp_id)
             continue
-        amounts = await redis.lrange(f"redpack_list:{rp_id}", 0, -1)
-        total = sum(float(a) for a in amounts)
+        total = round(await drain_redpack(rp_id) / 100, 2)
         if total > 0 and (sid := meta.get("sender_uid")):
             await update_balance(sid, total)
         cid_rp = meta.get("chat_id", "")
@@ -123,11 +134,13 @@ async def handle_maintain_cmd(message):
             affected_rp_chats.add(cid_rp)
         if cid_rp and mid_rp and int(mid_rp) > 0:
             asyncio.create_task(delete_msg_by_id(int(cid_rp), int(mid_rp)))
-        await redis.delete(f"redpack_meta:{rp_id}", f"redpack_list:{rp_id}")
-        await redis.srem("active_pw_rps", rp_id)
+        await redis.delete(f"redpack_meta:{rp_id}", f"redpack_users:{rp_id}")
+        await unregister_pw_redpack(cid_rp, meta.get("pw", ""), rp_id)
+        await cancel_redpack_expiry(rp_id)
         rp_refunded += 1
     # 4. 清理骰子聚合面板
     for cid_dc in affected_rp_chats:
+        forget_dice_panel(cid_dc)
         panel = await redis.get(f"dice_panel_msg:{cid_dc}")
         if panel:
             try:
@@ -235,16 +248,12 @@ async def handle_compensate_cmd(message):
     asyncio.create_task(_compensation_cleanup(message.chat.id, announce.message_id, 1800, f"compensation_pin:{message.chat.id}"))
 
 
-@blackhole_router.message(CleanTextFilter(), F.text)
+@blackhole_router.message(CleanTextFilter(), F.text, IngressFilter("pw"))
 async def handle_pw_redpack_text(message):
     text = message.text.strip()
-    if not text:
+    if not text or await in_maintenance(message.chat.id):
         return
-
-    active_rps = await redis.smembers("active_pw_rps")
-    if not active_rps:
-        return
-    await attempt_claim_pw_redpack(message, text, str(message.from_user.id), list(active_rps))
+    await attempt_claim_pw_redpack(message, text, str(message.from_user.id))
 
 
 @blackhole_router.message(CleanTextFilter(), F.dice)
@@ -253,15 +262,13 @@ async def handle_manual_dice(message):
         return
     uid = str(message.from_user.id)
     chat_id = message.chat.id
+    if await in_maintenance(chat_id):
+        return
 
     active_games = await redis.smembers(f"chat_games:{chat_id}")
-    active_rps = await redis.smembers("active_pw_rps")
-    claimed = False
-
-    if active_rps:
-        claimed = await attempt_claim_pw_redpack(message, message.dice.emoji, uid, list(active_rps))
-        if claimed:
-            return
+    claimed = await attempt_claim_pw_redpack(message, message.dice.emoji, uid)
+    if claimed:
+        return
 
     if not active_games:
         return
@@ -284,31 +291,38 @@ async def handle_manual_dice(message):
 
 async def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    # 入口分类在所有 router 中间件之前执行：闲聊直接丢弃，零 Redis 调用
+    dp.update.outer_middleware(IngressMiddleware())
     # 精确 handler 先注册，黑洞兜底最后
     dp.include_router(handlers_router)
     dp.include_router(blackhole_router)
-    asyncio.create_task(daily_backup_task())
-    asyncio.create_task(daily_report_task())
-    asyncio.create_task(noon_event_task())
-    asyncio.create_task(weekly_help_task())
-
-    # ── 重启恢复：清理残留骰子面板 + 重启活跃红包 watcher ──
+    # 定时任务只在持有 Redis 租约的主节点执行，多副本不会重复发奖/播报
+    asyncio.create_task(leader_lease_task())
+    # 红包过期统一由 ticker 按 rp_expiry 驱动，重启后自动接续，无需重建 watcher
+    asyncio.create_task(redpack_expiry_ticker())
+    # 红包雨波次、入账与面板刷新由 ticker 按 rain_schedule 驱动，重启后同样自动接续
+    asyncio.create_task(rain_ticker())
+    # 进程内口令表：订阅其他实例的口令增删，入口分类器据此零 Redis 丢弃闲聊
+    asyncio.create_task(pw_hints_listener())
+    # 备份/收盘/战报/彩蛋/每周帮助统一由调度器按定时堆触发，错过的按各自策略补跑
+    asyncio.create_task(scheduler_task())
+    asyncio.create_task(history_writer_task())
+    asyncio.create_task(broadcast_resume_task())
+
+    # ── 重启恢复：重建口令索引 + 清理残留骰子面板（红包过期由 ticker 自动接续）──
     try:
+        # 0. 重建按群口令索引（兼容升级前发出的红包）
+        await rebuild_pw_indexes()
+        # 补建当前周期胜率索引（兼容升级前的战绩）
+        await rebuild_win_rate_index()
+        # 补发上次进程未入账的红包雨积分
+        await recover_rain_credits()
+
         # 1. 扫描所有群，清理重启前留下的骰子面板消息
         group_ids = await redis.smembers("active_groups")
-        active_rps = await redis.smembers("active_pw_rps")
-        active_dice_chats = set()
-        dice_rp_per_chat = {}
-        for rp_id in active_rps:
-            meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-            if meta and meta.get("pw") == "🎲" and meta.get("suspended") != "1":
-                cid_str = meta.get("chat_id", "")
-                if cid_str:
-                    active_dice_chats.add(cid_str)
-                    dice_rp_per_chat[cid_str] = dice_rp_per_chat.get(cid_str, 0) + 1
         for cid in group_ids:
             panel_msg_id = await redis.get(f"dice_panel_msg:{cid}")
-            if panel_msg_id and dice_rp_per_chat.get(cid, 0) < 2:
+            if panel_msg_id and await redis.scard(pw_index_key(cid, "🎲")) < 2:
                 try:
                     await bot.delete_message(int(cid), int(panel_msg_id))
                 except Exception:
@@ -316,22 +330,6 @@ async def main():
                 await redis.delete(f"dice_panel_msg:{cid}")
                 logging.info(f"[startup] 清理残留骰子面板 chat={cid} msg={panel_msg_id}")
 
-        # 2. 重启活跃红包的 expiry watcher（普通口令/拼手气）
-        for rp_id in active_rps:
-            meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-            if not meta:
-                await redis.srem("active_pw_rps", rp_id)
-                continue
-            epoch = meta.get("created_at", "")
-            chat_id_str = meta.get("chat_id", "")
-            msg_id_str = meta.get("msg_id", "0")
-            is_pw = "pw" in meta
-            if not chat_id_str or not epoch:
-                continue
-            asyncio.create_task(redpack_expiry_watcher(
-                int(chat_id_str), int(msg_id_str), rp_id, is_pw, epoch
-            ))
-            logging.info(f"[startup] 重启红包 watcher rp_id={rp_id}")
     except Exception as e:
         logging.warning(f"[startup] 重启恢复异常: {e}")
 
@@ -373,6 +371,9 @@ async def main():
     base_commands = [
         tg_types.BotCommand(command="dice_checkin", description="每日签到"),
         tg_types.BotCommand(command="dice_bal", description="查询余额"),
+        tg_types.BotCommand(command="dice_me", description="个人战绩"),
+        tg_types.BotCommand(command="dice_history", description="历史对局"),
+        tg_types.BotCommand(command="dice_h2h", description="交手记录（回复对方）"),
         tg_types.BotCommand(command="dice_redpack", description="发拼手气红包"),
         tg_types.BotCommand(command="dice_redpack_pw", description="发口令红包"),
         tg_types.BotCommand(command="dice_attack", description="向某人发起 Attack 对决（回复消息使用）"),
@@ -380,6 +381,8 @@ async def main():
         tg_types.BotCommand(command="dice_rank", description="今日胜负榜"),
         tg_types.BotCommand(command="dice_rank_week", description="本周胜负榜"),
         tg_types.BotCommand(command="dice_rank_month", description="本月胜负榜"),
+        tg_types.BotCommand(command="dice_rank_range", description="任意日期区间胜负榜"),
+        tg_types.BotCommand(command="dice_rank_archive", description="历史归档榜单"),
         tg_types.BotCommand(command="dice_help", description="查看帮助"),
         tg_types.BotCommand(command="dice_event", description="查看最近系统彩蛋与补偿记录"),
     ]
@@ -388,9 +391,12 @@ async def main():
         tg_types.BotCommand(command="dice_forced_stop", description="[仅限管理] 强杀异常对局"),
         tg_types.BotCommand(command="dice_give", description="[仅限超管] 回复加积分"),
         tg_types.BotCommand(command="dice_take", description="[仅限超管] 回复扣积分"),
+        tg_types.BotCommand(command="dice_rain", description="[仅限超管] 发起红包雨"),
         tg_types.BotCommand(command="dice_let", description="[仅限超管] 回复覆写积分"),
         tg_types.BotCommand(command="dice_backup_db", description="[仅限超管] 备份数据库"),
         tg_types.BotCommand(command="dice_restore_db", description="[仅限超管] 恢复数据库"),
+        tg_types.BotCommand(command="dice_snapshot", description="[仅限超管] 导出运行态快照"),
+        tg_types.BotCommand(command="dice_snapshot_load", description="[仅限超管] 导入运行态快照"),
         tg_types.BotCommand(command="dice_maintain", description="[仅限超管] 停机维护"),
         tg_types.BotCommand(command="dice_compensate", description="[仅限超管] 停机补偿"),
     ]
@@ -432,15 +438,18 @@ async def main():
                 url=webhook_url,
                 secret_token=WEBHOOK_SECRET_TOKEN or None,
                 drop_pending_updates=True,
+                allowed_updates=ALLOWED_UPDATES,
             )
 
             app = web.Application()
-            request_handler = SimpleRequestHandler(
+            # 立即应答 Telegram，更新按群 FIFO 排队、由有界 worker 池处理
+            request_handler = QueuedRequestHandler(
                 dispatcher=dp,
                 bot=bot,
                 secret_token=WEBHOOK_SECRET_TOKEN or None,
+                classify=classify_update,
             )
-            request_handler.register(app, path=webhook_path)
+            request_handler.register(app, path=webhook_path, stats_path=WEBHOOK_STATS_PATH)
             setup_application(app, dp, bot=bot)
 
             runner = web.AppRunner(app)
@@ -458,7 +467,7 @@ async def main():
         else:
             await bot.delete_webhook(drop_pending_updates=True)
             logging.info("Bot starting in polling mode ...")
-            await dp.start_polling(bot)
+            await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
     except Exception as e:
         logging.exception("Webhook startup failed, fallback to polling: %s", e)
         effective_mode = "polling"
@@ -467,7 +476,7 @@ async def main():
         except Exception:
             pass
         logging.info("Bot running in polling mode")
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
     finally:
         if effective_mode == "webhook":
             try:
@@ -479,6 +488,11 @@ async def main():
                     await runner.cleanup()
                 except Exception:
                     pass
+        try:
+            await flush_game_history()
+        except Exception as e:
+            logging.warning(f"[history] 停机写入失败: {e}")
+        await release_leadership()
         try:
             await redis.aclose()
         except Exception:
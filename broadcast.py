@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.exceptions import (TelegramRetryAfter, TelegramMigrateToChat, TelegramForbiddenError,
+                                TelegramBadRequest, TelegramNetworkError, TelegramServerError)
+
+from config import SUPER_ADMIN_ID
+from core import bot, redis
+from leader import is_leader, INSTANCE_ID
+
+# ==============================
+# 群发引擎：有界并发 + 按群限速 + retry_after 退避，进度存 Redis，重启后从断点续发
+# 各类播报用 register_broadcast 注册单群投递函数 deliver(chat_id, payload) -> 消息 ID
+# ==============================
+
+BROADCAST_CONCURRENCY = 8
+# 同一群两次 API 调用的最小间隔（发送、置顶、解钉都算）
+BROADCAST_CHAT_INTERVAL = 1.0
+# 全局每秒 API 调用上限，低于 Telegram 的 30/s
+BROADCAST_GLOBAL_RATE = 25
+# 网络/5xx 等瞬时错误的重试次数与退避基数（秒）
+BROADCAST_RETRIES = 3
+BROADCAST_BACKOFF = 2.0
+# 单次调用连续遇到 retry_after 的最多等待次数
+BROADCAST_MAX_FLOOD_WAITS = 5
+# 进度 key 保留时长；期间同一 bid 不会被重新初始化
+BROADCAST_TTL = 86400 * 3
+BROADCAST_LOCK_TTL = 60
+BROADCAST_RESUME_INTERVAL = 30
+
+BROADCAST_ACTIVE_KEY = "broadcast_active"
+
+_HANDLERS: dict = {}
+_running: set = set()
+_chat_next: dict = {}
+_global_next = 0.0
+
+
+def register_broadcast(kind: str):
+    """注册一类播报的单群投递函数：async deliver(chat_id, payload) -> 消息 ID 或 None"""
+    def deco(fn):
+        _HANDLERS[kind] = fn
+        return fn
+    return deco
+
+
+def _meta_key(bid: str) -> str:
+    return f"broadcast:{bid}"
+
+
+def _pending_key(bid: str) -> str:
+    return f"broadcast_pending:{bid}"
+
+
+def _fail_key(bid: str) -> str:
+    return f"broadcast_fail:{bid}"
+
+
+def _msgs_key(bid: str) -> str:
+    return f"broadcast_msgs:{bid}"
+
+
+def _lock_key(bid: str) -> str:
+    return f"broadcast_lock:{bid}"
+
+
+async def _throttle(chat_id: int):
+    """预约下一个可用时间片：同群间隔 BROADCAST_CHAT_INTERVAL，全局间隔 1/BROADCAST_GLOBAL_RATE"""
+    global _global_next
+    now = time.monotonic()
+    slot = max(now, _global_next, _chat_next.get(chat_id, 0.0))
+    _global_next = max(now, _global_next) + 1 / BROADCAST_GLOBAL_RATE
+    _chat_next[chat_id] = slot + BROADCAST_CHAT_INTERVAL
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+async def api_call(chat_id: int, method, **kwargs):
+    """投递函数里的每次 Bot API 调用都走这里：先限速，遇到 retry_after 按要求等待后重试"""
+    for _ in range(BROADCAST_MAX_FLOOD_WAITS):
+        await _throttle(chat_id)
+        try:
+            return await method(chat_id=chat_id, **kwargs)
+        except TelegramRetryAfter as e:
+            logging.warning(f"[broadcast] 群 {chat_id} 触发限流，等待 {e.retry_after}s")
+            _chat_next[chat_id] = time.monotonic() + e.retry_after
+    await _throttle(chat_id)
+    return await method(chat_id=chat_id, **kwargs)
+
+
+async def _deliver_one(kind: str, payload: dict, gid: str) -> tuple:
+    """返回 (状态, 详情)：ok / removed（群已不可达，移出 active_groups）/ failed（保留群，写进报告）"""
+    chat_id = int(gid)
+    last_err = None
+    for attempt in range(BROADCAST_RETRIES + 1):
+        try:
+            return "ok", await _HANDLERS[kind](chat_id, payload)
+        except TelegramMigrateToChat as e:
+            # 群升级为超级群：换新 ID 立即重投
+            new_id = e.migrate_to_chat_id
+            pipe = redis.pipeline(transaction=False)
+            pipe.srem("active_groups", gid)
+            pipe.sadd("active_groups", str(new_id))
+            await pipe.execute()
+            logging.info(f"[broadcast] 群 {gid} 已迁移到 {new_id}")
+            chat_id = new_id
+        except TelegramForbiddenError as e:
+            return "removed", str(e)
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "removed", str(e)
+            return "failed", str(e)
+        except (TelegramRetryAfter, TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+            last_err = e
+            if attempt < BROADCAST_RETRIES:
+                await asyncio.sleep(BROADCAST_BACKOFF * 2 ** attempt)
+        except Exception as e:
+            return "failed", str(e)
+    return "failed", f"重试 {BROADCAST_RETRIES} 次仍失败: {last_err}"
+
+
+async def _record(bid: str, gid: str, status: str, detail):
+    pipe = redis.pipeline(transaction=False)
+    pipe.srem(_pending_key(bid), gid)
+    pipe.hincrby(_meta_key(bid), status, 1)
+    if status == "ok":
+        if detail:
+            pipe.hset(_msgs_key(bid), gid, str(detail))
+            pipe.expire(_msgs_key(bid), BROADCAST_TTL)
+    else:
+        pipe.hset(_fail_key(bid), gid, f"{status}:{str(detail)[:200]}")
+        pipe.expire(_fail_key(bid), BROADCAST_TTL)
+    if status == "removed":
+        pipe.srem("active_groups", gid)
+    await pipe.execute()
+
+
+async def _keep_lock(bid: str):
+    while True:
+        await asyncio.sleep(BROADCAST_LOCK_TTL / 3)
+        try:
+            await redis.expire(_lock_key(bid), BROADCAST_LOCK_TTL)
+        except Exception as e:
+            logging.warning(f"[broadcast] 续期 {bid} 锁失败: {e}")
+
+
+async def _send_report(bid: str, meta: dict, elapsed: float):
+    fails = await redis.hgetall(_fail_key(bid))
+    lines = [
+        f"📣 <b>群发投递报告</b>",
+        f"任务：<code>{bid}</code>",
+        f"群数：<b>{meta.get('total', 0)}</b>（成功 <b>{meta.get('ok', 0)}</b> · 失败 <b>{meta.get('failed', 0)}</b> · 已移除 <b>{meta.get('removed', 0)}</b>）",
+        f"耗时：{elapsed:.1f}s" + ("（断点续发）" if meta.get("resumed") else ""),
+    ]
+    if fails:
+        lines.append("")
+        for gid, reason in list(fails.items())[:20]:
+            status, _, err = reason.partition(":")
+            tag = "🚫" if status == "removed" else "⚠️"
+            lines.append(f"{tag} <code>{gid}</code> {err[:80]}")
+        if len(fails) > 20:
+            lines.append(f"……另有 {len(fails) - 20} 个群")
+    try:
+        await bot.send_message(chat_id=SUPER_ADMIN_ID, text="\n".join(lines))
+    except Exception as e:
+        logging.error(f"群发投递报告通报超管失败: {e}")
+
+
+async def _run_broadcast(bid: str):
+    """投递 pending 集合里剩下的群；调用前必须已持有 broadcast_lock:{bid}"""
+    _running.add(bid)
+    keeper = asyncio.create_task(_keep_lock(bid))
+    started = time.time()
+    try:
+        meta = await redis.hgetall(_meta_key(bid))
+        kind = meta.get("kind")
+        if kind not in _HANDLERS:
+            logging.warning(f"[broadcast] {bid} 未知类型 {kind}，放弃")
+            await redis.srem(BROADCAST_ACTIVE_KEY, bid)
+            return
+        payload = json.loads(meta.get("payload") or "{}")
+        pending = await redis.smembers(_pending_key(bid))
+        sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+        async def worker(gid: str):
+            async with sem:
+                status, detail = await _deliver_one(kind, payload, gid)
+                if status != "ok":
+                    logging.warning(f"[broadcast] {bid} 群 {gid} {status}: {detail}")
+                await _record(bid, gid, status, detail)
+
+        await asyncio.gather(*(worker(gid) for gid in pending))
+        await redis.srem(BROADCAST_ACTIVE_KEY, bid)
+        meta = await redis.hgetall(_meta_key(bid))
+        logging.info(f"[broadcast] {bid} 完成：成功 {meta.get('ok', 0)} 失败 {meta.get('failed', 0)} 移除 {meta.get('removed', 0)}")
+        await _send_report(bid, meta, time.time() - started)
+    finally:
+        keeper.cancel()
+        _running.discard(bid)
+        try:
+            await redis.delete(_lock_key(bid))
+        except:
+            pass
+
+
+async def start_broadcast(bid: str, kind: str, payload: dict):
+    """发起一次群发并等待投递完成。bid 在 BROADCAST_TTL 内幂等：已存在时只续发剩余的群"""
+    if not await redis.set(_lock_key(bid), INSTANCE_ID, nx=True, ex=BROADCAST_LOCK_TTL):
+        logging.info(f"[broadcast] {bid} 正在由其他实例投递，跳过")
+        return
+    if await redis.hsetnx(_meta_key(bid), "kind", kind):
+        groups = await redis.smembers("active_groups")
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(_meta_key(bid), mapping={
+            "payload": json.dumps(payload, ensure_ascii=False), "total": len(groups), "created_at": int(time.time()),
+        })
+        pipe.expire(_meta_key(bid), BROADCAST_TTL)
+        if groups:
+            pipe.sadd(_pending_key(bid), *groups)
+            pipe.expire(_pending_key(bid), BROADCAST_TTL)
+        pipe.sadd(BROADCAST_ACTIVE_KEY, bid)
+        await pipe.execute()
+    elif not await redis.sismember(BROADCAST_ACTIVE_KEY, bid):
+        logging.info(f"[broadcast] {bid} 已投递完成，跳过")
+        await redis.delete(_lock_key(bid))
+        return
+    await _run_broadcast(bid)
+
+
+async def broadcast_resume_task():
+    """主节点定期检查未完成的群发；原投递实例挂掉、锁过期后由这里接着发"""
+    while True:
+        await asyncio.sleep(BROADCAST_RESUME_INTERVAL)
+        if not is_leader():
+            continue
+        try:
+            for bid in await redis.smembers(BROADCAST_ACTIVE_KEY):
+                if bid in _running:
+                    continue
+                if not await redis.exists(_meta_key(bid)):
+                    await redis.srem(BROADCAST_ACTIVE_KEY, bid)
+                    continue
+                if not await redis.set(_lock_key(bid), INSTANCE_ID, nx=True, ex=BROADCAST_LOCK_TTL):
+                    continue
+                await redis.hset(_meta_key(bid), "resumed", "1")
+                logging.info(f"[broadcast] 续发 {bid}，剩余 {await redis.scard(_pending_key(bid))} 个群")
+                asyncio.create_task(_run_broadcast(bid))
+        except Exception as e:
+            logging.warning(f"[broadcast] 续发检查异常: {e}")
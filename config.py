@@ -30,6 +30,23 @@ WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook").strip() or "/teleg
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip() or "0.0.0.0"
 WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "9999"))
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "").strip()
+WEBHOOK_STATS_PATH = os.getenv("WEBHOOK_STATS_PATH", "/stats").strip() or "/stats"
+
+# Webhook 更新执行器：全局 worker 数、总积压上限、单群积压上限（超限返回 429 让 Telegram 重投）
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_LIMIT = int(os.getenv("UPDATE_QUEUE_LIMIT", "2000"))
+UPDATE_CHAT_QUEUE_LIMIT = int(os.getenv("UPDATE_CHAT_QUEUE_LIMIT", "300"))
+# update_id 去重窗口大小（Telegram 重投的更新在窗口内直接丢弃）
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "4096"))
+
+# 已收盘排行榜的 SQLite 归档文件
+RANK_ARCHIVE_DB = os.getenv("RANK_ARCHIVE_DB", "rank_archive.db").strip() or "rank_archive.db"
+# 对局历史 SQLite 文件（/dice_history、/dice_h2h）
+HISTORY_DB = os.getenv("HISTORY_DB", "game_history.db").strip() or "game_history.db"
+# 增量备份历史库（带版本，可按时间点恢复）
+BACKUP_DB = os.getenv("BACKUP_DB", "backup_history.db").strip() or "backup_history.db"
+# 全量运行态快照库（对局押注、红包份额、攻击、连胜、排行榜等）
+SNAPSHOT_DB = os.getenv("SNAPSHOT_DB", "live_snapshot.db").strip() or "live_snapshot.db"
 
 # 每次停机修复后更新此处，停机补偿公告会自动带上本次修复说明
 LAST_FIX_DESC = (
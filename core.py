@@ -13,7 +13,7 @@ bot = Bot(
     session=AiohttpSession(timeout=12),
 )
 dp = Dispatcher()
-redis = Redis(host='redis', port=6379, db=0, decode_responses=True, password=os.getenv('REDIS_PASSWORD'))
+redis = Redis(host=os.getenv('REDIS_HOST', 'redis'), port=int(os.getenv('REDIS_PORT', '6379')), db=int(os.getenv('REDIS_DB', '0')), decode_responses=True, password=os.getenv('REDIS_PASSWORD'))
 
 
 class CleanTextFilter(BaseFilter):
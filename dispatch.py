@@ -0,0 +1,240 @@
+import asyncio
+import hmac
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_LIMIT, UPDATE_CHAT_QUEUE_LIMIT, UPDATE_DEDUP_WINDOW
+
+
+def _chat_key(update: types.Update):
+    """同一群的更新按到达顺序串行处理；取不到 chat 的更新各自独立"""
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        cq = update.callback_query
+        if cq.message:
+            return cq.message.chat.id
+        return f"user:{cq.from_user.id}"
+    return f"update:{update.update_id}"
+
+
+class UpdateDeduplicator:
+    """update_id 滑动窗口去重：只保存最大 id + 一个窗口位图，O(1) 内存。
+
+    Telegram 在我们应答慢时会重投同一个 update，重投的必然落在最近窗口内；
+    比窗口还旧的 id 无法判断是否处理过，记一条告警后照常处理，不静默丢弃。
+    """
+
+    def __init__(self, window: int = 4096):
+        self._window = window
+        self._mask = (1 << window) - 1
+        self._max_id = None
+        self._bits = 0
+
+    def contains(self, update_id: int) -> bool:
+        if self._max_id is None or update_id > self._max_id:
+            return False
+        offset = self._max_id - update_id
+        if offset >= self._window:
+            logging.warning(f"[dispatch] update_id={update_id} 落后最新 {offset}，超出去重窗口 {self._window}，按新更新处理")
+            return False
+        return bool((self._bits >> offset) & 1)
+
+    def add(self, update_id: int):
+        if self._max_id is None:
+            self._max_id, self._bits = update_id, 1
+            return
+        if update_id > self._max_id:
+            shift = update_id - self._max_id
+            self._bits = ((self._bits << shift) | 1) & self._mask if shift < self._window else 1
+            self._max_id = update_id
+            return
+        offset = self._max_id - update_id
+        if offset < self._window:
+            self._bits |= 1 << offset
+
+
+class ChatOrderedExecutor:
+    """按群 FIFO + 全局有界 worker 池执行更新。
+
+    每个群一条队列，同一时刻一个群最多只被一个 worker 处理，保证群内顺序；
+    不同群之间由 worker 池轮转，单群骰子风暴不会拖住其他群。
+    """
+
+    def __init__(self, handle, workers: int, max_pending: int, max_chat_pending: int):
+        self._handle = handle
+        self._workers_n = workers
+        self._max_pending = max_pending
+        self._max_chat_pending = max_chat_pending
+        self._queues: dict = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._workers: list = []
+        self._pending = 0
+        self._busy = 0
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        if self._workers:
+            return
+        for i in range(self._workers_n):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def submit(self, key, item) -> bool:
+        """入队；超过全局或单群积压上限时拒绝（交给 Telegram 稍后重投）"""
+        q = self._queues.get(key)
+        if self._pending >= self._max_pending or (q is not None and len(q) >= self._max_chat_pending):
+            self._rejected += 1
+            return False
+        if q is None:
+            q = self._queues[key] = deque()
+            self._ready.put_nowait(key)
+        q.append((time.monotonic(), item))
+        self._pending += 1
+        self._accepted += 1
+        return True
+
+    async def _worker(self, idx: int):
+        while True:
+            key = await self._ready.get()
+            q = self._queues.get(key)
+            if not q:
+                self._queues.pop(key, None)
+                continue
+            enqueued_at, item = q.popleft()
+            self._pending -= 1
+            wait = time.monotonic() - enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._busy += 1
+            try:
+                await self._handle(item)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logging.exception(f"[dispatch] 处理更新异常 chat={key}: {e}")
+            finally:
+                self._busy -= 1
+                if q:
+                    self._ready.put_nowait(key)
+                else:
+                    self._queues.pop(key, None)
+
+    def stats(self, reset_window: bool = False) -> dict:
+        done = self._processed + self._failed
+        data = {
+            "workers": self._workers_n,
+            "busy_workers": self._busy,
+            "queue_depth": self._pending,
+            "active_chats": len(self._queues),
+            "max_chat_depth": max((len(q) for q in self._queues.values()), default=0),
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+            "processed": self._processed,
+            "failed": self._failed,
+            "avg_wait_ms": round(self._wait_total / done * 1000, 1) if done else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 1),
+        }
+        if reset_window:
+            self._wait_max = 0.0
+        return data
+
+
+class QueuedRequestHandler:
+    """Webhook 入口：校验后立即应答 Telegram，更新交给 ChatOrderedExecutor 异步处理"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str | None = None, classify=None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        # classify(update) -> dict | None：入队前分类，None 直接丢弃，dict 作为 handler data 透传
+        self.classify = classify
+        self.dropped = 0
+        self.executor = ChatOrderedExecutor(
+            self._process_update,
+            workers=UPDATE_WORKERS,
+            max_pending=UPDATE_QUEUE_LIMIT,
+            max_chat_pending=UPDATE_CHAT_QUEUE_LIMIT,
+        )
+        self.dedup = UpdateDeduplicator(UPDATE_DEDUP_WINDOW)
+        self.duplicates = 0
+
+    def register(self, app: web.Application, path: str, stats_path: str | None = None):
+        app.router.add_post(path, self.handle)
+        if stats_path:
+            if self.secret_token:
+                app.router.add_get(stats_path, self.handle_stats)
+            else:
+                logging.warning(f"[dispatch] 未配置 WEBHOOK_SECRET_TOKEN，不开放 {stats_path} 指标接口")
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+
+    async def _on_startup(self, app: web.Application):
+        self.executor.start()
+
+    async def _on_shutdown(self, app: web.Application):
+        await self.executor.stop()
+
+    async def _process_update(self, item):
+        update, tags = item
+        result = await self.dispatcher.feed_update(self.bot, update, **tags)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    def _authorized(self, token: str | None) -> bool:
+        return hmac.compare_digest((token or "").encode(), self.secret_token.encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not self._authorized(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"[dispatch] 无法解析更新: {e}")
+            return web.json_response({})
+        if self.dedup.contains(update.update_id):
+            # 重投的更新直接应答丢弃，不再重复跑 handler
+            self.duplicates += 1
+            logging.info(f"[dispatch] 丢弃重投更新 update_id={update.update_id} (累计 {self.duplicates})")
+            return web.json_response({})
+        tags = {}
+        if self.classify:
+            tags = self.classify(update)
+            if tags is None:
+                self.dropped += 1
+                self.dedup.add(update.update_id)
+                return web.json_response({})
+        if not self.executor.submit(_chat_key(update), (update, tags)):
+            # 背压：返回 429 让 Telegram 稍后重投，而不是在内存里无限堆积
+            logging.warning(f"[dispatch] 队列已满，拒绝 update_id={update.update_id}")
+            return web.Response(status=429, text="Too Many Requests")
+        # 只有真正入队才记入窗口：被 429 拒绝的更新重投时必须能再次处理
+        self.dedup.add(update.update_id)
+        return web.json_response({})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """指标接口与 Webhook 同端口对外，需带同一个 secret token（请求头或 ?token=）"""
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token") or request.query.get("token")
+        if not self._authorized(token):
+            return web.Response(status=401, text="Unauthorized")
+        data = self.executor.stats()
+        data["duplicates_dropped"] = self.duplicates
+        data["chatter_dropped"] = self.dropped
+        return web.json_response(data)
@@ -11,6 +11,7 @@ from utils import get_mention, delete_msg_by_id, delete_msgs, delete_msgs_by_ids
 from balance import update_balance, release_user_locks, get_or_init_balance
 from redpack import suspend_dice_redpacks, resume_dice_redpacks
 from game_settle import get_roll_keyboard, process_dice_value
+from odds import odds_line
 
 
 async def _find_players_by_game_id(game_id: str) -> list:
@@ -342,6 +343,7 @@ async def start_game_creation(chat_id: int, uid: str, name: str, pending_data: d
         txt = (f"🎯 <b>决斗发起！</b>\n"
                f"{mention} 向群友发起对决！\n"
                f"押注：<b>{amount:g}</b> | 骰子：<b>{dice_count}</b>颗 | 比<b>{direction}</b>\n"
+               f"{odds_line(direction, dice_count, 2)}\n"
                f"60秒无人应答自动退款，快来接单👇")
         kb = types.InlineKeyboardMarkup(inline_keyboard=[[
             types.InlineKeyboardButton(text="⚔️ 接单", callback_data=f"jg:{game_id}")
@@ -351,6 +353,7 @@ async def start_game_creation(chat_id: int, uid: str, name: str, pending_data: d
         txt = (f"🎯 <b>指定决斗！</b>\n"
                f"{mention} 向 {target_mention} 发起专属对决！\n"
                f"押注：<b>{amount:g}</b> | 骰子：<b>{dice_count}</b>颗 | 比<b>{direction}</b>\n"
+               f"{odds_line(direction, dice_count, 2)}\n"
                f"1分钟内不应答自动退款！")
         kb = types.InlineKeyboardMarkup(inline_keyboard=[[
             types.InlineKeyboardButton(text="⚔️ 应战！", callback_data=f"jg:{game_id}")
@@ -358,6 +361,7 @@ async def start_game_creation(chat_id: int, uid: str, name: str, pending_data: d
     elif game_mode == "multi_exact":
         txt = (f"🎲 <b>定员组局 (1/{target_players})</b>\n"
                f"押注：<b>{amount:g}</b> | 骰子：<b>{dice_count}</b>颗 | 比<b>{direction}</b>\n"
+               f"{odds_line(direction, dice_count, target_players)}\n"
                f"当前：{mention}\n死等满员👇")
         kb = types.InlineKeyboardMarkup(inline_keyboard=[
             [types.InlineKeyboardButton(text="⚔️ 接单", callback_data=f"jg:{game_id}")],
@@ -366,6 +370,7 @@ async def start_game_creation(chat_id: int, uid: str, name: str, pending_data: d
     else:  # multi_dynamic
         txt = (f"🎲 <b>多人发车 (1/5)</b>\n"
                f"押注：<b>{amount:g}</b> | 骰子：<b>{dice_count}</b>颗 | 比<b>{direction}</b>\n"
+               f"{odds_line(direction, dice_count, 2)}\n"
                f"当前：{mention}\n有人进就开始15秒倒计时👇")
         kb = types.InlineKeyboardMarkup(inline_keyboard=[
             [types.InlineKeyboardButton(text="⚔️ 接单", callback_data=f"jg:{game_id}")],
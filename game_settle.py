@@ -9,7 +9,8 @@ from aiogram import types
 from config import game_locks, get_lock, ALLOWED_THREAD_ID
 from core import bot, redis
 from utils import get_mention, safe_html, delete_msg_by_id, delete_msgs, delete_msgs_by_ids
-from balance import update_balance, get_period_keys, release_user_locks
+from balance import update_balance, release_user_locks, record_rank_result, record_user_rollup
+from history import record_game_history
 from redpack import resume_dice_redpacks
 
 
@@ -163,7 +164,6 @@ async def process_round_end_or_settle(chat_id: int, game_id: str, game_data: dic
                 player_profit_cents[p] = base_share + (1 if idx < rem else 0)
             current_rank += g_size
 
-        daily_k, weekly_k, monthly_k = get_period_keys()
         tie_txt = f" <i>(加赛{tie_rounds}轮)</i>" if tie_rounds > 0 else ""
         if force_settle:
             tie_txt += "\n⚠️ <b>[已达20颗极限强制平分清算]</b>"
@@ -188,22 +188,12 @@ async def process_round_end_or_settle(chat_id: int, game_id: str, game_data: dic
                 await redis.hincrbyfloat(session_key, f"p_{p}", win_lose_profit)
                 await redis.hset(session_key, f"name_{p}", names[p])
 
-            for period, prefix in [(daily_k, "daily"), (weekly_k, "weekly"), (monthly_k, "monthly")]:
-                await redis.zincrby(f"rank_points:{prefix}:{period}", win_lose_profit, p)
-                if win_lose_profit > 0:
-                    await redis.zincrby(f"rank_gross_wins:{prefix}:{period}", win_lose_profit, p)
-                    await redis.zincrby(f"rank_wins:{prefix}:{period}", 1, p)
-                elif win_lose_profit < 0:
-                    await redis.zincrby(f"rank_gross_losses:{prefix}:{period}", abs(win_lose_profit), p)
-                    await redis.zincrby(f"rank_losses:{prefix}:{period}", 1, p)
-                else:
-                    await redis.zincrby(f"rank_draws:{prefix}:{period}", 1, p)
-                await redis.expire(f"rank_points:{prefix}:{period}", 86400 * 60)
-                await redis.expire(f"rank_gross_wins:{prefix}:{period}", 86400 * 60)
-                await redis.expire(f"rank_gross_losses:{prefix}:{period}", 86400 * 60)
-                await redis.expire(f"rank_wins:{prefix}:{period}", 86400 * 60)
-                await redis.expire(f"rank_losses:{prefix}:{period}", 86400 * 60)
-                await redis.expire(f"rank_draws:{prefix}:{period}", 86400 * 60)
+            # 先写个人汇总：周/月胜率索引按 user_stats 里的胜负平计算
+            await record_user_rollup(p, player_profit_cents[p], {
+                "ts": int(time.time()), "dir": direction, "bet": amount,
+                "rank": i + 1, "players": len(sorted_players), "profit": win_lose_profit,
+            })
+            await record_rank_result(p, win_lose_profit)
 
             sign = "+" if win_lose_profit > 0 else ""
             p_rolls = rolls.get(p, [])
@@ -219,6 +209,21 @@ async def process_round_end_or_settle(chat_id: int, game_id: str, game_data: dic
                 elif (direction == "大" and score == 9) or (direction == "小" and score == 0):
                     extreme_compensations.append((p, names[p], score, "lucky", extreme_bonus_abs, player_profit_cents[p]))
 
+        # 对局历史入队，后台线程批量落盘
+        record_game_history({
+            "game_id": game_id, "chat_id": chat_id, "ts": int(time.time()), "direction": direction,
+            "bet": amount, "dice_count": initial_count, "tie_rounds": tie_rounds, "forced": force_settle,
+            "players": [
+                {"uid": p, "rank": i + 1, "profit_cents": player_profit_cents[p],
+                 "score": None if (-1 in rolls.get(p, []) or not rolls.get(p)) else calculate_score_with_details(rolls[p])[0],
+                 "rolls": json.dumps(rolls.get(p, []))}
+                for i, p in enumerate(sorted_players)
+            ],
+        })
+
+        # 排行榜数据已变：推进代号，已缓存的榜单文本随之失效
+        await redis.incr("rank_gen")
+
         await bot.send_message(chat_id, "\n".join(final_text), message_thread_id=ALLOWED_THREAD_ID or None)
 
         # ── 连胜/连败奖惩 ──
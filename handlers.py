@@ -6,7 +6,6 @@ import math
 import os
 import random
 import re
-import sqlite3
 import time
 import uuid
 
@@ -18,13 +17,26 @@ from typing import Callable, Dict, Any, Awaitable
 from config import BOT_ID, SUPER_ADMIN_ID, ADMIN_IDS, TZ_BJ, PATTERN, LAST_FIX_DESC, get_lock, ALLOWED_CHAT_ID, ALLOWED_THREAD_ID
 from core import bot, redis, CleanTextFilter
 from utils import (get_mention, safe_html, delete_msgs, delete_msg_by_id,
-                   reply_and_auto_delete, safe_zrevrange, safe_zrange, delete_msgs_by_ids)
-from balance import get_or_init_balance, update_balance, get_period_keys
-from tasks import perform_backup, get_latest_backup_path, BACKUP_KEEP
+                   reply_and_auto_delete, safe_zrange, delete_msgs_by_ids)
+from balance import (get_or_init_balance, update_balance, get_period_keys, rank_sources, rate_base, merged_top,
+                     rate_counts, live_base, RANK_RATE_MIN_GAMES,
+                     RANK_DAILY_RETENTION_DAYS, parse_rank_day, range_period_key, range_is_closed, USER_RECENT_GAMES,
+                     BACKUP_DIRTY_KEY)
+from backup import (perform_backup, list_restore_points, get_restore_point, load_restore_point,
+                    format_restore_point, restore_users, verify_restore, diff_restore_point, BACKUP_RETENTION_DAYS)
+from snapshot import (export_snapshot, import_snapshot, get_snapshot, list_snapshots, snapshot_family_counts, format_snapshot)
+from leader import MAINTENANCE_ALL_KEY
 from game import start_game_creation, start_rolling_phase, rank_panel_watcher, refund_game, get_valid_user_game
 from game_settle import process_dice_value
+from odds import odds_line
 from redpack import (build_redpack_panel, refresh_dice_panel, attempt_claim_pw_redpack,
-                     redpack_expiry_watcher, generate_redpack_amounts)
+                     schedule_redpack_expiry, store_redpack_shares, register_pw_redpack,
+                     claim_redpacks)
+from ingress import IngressFilter
+from rain import start_rain, grab_rain
+from history import query_user_history, query_user_totals, query_head_to_head
+from archive import (parse_archive_period, list_archived_periods, is_period_archived,
+                     query_archive_top, query_archive_win_rate)
 
 router = Router()
 
@@ -33,12 +45,20 @@ KNOWN_DICE_COMMANDS = {
     "dice_event",
     "dice_backup_db",
     "dice_restore_db",
+    "dice_snapshot",
+    "dice_snapshot_load",
     "dice_checkin",
     "dice_redpack",
     "dice_redpack_pw",
+    "dice_rain",
     "dice_rank",
     "dice_rank_week",
     "dice_rank_month",
+    "dice_rank_range",
+    "dice_rank_archive",
+    "dice_me",
+    "dice_history",
+    "dice_h2h",
     "dice_bal",
     "dice_gift",
     "dice_forced_stop",
@@ -92,6 +112,11 @@ class TopicRestrictionMiddleware(BaseMiddleware):
 # 维护期全量拦截中间件
 # ==============================
 
+async def in_maintenance(chat_id) -> bool:
+    """本群维护中，或快照导入期间的全局暂停"""
+    return bool(await redis.exists(f"maintenance:{chat_id}", MAINTENANCE_ALL_KEY))
+
+
 class MaintenanceMiddleware(BaseMiddleware):
     async def __call__(
         self,
@@ -101,12 +126,12 @@ class MaintenanceMiddleware(BaseMiddleware):
     ) -> Any:
         if isinstance(event, types.Message):
             chat_id = event.chat.id
-            if await redis.exists(f"maintenance:{chat_id}"):
+            if await in_maintenance(chat_id):
                 await reply_and_auto_delete(event, "🔧 <b>系统维护中</b>，暂停所有功能，请等待维护完成后再操作。")
                 return
         elif isinstance(event, types.CallbackQuery):
             chat_id = event.message.chat.id if event.message else None
-            if chat_id and await redis.exists(f"maintenance:{chat_id}"):
+            if chat_id and await in_maintenance(chat_id):
                 try:
                     await event.answer("🔧 系统维护中，请稍后再试", show_alert=True)
                 except Exception:
@@ -147,104 +172,131 @@ router.callback_query.middleware(TelegramResilienceMiddleware())
 # 排行榜辅助函数
 # ==============================
 
-async def get_leaderboard_text(period: str, board: str, title: str) -> str:
-    daily_k, weekly_k, monthly_k = get_period_keys()
-    period_map = {"daily": daily_k, "weekly": weekly_k, "monthly": monthly_k}
-    period_key = period_map.get(period, daily_k)
+# 渲染结果缓存：结算时 INCR rank_gen，缓存值带生成时的代号，代号一致即直接复用
+RANK_CACHE_TTL = 600
+
+
+async def get_leaderboard_text(period: str, board: str, title: str, period_key: str = None) -> str:
+    if period_key is None:
+        daily_k, weekly_k, monthly_k = get_period_keys()
+        period_map = {"daily": daily_k, "weekly": weekly_k, "monthly": monthly_k}
+        period_key = period_map.get(period, daily_k)
+
+    cache_key = f"rank_cache:{period}:{board}:{period_key}"
+    if period == "range" and range_is_closed(period_key):
+        # 已收盘区间的数据不再变化，缓存只需一次 GET
+        gen, cached = "static", await redis.get(cache_key)
+    else:
+        gen, cached = await redis.mget("rank_gen", cache_key)
+        gen = gen or "0"
+    if cached:
+        cached_gen, _, text = cached.partition("\n")
+        if cached_gen == gen:
+            return text
+
+    text = await render_leaderboard_text(period, board, title, period_key)
+    # 存渲染前读到的代号：渲染期间若有新结算，下次查看自然失效重算
+    await redis.set(cache_key, f"{gen}\n{text}", ex=RANK_CACHE_TTL)
+    return text
+
 
+async def render_leaderboard_text(period: str, board: str, title: str, period_key: str) -> str:
     lines = [f"🏆 <b>{title}</b>\n"]
+    # 周/月榜 = 已收盘视图 + 今天的日榜，查询时合并
+    sources = await rank_sources(period, period_key)
 
+    rate_rows = {}
     if board == "net":
-        raw_winners = await safe_zrevrange(f"rank_points:{period}:{period_key}", 0, 9, withscores=True)
-        raw_losers = await safe_zrange(f"rank_points:{period}:{period_key}", 0, 9, withscores=True)
+        raw_winners = await merged_top("points", sources, 10)
+        raw_losers = await merged_top("points", sources, 10, desc=False)
         top_winners = [(uid, score) for uid, score in raw_winners if score > 0][:5]
         top_losers = [(uid, score) for uid, score in raw_losers if score < 0][:5]
+        top_uids, low_uids = [], []
+    else:
+        top_winners = await merged_top("gross_wins", sources, 5)
+        top_losers = await merged_top("gross_losses", sources, 5)
+        # 胜率榜仅在胜负榜展示；净胜负榜不展示。排序由结算时维护的胜率索引给出
+        rbase = rate_base(period, period_key)
+        top_uids = await safe_zrange(f"rank_rate_top:{rbase}", 0, 4)
+        low_uids = await safe_zrange(f"rank_rate_low:{rbase}", 0, 4)
+        rate_uids = list(dict.fromkeys(top_uids + low_uids))
+        if rate_uids:
+            for uid, (wins, losses, draws) in (await rate_counts(period, period_key, rate_uids)).items():
+                total = wins + losses + draws
+                rate_rows[uid] = (wins / total * 100 if total else 0.0, wins, losses, draws, total)
+
+    # 所有上榜玩家的名字一次 HMGET 取回
+    all_uids = list(dict.fromkeys([u for u, _ in top_winners] + [u for u, _ in top_losers] + top_uids + low_uids))
+    names = dict(zip(all_uids, await redis.hmget("user_names", all_uids))) if all_uids else {}
+
+    def mention(uid):
+        return get_mention(uid, names.get(uid) or "未知玩家")
+
+    if board == "net":
         lines.append("📈 <b>净赢家 TOP 5</b>")
         if top_winners:
             for i, (uid, score) in enumerate(top_winners):
-                name = await redis.hget("user_names", uid) or "未知玩家"
-                lines.append(f"{i+1}. {get_mention(uid, name)} | +{score:g}")
+                lines.append(f"{i+1}. {mention(uid)} | +{score:g}")
         else:
             lines.append("暂无盈利数据。")
         lines.append("\n📉 <b>净亏损 TOP 5</b>")
         if top_losers:
             for i, (uid, score) in enumerate(top_losers):
-                name = await redis.hget("user_names", uid) or "未知玩家"
-                lines.append(f"{i+1}. {get_mention(uid, name)} | {score:g}")
+                lines.append(f"{i+1}. {mention(uid)} | {score:g}")
         else:
             lines.append("暂无亏损数据。")
+        return "\n".join(lines)
+
+    lines.append("📈 <b>赢家榜 TOP 5</b>")
+    if top_winners:
+        for i, (uid, score) in enumerate(top_winners):
+            lines.append(f"{i+1}. {mention(uid)} | +{score:g}")
     else:
-        top_winners = await safe_zrevrange(f"rank_gross_wins:{period}:{period_key}", 0, 4, withscores=True)
-        top_losers = await safe_zrevrange(f"rank_gross_losses:{period}:{period_key}", 0, 4, withscores=True)
-        lines.append("📈 <b>赢家榜 TOP 5</b>")
-        if top_winners:
-            for i, (uid, score) in enumerate(top_winners):
-                name = await redis.hget("user_names", uid) or "未知玩家"
-                lines.append(f"{i+1}. {get_mention(uid, name)} | +{score:g}")
-        else:
-            lines.append("暂无盈利数据。")
-        lines.append("\n📉 <b>散财榜 TOP 5</b>")
-        if top_losers:
-            for i, (uid, score) in enumerate(top_losers):
-                name = await redis.hget("user_names", uid) or "未知玩家"
-                lines.append(f"{i+1}. {get_mention(uid, name)} | -{score:g}")
-        else:
-            lines.append("暂无亏损数据。")
+        lines.append("暂无盈利数据。")
+    lines.append("\n📉 <b>散财榜 TOP 5</b>")
+    if top_losers:
+        for i, (uid, score) in enumerate(top_losers):
+            lines.append(f"{i+1}. {mention(uid)} | -{score:g}")
+    else:
+        lines.append("暂无亏损数据。")
 
-        # 胜率榜仅在胜负榜展示；净胜负榜不展示。
-        wins_all = await safe_zrange(f"rank_wins:{period}:{period_key}", 0, -1, withscores=True)
-        losses_all = await safe_zrange(f"rank_losses:{period}:{period_key}", 0, -1, withscores=True)
-        draws_all = await safe_zrange(f"rank_draws:{period}:{period_key}", 0, -1, withscores=True)
-        wins_map = {uid: float(score) for uid, score in wins_all}
-        losses_map = {uid: float(score) for uid, score in losses_all}
-        draws_map = {uid: float(score) for uid, score in draws_all}
-        rate_rows = []
-        for uid in (set(wins_map.keys()) | set(losses_map.keys()) | set(draws_map.keys())):
-            wins = wins_map.get(uid, 0.0)
-            losses = losses_map.get(uid, 0.0)
-            draws = draws_map.get(uid, 0.0)
-            total = int(wins + losses + draws)
-            if total <= 0:
-                continue
-            win_rate = wins / total * 100
-            rate_rows.append((uid, win_rate, int(wins), int(losses), int(draws), total))
-        rate_rows.sort(key=lambda x: (-x[1], -x[5], -x[2], x[0]))
-        lines.append("\n📈 <b>胜率 TOP 5</b>")
-        if rate_rows:
-            for i, (uid, win_rate, wins, losses, draws, total) in enumerate(rate_rows[:5]):
-                name = await redis.hget("user_names", uid) or "未知玩家"
-                draw_str = f" {draws}平" if draws > 0 else ""
-                lines.append(
-                    f"{i+1}. {get_mention(uid, name)} | {win_rate:.1f}%（{wins}胜 {losses}负{draw_str} / {total}局）"
-                )
-        else:
-            lines.append("暂无胜率数据。")
-
-        low_rate_rows = sorted(rate_rows, key=lambda x: (x[1], -x[5], -x[3], x[0]))
-        lines.append("\n📉 <b>胜率 LAST 5</b>")
-        if low_rate_rows:
-            for i, (uid, win_rate, wins, losses, draws, total) in enumerate(low_rate_rows[:5]):
-                name = await redis.hget("user_names", uid) or "未知玩家"
-                draw_str = f" {draws}平" if draws > 0 else ""
-                lines.append(
-                    f"{i+1}. {get_mention(uid, name)} | {win_rate:.1f}%（{wins}胜 {losses}负{draw_str} / {total}局）"
-                )
-        else:
+    for heading, uids in ((f"\n📈 <b>胜率 TOP 5</b>（≥{RANK_RATE_MIN_GAMES}局）", top_uids),
+                          (f"\n📉 <b>胜率 LAST 5</b>（≥{RANK_RATE_MIN_GAMES}局）", low_uids)):
+        lines.append(heading)
+        if not uids:
             lines.append("暂无胜率数据。")
+            continue
+        for i, uid in enumerate(uids):
+            win_rate, wins, losses, draws, total = rate_rows[uid]
+            draw_str = f" {draws}平" if draws > 0 else ""
+            lines.append(
+                f"{i+1}. {mention(uid)} | {win_rate:.1f}%（{wins}胜 {losses}负{draw_str} / {total}局）"
+            )
 
     return "\n".join(lines)
 
 
-def get_rank_markup(period: str, board: str, uid: str) -> types.InlineKeyboardMarkup:
+def get_rank_markup(period: str, board: str, uid: str, period_key: str = "") -> types.InlineKeyboardMarkup:
     def btn(label, p, b):
         is_active = (p == period and b == board)
         text = f"✅ {label}" if is_active else label
-        return types.InlineKeyboardButton(text=text, callback_data=f"rank_sw:{p}:{b}:{uid}")
-    row1 = [btn("今日", "daily", board), btn("本周", "weekly", board), btn("本月", "monthly", board)]
+        suffix = f":{period_key}" if p == "range" else ""
+        return types.InlineKeyboardButton(text=text, callback_data=f"rank_sw:{p}:{b}:{uid}{suffix}")
     row2 = [btn("胜负榜", period, "gross"), btn("净胜负榜", period, "net")]
+    if period == "range":
+        return types.InlineKeyboardMarkup(inline_keyboard=[row2])
+    row1 = [btn("今日", "daily", board), btn("本周", "weekly", board), btn("本月", "monthly", board)]
     return types.InlineKeyboardMarkup(inline_keyboard=[row1, row2])
 
 
+def get_rank_title(period: str, board: str, period_key: str = "") -> str:
+    board_name = "净胜负榜" if board == "net" else "胜负榜"
+    if period == "range":
+        start, end = period_key.split("-")
+        return f"{start[:4]}-{start[4:6]}-{start[6:]} ~ {end[:4]}-{end[4:6]}-{end[6:]} {board_name}"
+    return {"daily": "今日", "weekly": "本周", "monthly": "本月"}[period] + board_name
+
+
 # ==============================
 # 指令 handlers
 # ==============================
@@ -300,6 +352,9 @@ async def cmd_help(message: types.Message):
 
 • <code>/dice_checkin</code>：每日签到领积分。<b>连续签到5天白送两万！</b>
 • <code>/dice_bal</code>：查看自己的可用积分余额。
+• <code>/dice_me</code>：查看个人战绩（余额、连胜、各周期盈亏与排名、最近10局）。
+• <code>/dice_history</code>：查看自己的历史对局（回复某人可查看对方）。
+• <code>/dice_h2h</code>：回复某人发送，查看你们的交手记录。
 • <code>/dice_gift 100</code>：回复某人的消息发送，直接赠送他100积分。
 • <code>/dice_redpack 1000 5</code>：发拼手气红包（总额1000，分5个包）。
 • <code>/dice_redpack_pw 100 2 芝麻开门</code>：发口令红包，打出"芝麻开门"才能抢。
@@ -307,6 +362,8 @@ async def cmd_help(message: types.Message):
 • <code>/dice_rank</code>：查看今日胜负榜（支持按钮切换净赚榜）。
 • <code>/dice_rank_week</code>：查看本周胜负榜。
 • <code>/dice_rank_month</code>：查看本月胜负榜。
+• <code>/dice_rank_range 20260101 20260115</code>：查看任意日期区间的胜负榜（近35天内）。
+• <code>/dice_rank_archive 2026-W03</code>：查看已归档的历史日/周/月榜（20260101 / 2026-W03 / 202601，不带参数列出最近归档）。
 • <code>/dice_event</code>：查看过去24小时系统事件（彩蛋/补偿记录）。"""
     bot_msg = await message.reply(help_text)
     asyncio.create_task(delete_msgs([message, bot_msg], 60))
@@ -379,37 +436,111 @@ async def cmd_backup_db(message: types.Message):
         bot_msg = await message.reply("❌ 越权拦截")
         return asyncio.create_task(delete_msgs([message, bot_msg], 10))
     count = await perform_backup()
-    latest = get_latest_backup_path() or "无"
+    latest = await get_restore_point()
     bot_msg = await message.reply(
         f"✅ <b>手动备份完成！</b>\n"
-        f"当前 Redis 核心资产已写入 SQLite（共 {count} 条）。\n"
-        f"🗂 最新备份：<code>{latest}</code>\n"
-        f"♻️ 仅保留最近 <b>{BACKUP_KEEP}</b> 份。"
+        f"本次写入 {count} 条变更。\n"
+        f"🗂 最新恢复点：<code>{format_restore_point(latest) if latest else '无'}</code>\n"
+        f"♻️ 恢复点保留 <b>{BACKUP_RETENTION_DAYS}</b> 天。"
     )
     asyncio.create_task(delete_msgs([message, bot_msg], 10))
 
 
+def get_restore_markup(version: int):
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔍 预演对比（不写入）", callback_data=f"restore_dry:{version}")],
+        [types.InlineKeyboardButton(text="⚠️ 确认覆盖恢复", callback_data=f"confirm_restore:{version}"),
+         types.InlineKeyboardButton(text="❌ 取消", callback_data="cancel_restore")],
+    ])
+
+
 @router.message(CleanTextFilter(), Command("dice_restore_db"))
 async def cmd_restore_db(message: types.Message):
     if message.from_user.id != SUPER_ADMIN_ID:
         bot_msg = await message.reply("❌ 越权拦截")
         return asyncio.create_task(delete_msgs([message, bot_msg], 10))
 
-    markup = types.InlineKeyboardMarkup(inline_keyboard=[[
-        types.InlineKeyboardButton(text="⚠️ 确认覆盖恢复", callback_data="confirm_restore"),
-        types.InlineKeyboardButton(text="❌ 取消", callback_data="cancel_restore")
-    ]])
-    latest = get_latest_backup_path()
-    latest_text = f"<code>{latest}</code>" if latest else "（未找到可用备份）"
+    args = message.text.split()
+    if len(args) > 1 and args[1] == "list":
+        points = await list_restore_points()
+        text = "\n".join(f"• <code>{format_restore_point(p)}</code>" for p in points) or "（暂无恢复点）"
+        bot_msg = await message.reply(f"🗂 <b>最近的恢复点</b>\n\n{text}\n\n用法：<code>/dice_restore_db 版本号</code>")
+        return asyncio.create_task(delete_msgs([message, bot_msg], 60))
+    if len(args) > 1 and not args[1].isdigit():
+        return await reply_and_auto_delete(message, "❌ 用法：<code>/dice_restore_db [版本号]</code>，<code>/dice_restore_db list</code> 查看恢复点。")
+
+    point = await get_restore_point(int(args[1]) if len(args) > 1 else None)
+    if not point:
+        return await reply_and_auto_delete(message, "⚠️ 未找到可用的恢复点！")
+    markup = get_restore_markup(point[0])
     await message.reply(
         "⚠️ <b>高危操作警告</b> ⚠️\n\n"
         "此操作将清空并覆写当前 Redis 中的所有用户资产！\n"
-        f"将使用最新备份：{latest_text}\n"
+        f"将恢复到：<code>{format_restore_point(point)}</code>\n"
         "确定要继续恢复吗？",
         reply_markup=markup,
     )
 
 
+SNAPSHOT_FAMILY_NAMES = {
+    "balance": "余额", "user": "用户数据", "game": "对局", "streak": "连胜", "redpack": "红包",
+    "rain": "红包雨", "attack": "攻击", "rank": "排行榜", "misc": "其他",
+}
+
+
+@router.message(CleanTextFilter(), Command("dice_snapshot"))
+async def cmd_snapshot(message: types.Message):
+    if message.from_user.id != SUPER_ADMIN_ID:
+        bot_msg = await message.reply("❌ 越权拦截")
+        return asyncio.create_task(delete_msgs([message, bot_msg], 10))
+
+    args = message.text.split()
+    if len(args) > 1 and args[1] == "list":
+        snaps = await list_snapshots()
+        text = "\n".join(f"• <code>{format_snapshot(s)}</code>" for s in snaps) or "（暂无快照）"
+        bot_msg = await message.reply(f"📸 <b>最近的运行态快照</b>\n\n{text}\n\n导入：<code>/dice_snapshot_load 快照号</code>")
+        return asyncio.create_task(delete_msgs([message, bot_msg], 60))
+
+    bot_msg = await message.reply("⏳ 正在导出运行态快照...")
+    sid, total = await export_snapshot()
+    counts = await snapshot_family_counts(sid)
+    detail = "\n".join(f"• {SNAPSHOT_FAMILY_NAMES.get(f, f)}：{n}" for f, n in counts)
+    try:
+        await bot_msg.edit_text(
+            f"✅ <b>运行态快照完成！</b>\n"
+            f"📸 快照号：<code>#{sid}</code>，共 <b>{total}</b> 个 key\n{detail}"
+        )
+    except:
+        pass
+    asyncio.create_task(delete_msgs([message, bot_msg], 30))
+
+
+@router.message(CleanTextFilter(), Command("dice_snapshot_load"))
+async def cmd_snapshot_load(message: types.Message):
+    if message.from_user.id != SUPER_ADMIN_ID:
+        bot_msg = await message.reply("❌ 越权拦截")
+        return asyncio.create_task(delete_msgs([message, bot_msg], 10))
+
+    args = message.text.split()
+    if len(args) < 2 or not args[1].lstrip("#").isdigit():
+        return await reply_and_auto_delete(message, "❌ 用法：<code>/dice_snapshot_load 快照号</code>，<code>/dice_snapshot list</code> 查看快照。")
+    snap = await get_snapshot(int(args[1].lstrip("#")))
+    if not snap:
+        return await reply_and_auto_delete(message, "⚠️ 未找到该快照！")
+    markup = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="⚠️ 确认导入", callback_data=f"confirm_snapload:{snap[0]}"),
+         types.InlineKeyboardButton(text="❌ 取消", callback_data="cancel_restore")],
+    ])
+    await message.reply(
+        "⚠️ <b>高危操作警告</b> ⚠️\n\n"
+        "将用快照覆盖 Redis 中同名的对局、红包、攻击、连胜、排行榜与余额等 key（快照之后新建的 key 不受影响）！\n"
+        "导入期间所有群暂停处理。\n"
+        f"快照：<code>{format_snapshot(snap)}</code>\n"
+        "确定要继续导入吗？",
+        reply_markup=markup,
+    )
+
+
 @router.message(CleanTextFilter(), Command("dice_checkin"))
 async def cmd_checkin(message: types.Message):
     uid = str(message.from_user.id)
@@ -465,16 +596,13 @@ async def cmd_redpack(message: types.Message):
 
     await update_balance(uid, -amount)
     rp_id = str(uuid.uuid4())[:8]
-    amounts = generate_redpack_amounts(amount, count)
 
     epoch = str(time.time())
     await redis.hset(f"redpack_meta:{rp_id}", mapping={
         "amount": str(amount), "count": str(count), "chat_id": str(message.chat.id),
         "sender_uid": uid, "sender_name": message.from_user.first_name, "created_at": epoch
     })
-    await redis.rpush(f"redpack_list:{rp_id}", *amounts)
-    await redis.expire(f"redpack_meta:{rp_id}", 300)
-    await redis.expire(f"redpack_list:{rp_id}", 300)
+    await store_redpack_shares(rp_id, amount, count, 320)
 
     text, markup = await build_redpack_panel(rp_id, is_pw=False)
     bot_msg = await bot.send_message(message.chat.id, text, reply_markup=markup, message_thread_id=ALLOWED_THREAD_ID or None)
@@ -483,7 +611,7 @@ async def cmd_redpack(message: types.Message):
 
     # 0秒光速抹除老板发包指令
     asyncio.create_task(delete_msgs([message], 0))
-    asyncio.create_task(redpack_expiry_watcher(message.chat.id, bot_msg.message_id, rp_id, False, epoch))
+    await schedule_redpack_expiry(rp_id, float(epoch))
 
 
 @router.message(CleanTextFilter(), Command("dice_redpack_pw"))
@@ -526,17 +654,14 @@ async def cmd_redpack_pw(message: types.Message):
 
     await update_balance(uid, -amount)
     rp_id = str(uuid.uuid4())[:8]
-    amounts = generate_redpack_amounts(amount, count)
 
     epoch = str(time.time())
     await redis.hset(f"redpack_meta:{rp_id}", mapping={
         "amount": str(amount), "count": str(count), "pw": pw, "chat_id": str(message.chat.id),
         "sender_uid": uid, "sender_name": message.from_user.first_name, "created_at": epoch
     })
-    await redis.sadd("active_pw_rps", rp_id)
-    await redis.rpush(f"redpack_list:{rp_id}", *amounts)
-    await redis.expire(f"redpack_meta:{rp_id}", 320)
-    await redis.expire(f"redpack_list:{rp_id}", 320)
+    await store_redpack_shares(rp_id, amount, count, 320)
+    await register_pw_redpack(message.chat.id, pw, rp_id)
 
     # 0秒光速抹除老板发包指令
     asyncio.create_task(delete_msgs([message], 0))
@@ -549,12 +674,12 @@ async def cmd_redpack_pw(message: types.Message):
             await refresh_dice_panel(message.chat.id)
         except Exception as e:
             logging.warning(f"[redpack_pw] refresh_dice_panel 异常: {e}")
-        asyncio.create_task(redpack_expiry_watcher(message.chat.id, bot_msg.message_id, rp_id, True, epoch))
+        await schedule_redpack_expiry(rp_id, float(epoch))
     else:
         text, markup = await build_redpack_panel(rp_id, is_pw=True)
         bot_msg = await bot.send_message(message.chat.id, text, reply_markup=markup, message_thread_id=ALLOWED_THREAD_ID or None)
         await redis.hset(f"redpack_meta:{rp_id}", "msg_id", str(bot_msg.message_id))
-        asyncio.create_task(redpack_expiry_watcher(message.chat.id, bot_msg.message_id, rp_id, True, epoch))
+        await schedule_redpack_expiry(rp_id, float(epoch))
 
 
 @router.message(CleanTextFilter(), Command("dice_rank"))
@@ -584,14 +709,111 @@ async def cmd_rank_monthly(message: types.Message):
     asyncio.create_task(rank_panel_watcher(message.chat.id, bot_msg.message_id, message.message_id))
 
 
+@router.message(CleanTextFilter(), Command("dice_rank_range"))
+async def cmd_rank_range(message: types.Message):
+    args = message.text.split()
+    if len(args) < 3:
+        return await reply_and_auto_delete(message, "❌ 用法：<code>/dice_rank_range 起始日期 结束日期</code>（如 20260101 20260115）")
+    start, end = parse_rank_day(args[1]), parse_rank_day(args[2])
+    if not start or not end:
+        return await reply_and_auto_delete(message, "❌ 日期格式错误！请使用 20260101 或 2026-01-01。")
+    if start > end:
+        start, end = end, start
+    today = datetime.datetime.now(TZ_BJ).date()
+    if end > today:
+        return await reply_and_auto_delete(message, "❌ 结束日期不能晚于今天。")
+    if (today - start).days >= RANK_DAILY_RETENTION_DAYS:
+        return await reply_and_auto_delete(message, f"❌ 只保留最近 {RANK_DAILY_RETENTION_DAYS} 天的日榜，起始日期太早了。")
+
+    uid = str(message.from_user.id)
+    period_key = range_period_key(start, end)
+    text = await get_leaderboard_text("range", "gross", get_rank_title("range", "gross", period_key), period_key)
+    bot_msg = await message.reply(text, reply_markup=get_rank_markup("range", "gross", uid, period_key))
+    await redis.setex(f"rank_msg:{message.chat.id}:{bot_msg.message_id}", 60, "1")
+    asyncio.create_task(rank_panel_watcher(message.chat.id, bot_msg.message_id, message.message_id))
+
+
+ARCHIVE_TYPE_NAMES = {"daily": "日榜", "weekly": "周榜", "monthly": "月榜"}
+
+
+def format_archive_period(period_type: str, period_key: str) -> str:
+    if period_type == "weekly":
+        year, week = period_key.split("-")
+        return f"{year}-W{week}"
+    return period_key
+
+
+async def render_archive_text(period_type: str, period_key: str) -> str:
+    title = f"{format_archive_period(period_type, period_key)} {ARCHIVE_TYPE_NAMES[period_type]}（归档）"
+    lines = [f"🏆 <b>{title}</b>\n"]
+    winners = await query_archive_top(period_type, period_key, "gross_wins")
+    losers = await query_archive_top(period_type, period_key, "gross_losses")
+    net_top = await query_archive_top(period_type, period_key, "points")
+    rate_top = await query_archive_win_rate(period_type, period_key)
+    rate_low = await query_archive_win_rate(period_type, period_key, desc=False)
+
+    all_uids = list(dict.fromkeys([r[0] for r in winners + losers + net_top + rate_top + rate_low]))
+    names = dict(zip(all_uids, await redis.hmget("user_names", all_uids))) if all_uids else {}
+
+    def mention(uid):
+        return get_mention(uid, names.get(uid) or "未知玩家")
+
+    for heading, rows, sign in (("📈 <b>赢家榜 TOP 5</b>", winners, "+"),
+                                ("\n📉 <b>散财榜 TOP 5</b>", losers, "-"),
+                                ("\n💰 <b>净赢家 TOP 5</b>", net_top, "+")):
+        lines.append(heading)
+        rows = [(uid, score) for uid, score in rows if score > 0]
+        if not rows:
+            lines.append("暂无数据。")
+        for i, (uid, score) in enumerate(rows):
+            lines.append(f"{i+1}. {mention(uid)} | {sign}{score:g}")
+
+    for heading, rows in ((f"\n📈 <b>胜率 TOP 5</b>（≥{RANK_RATE_MIN_GAMES}局）", rate_top),
+                          (f"\n📉 <b>胜率 LAST 5</b>（≥{RANK_RATE_MIN_GAMES}局）", rate_low)):
+        lines.append(heading)
+        if not rows:
+            lines.append("暂无胜率数据。")
+        for i, (uid, wins, losses, draws) in enumerate(rows):
+            total = wins + losses + draws
+            draw_str = f" {draws}平" if draws > 0 else ""
+            lines.append(f"{i+1}. {mention(uid)} | {wins / total * 100:.1f}%（{wins}胜 {losses}负{draw_str} / {total}局）")
+    return "\n".join(lines)
+
+
+@router.message(CleanTextFilter(), Command("dice_rank_archive"))
+async def cmd_rank_archive(message: types.Message):
+    args = message.text.split()
+    if len(args) < 2:
+        periods = await list_archived_periods()
+        if not periods:
+            return await reply_and_auto_delete(message, "📭 暂无归档榜单，每日收盘后自动归档。")
+        lines = ["🗄 <b>最近归档的榜单</b>\n"]
+        for period_type, period_key, players in periods:
+            lines.append(f"• <code>{format_archive_period(period_type, period_key)}</code> {ARCHIVE_TYPE_NAMES[period_type]} | {players}人")
+        lines.append("\n用法：<code>/dice_rank_archive 20260101</code> / <code>2026-W03</code> / <code>202601</code>")
+        bot_msg = await message.reply("\n".join(lines))
+        asyncio.create_task(delete_msgs([message, bot_msg], 60))
+        return
+
+    parsed = parse_archive_period(args[1])
+    if not parsed:
+        return await reply_and_auto_delete(message, "❌ 周期格式错误！日榜 20260101，周榜 2026-W03，月榜 202601。")
+    if not await is_period_archived(*parsed):
+        return await reply_and_auto_delete(message, "❌ 该周期尚未归档（未收盘或没有记录）。")
+    bot_msg = await message.reply(await render_archive_text(*parsed))
+    asyncio.create_task(delete_msgs([message, bot_msg], 60))
+
+
 @router.message(CleanTextFilter(), Command("dice_bal"))
 async def check_balance(message: types.Message):
     uid = str(message.from_user.id)
     bal = await get_or_init_balance(uid)
     _, _, monthly_k = get_period_keys()
-    wins = float(await redis.zscore(f"rank_wins:monthly:{monthly_k}", uid) or 0)
-    losses = float(await redis.zscore(f"rank_losses:monthly:{monthly_k}", uid) or 0)
-    draws = float(await redis.zscore(f"rank_draws:monthly:{monthly_k}", uid) or 0)
+    # 本月胜负平取结算时累加的个人汇总，一次 HMGET
+    month, wins, losses, draws = await redis.hmget(f"user_stats:{uid}", "month", "month_w", "month_l", "month_d")
+    if month != monthly_k:
+        wins = losses = draws = 0
+    wins, losses, draws = float(wins or 0), float(losses or 0), float(draws or 0)
     total_games = int(wins + losses + draws)
     if total_games > 0:
         win_rate = wins / total_games * 100
@@ -603,6 +825,112 @@ async def check_balance(message: types.Message):
     asyncio.create_task(delete_msgs([message, bot_msg], 10))
 
 
+@router.message(CleanTextFilter(), Command("dice_me"))
+async def cmd_me(message: types.Message):
+    uid = str(message.from_user.id)
+    period_keys = get_period_keys()
+    # 排名读结算时维护的当天 / 本周 / 本月积分 key，不触发视图重建
+    bases = [f"daily:{period_keys[0]}", live_base("weekly", period_keys[1]), live_base("monthly", period_keys[2])]
+
+    # 余额、个人汇总、最近对局、各周期排名一次 pipeline 取回
+    pipe = redis.pipeline(transaction=False)
+    pipe.get(f"user_balance:{uid}")
+    pipe.hgetall(f"user_stats:{uid}")
+    pipe.lrange(f"user_recent:{uid}", 0, USER_RECENT_GAMES - 1)
+    for base in bases:
+        pipe.zrevrank(f"rank_points:{base}", uid)
+        pipe.zcard(f"rank_points:{base}")
+    bal_raw, stats, recent, *ranks = await pipe.execute()
+    bal = round(float(bal_raw), 2) if bal_raw is not None else await get_or_init_balance(uid)
+
+    streak = int(stats.get("streak", 0))
+    if streak > 0:
+        streak_str = f"🔥 {streak} 连胜"
+    elif streak < 0:
+        streak_str = f"🧊 {-streak} 连败"
+    else:
+        streak_str = "—"
+    lines = [f"👤 <b>{safe_html(message.from_user.full_name)}</b> 的战绩\n",
+             f"💰 可用积分：<b>{bal}</b>",
+             f"📊 当前连势：{streak_str}（最长连胜 {int(stats.get('best_streak', 0))}）\n"]
+
+    for i, (field, label) in enumerate((("day", "今日"), ("week", "本周"), ("month", "本月"))):
+        rank, total = ranks[2 * i], ranks[2 * i + 1]
+        if stats.get(field) != period_keys[i]:
+            lines.append(f"{label}：暂无对局")
+            continue
+        profit = int(stats.get(f"{field}_cents", 0)) / 100
+        wins, losses, draws = (int(stats.get(f"{field}_{k}", 0)) for k in ("w", "l", "d"))
+        draw_str = f" {draws}平" if draws else ""
+        rank_str = f"第 {rank + 1}/{total} 名" if rank is not None else "未上榜"
+        lines.append(f"{label}：<b>{profit:+.2f}</b> | {wins}胜 {losses}负{draw_str} | 净胜负榜{rank_str}")
+
+    lines.append(f"\n🕘 <b>最近 {USER_RECENT_GAMES} 局</b>")
+    if not recent:
+        lines.append("暂无对局记录。")
+    for raw in recent:
+        try:
+            g = json.loads(raw)
+        except Exception:
+            continue
+        ts = datetime.datetime.fromtimestamp(g["ts"], TZ_BJ).strftime("%m-%d %H:%M")
+        lines.append(f"{ts} 比{g['dir']} 押{g['bet']:g} | 第{g['rank']}/{g['players']}名 | {g['profit']:+.2f}")
+
+    bot_msg = await message.reply("\n".join(lines))
+    asyncio.create_task(delete_msgs([message, bot_msg], 30))
+
+
+@router.message(CleanTextFilter(), Command("dice_history"))
+async def cmd_history(message: types.Message):
+    target = message.reply_to_message.from_user if message.reply_to_message else message.from_user
+    if target.is_bot:
+        return await reply_and_auto_delete(message, "❌ 机器人没有对局记录。")
+    args = message.text.split()
+    limit = 10
+    if len(args) > 1:
+        if not args[1].isdigit():
+            return await reply_and_auto_delete(message, "❌ 用法：<code>/dice_history [局数]</code>，回复某人可查看对方记录。")
+        limit = max(1, min(int(args[1]), 30))
+
+    uid = str(target.id)
+    rows = await query_user_history(uid, limit)
+    if not rows:
+        return await reply_and_auto_delete(message, "📭 暂无历史对局记录。")
+    games, firsts, total_cents = await query_user_totals(uid)
+    lines = [f"📜 <b>{safe_html(target.full_name)}</b> 的历史对局",
+             f"共 {games} 局 | 第一名 {firsts} 次 | 累计盈亏 <b>{total_cents / 100:+.2f}</b>\n"]
+    for ts, direction, bet, rank, players, profit_cents, score, tie_rounds in rows:
+        t = datetime.datetime.fromtimestamp(ts, TZ_BJ).strftime("%m-%d %H:%M")
+        score_str = "逃跑" if score is None else f"{score}点"
+        tie_str = f" 加赛{tie_rounds}轮" if tie_rounds else ""
+        lines.append(f"{t} 比{direction} 押{bet:g}{tie_str} | {score_str} 第{rank}/{players}名 | {profit_cents / 100:+.2f}")
+    bot_msg = await message.reply("\n".join(lines))
+    asyncio.create_task(delete_msgs([message, bot_msg], 60))
+
+
+@router.message(CleanTextFilter(), Command("dice_h2h"))
+async def cmd_head_to_head(message: types.Message):
+    if not message.reply_to_message or message.reply_to_message.from_user.is_bot:
+        return await reply_and_auto_delete(message, "❌ 用法：回复对方的消息发送 <code>/dice_h2h</code>。")
+    me, other = message.from_user, message.reply_to_message.from_user
+    if me.id == other.id:
+        return await reply_and_auto_delete(message, "❌ 不能和自己比较。")
+
+    (games, my_better, other_better, my_cents, other_cents), recent = await query_head_to_head(str(me.id), str(other.id))
+    if not games:
+        return await reply_and_auto_delete(message, "📭 你们还没有同局交手过。")
+    my_name, other_name = get_mention(me.id, me.full_name), get_mention(other.id, other.full_name)
+    lines = [f"⚔️ {my_name} vs {other_name}",
+             f"同局 {games} 次 | 名次领先 <b>{my_better}</b> : <b>{other_better}</b>",
+             f"同局盈亏：{my_cents / 100:+.2f} vs {other_cents / 100:+.2f}\n",
+             "🕘 <b>最近交手</b>"]
+    for ts, my_rank, other_rank, my_p, other_p in recent:
+        t = datetime.datetime.fromtimestamp(ts, TZ_BJ).strftime("%m-%d %H:%M")
+        lines.append(f"{t} | 第{my_rank}名 {my_p / 100:+.2f} vs 第{other_rank}名 {other_p / 100:+.2f}")
+    bot_msg = await message.reply("\n".join(lines))
+    asyncio.create_task(delete_msgs([message, bot_msg], 60))
+
+
 @router.message(CleanTextFilter(), Command("dice_gift"))
 async def cmd_gift(message: types.Message):
     args = message.text.split()
@@ -698,7 +1026,10 @@ async def admin_set_balance(message: types.Message):
         bot_msg = await message.reply("❌ 禁止贿赂荷官🤫")
         return asyncio.create_task(delete_msgs([message, bot_msg], 10))
 
-    await redis.set(f"user_balance:{target_uid}", amount)
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(f"user_balance:{target_uid}", amount)
+    pipe.sadd(BACKUP_DIRTY_KEY, target_uid)
+    await pipe.execute()
     bot_msg = await message.reply(f"👑 <b>系统调账 (覆写)</b>\n已将该玩家的积分强制设为：<b>{amount}</b>")
     asyncio.create_task(delete_msgs([message, bot_msg], 10))
 
@@ -761,13 +1092,46 @@ async def admin_take_balance(message: types.Message):
     asyncio.create_task(delete_msgs([message, bot_msg], 10))
 
 
+@router.message(Command("dice_rain"))
+async def admin_rain(message: types.Message):
+    if message.from_user.id != SUPER_ADMIN_ID:
+        bot_msg = await message.reply("❌ 越权拦截")
+        return asyncio.create_task(delete_msgs([message, bot_msg], 10))
+
+    parts = message.text.split()
+    if len(parts) < 4:
+        return await reply_and_auto_delete(message, "❌ 用法：/dice_rain 总额 份数 分钟")
+    try:
+        raw_amount = float(parts[1])
+        amount = round(raw_amount, 2)
+        count = int(parts[2])
+        minutes = int(parts[3])
+    except ValueError:
+        return await reply_and_auto_delete(message, "❌ 格式错误！请输入有效数字。")
+    if amount != raw_amount:
+        return await reply_and_auto_delete(message, "❌ 精度拦截！最多保留两位小数。")
+    if amount <= 0 or amount > 1000000:
+        return await reply_and_auto_delete(message, "❌ 总金额必须在 0.01 到 1,000,000 之间。")
+    if count <= 0 or count > 20000:
+        return await reply_and_auto_delete(message, "❌ 份数必须在 1 到 20,000 之间。")
+    if minutes <= 0 or minutes > 30:
+        return await reply_and_auto_delete(message, "❌ 时长必须在 1 到 30 分钟之间。")
+    if amount / count < 0.01:
+        return await reply_and_auto_delete(message, "❌ 均值过低！单份至少 0.01。")
+
+    rain_id = await start_rain(message.chat.id, amount, count, minutes)
+    logging.info(f"[rain] 超管发起红包雨 rain={rain_id} 总额={amount} 份数={count} 时长={minutes}分钟")
+    asyncio.create_task(delete_msgs([message], 0))
+
+
 # ==============================
 # 发车对局核心指令
 # ==============================
 
-@router.message(CleanTextFilter(), F.text.regexp(PATTERN))
-async def handle_bet_command(message: types.Message):
-    match = PATTERN.match(message.text)
+@router.message(CleanTextFilter(), IngressFilter("bet"))
+async def handle_bet_command(message: types.Message, bet_match=None):
+    # 入口分类器已完成正则匹配，这里直接复用结果
+    match = bet_match or PATTERN.match(message.text)
     if not match:
         return
     uid = str(message.from_user.id)
@@ -867,7 +1231,7 @@ async def handle_bet_command(message: types.Message):
 # Callback handlers
 # ==============================
 
-@router.callback_query(F.data == "confirm_restore")
+@router.callback_query(F.data.startswith("confirm_restore:"))
 async def handle_confirm_restore_cb(callback: types.CallbackQuery):
     try:
         await callback.answer()
@@ -885,31 +1249,19 @@ async def handle_confirm_restore_cb(callback: types.CallbackQuery):
     except:
         pass
 
-    backup_path = get_latest_backup_path()
-    if not backup_path:
+    point = await get_restore_point(int(callback.data.split(":")[1]))
+    if not point:
         try:
-            await callback.message.edit_text("⚠️ 未找到可用备份文件，无法恢复！")
+            await callback.message.edit_text("⚠️ 恢复点已过期或不存在，无法恢复！")
         except:
             pass
         return
 
-    def db_read():
-        try:
-            if not os.path.exists(backup_path):
-                return "备份文件不存在"
-            conn = sqlite3.connect(backup_path)
-            c = conn.cursor()
-            c.execute("SELECT uid, balance, name, last_checkin, streak FROM users")
-            rows = c.fetchall()
-            conn.close()
-            return rows
-        except Exception as e:
-            return str(e)
-
-    rows = await asyncio.to_thread(db_read)
-    if isinstance(rows, str):
+    try:
+        rows = await load_restore_point(point[0])
+    except Exception as e:
         try:
-            await callback.message.edit_text(f"❌ 读取异常：{rows}")
+            await callback.message.edit_text(f"❌ 读取异常：{e}")
         except:
             pass
         return
@@ -921,21 +1273,130 @@ async def handle_confirm_restore_cb(callback: types.CallbackQuery):
             pass
         return
 
-    for uid, bal, name, last_checkin, streak in rows:
-        await redis.set(f"user_balance:{uid}", bal)
-        await redis.hset("user_names", uid, name)
-        if last_checkin or streak:
-            await redis.hset(f"user_data:{uid}", mapping={"last_checkin": last_checkin, "streak": str(streak)})
+    last_edit = 0.0
+
+    async def progress(done: int, total: int):
+        nonlocal last_edit
+        # 编辑限速：最多每 2 秒一次，最后一批必发
+        if done < total and time.time() - last_edit < 2:
+            return
+        last_edit = time.time()
+        try:
+            await callback.message.edit_text(f"⏳ 正在恢复：<b>{done}</b> / {total}（{done / total:.0%}）")
+        except:
+            pass
+
+    await restore_users(rows, progress)
+    try:
+        await callback.message.edit_text(f"🔎 写入完成，正在校验 {len(rows)} 个用户...")
+    except:
+        pass
+    ok, expected, actual, mismatched = await verify_restore(rows)
+    verify_line = (f"🔐 校验通过：<code>{expected[:16]}</code>" if ok else
+                   f"⚠️ 校验不一致：期望 <code>{expected[:16]}</code> 实际 <code>{actual[:16]}</code>\n"
+                   f"示例 uid：{', '.join(mismatched)}（可能是恢复期间有新的余额变动）")
 
     try:
         await callback.message.edit_text(
             f"✅ <b>系统恢复成功！</b>\n"
-            f"来源文件：<code>{backup_path}</code>\n"
-            f"已恢复 <b>{len(rows)}</b> 个用户的核心资产。"
+            f"恢复点：<code>{format_restore_point(point)}</code>\n"
+            f"已恢复 <b>{len(rows)}</b> 个用户的核心资产。\n"
+            f"{verify_line}"
         )
     except:
         pass
-    asyncio.create_task(delete_msgs([callback.message], 10))
+    asyncio.create_task(delete_msgs([callback.message], 30 if ok else 300))
+
+
+@router.callback_query(F.data.startswith("confirm_snapload:"))
+async def handle_confirm_snapshot_load_cb(callback: types.CallbackQuery):
+    try:
+        await callback.answer()
+    except:
+        pass
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        try:
+            await callback.answer("❌ 越权拦截", show_alert=True)
+        except:
+            pass
+        return
+
+    snap = await get_snapshot(int(callback.data.split(":")[1]))
+    if not snap:
+        try:
+            await callback.message.edit_text("⚠️ 快照已被清理或不存在，无法导入！")
+        except:
+            pass
+        return
+
+    sid, _, total = snap
+    last_edit = 0.0
+
+    async def progress(done: int):
+        nonlocal last_edit
+        if time.time() - last_edit < 2:
+            return
+        last_edit = time.time()
+        try:
+            await callback.message.edit_text(f"⏳ 正在导入快照 #{sid}：<b>{done}</b> / {total}")
+        except:
+            pass
+
+    try:
+        done = await import_snapshot(sid, progress)
+    except Exception as e:
+        try:
+            await callback.message.edit_text(f"❌ 导入异常：{e}")
+        except:
+            pass
+        return
+    try:
+        await callback.message.edit_text(
+            f"✅ <b>快照导入完成！</b>\n"
+            f"快照：<code>{format_snapshot(snap)}</code>\n"
+            f"已写回 <b>{done}</b> 个 key。"
+        )
+    except:
+        pass
+    asyncio.create_task(delete_msgs([callback.message], 30))
+
+
+@router.callback_query(F.data.startswith("restore_dry:"))
+async def handle_restore_dry_run_cb(callback: types.CallbackQuery):
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        try:
+            await callback.answer("❌ 越权拦截", show_alert=True)
+        except:
+            pass
+        return
+    try:
+        await callback.answer("正在对比...")
+    except:
+        pass
+
+    point = await get_restore_point(int(callback.data.split(":")[1]))
+    if not point:
+        try:
+            await callback.message.edit_text("⚠️ 恢复点已过期或不存在！")
+        except:
+            pass
+        return
+    diff = await diff_restore_point(point[0])
+    lines = [f"🔍 <b>恢复预演</b>（未写入任何数据）",
+             f"恢复点：<code>{format_restore_point(point)}</code>\n",
+             f"🆕 备份有、线上无（将新建）：<b>{diff['create']}</b>",
+             f"✏️ 数据不同（将覆盖）：<b>{diff['changed']}</b>",
+             f"✅ 完全相同：<b>{diff['same']}</b>",
+             f"➖ 仅线上有（不受影响）：<b>{diff['keep']}</b>",
+             f"💰 余额净变化：<b>{diff['delta']:+.2f}</b>"]
+    if diff["top"]:
+        lines.append("\n<b>变化最大</b>")
+        for uid, live_bal, backup_bal in diff["top"]:
+            lines.append(f"• <code>{uid}</code>：{live_bal:g} → {backup_bal:g}")
+    try:
+        await callback.message.edit_text("\n".join(lines), reply_markup=get_restore_markup(point[0]))
+    except:
+        pass
 
 
 @router.callback_query(F.data == "cancel_restore")
@@ -963,16 +1424,16 @@ async def handle_rank_switch_cb(callback: types.CallbackQuery):
     period = parts[1]
     board = parts[2]
     target_uid = parts[3] if len(parts) > 3 else ""
+    period_key = parts[4] if period == "range" and len(parts) > 4 else None
 
     if target_uid and str(callback.from_user.id) != target_uid:
         return await callback.answer("⚠️ 只有唤起该榜单的人可以切换！", show_alert=True)
 
     await redis.expire(f"rank_msg:{callback.message.chat.id}:{callback.message.message_id}", 60)
 
-    title_map = {"daily": "今日", "weekly": "本周", "monthly": "本月"}
-    title = title_map[period] + ("净胜负榜" if board == "net" else "胜负榜")
-    text = await get_leaderboard_text(period, board, title)
-    markup = get_rank_markup(period, board, target_uid)
+    title = get_rank_title(period, board, period_key or "")
+    text = await get_leaderboard_text(period, board, title, period_key)
+    markup = get_rank_markup(period, board, target_uid, period_key or "")
     try:
         await callback.message.edit_text(text, reply_markup=markup)
     except:
@@ -1096,12 +1557,14 @@ async def handle_join(callback: types.CallbackQuery):
             keys.append([types.InlineKeyboardButton(text="🚀 庄家强行发车", callback_data=f"fs:{game_id}:{players[0]}")])
             txt = (f"🎲 <b>定员组局 ({len(players)}/{target_players})</b>\n"
                    f"押注：<b>{_amt:g}</b> | 骰子：<b>{_dc}</b>颗 | 比<b>{_dir}</b>\n"
+                   f"{odds_line(_dir, _dc, target_players)}\n"
                    f"当前：{player_list_str}\n死等满员👇")
         else:
             keys.append([types.InlineKeyboardButton(text="🚀 庄家强行发车", callback_data=f"fs:{game_id}:{players[0]}")])
             await redis.hset(game_key, "join_deadline", str(time.time() + 15))
             txt = (f"🎲 <b>多人发车 ({len(players)}/5)</b>\n"
                    f"押注：<b>{_amt:g}</b> | 骰子：<b>{_dc}</b>颗 | 比<b>{_dir}</b>\n"
+                   f"{odds_line(_dir, _dc, len(players))}\n"
                    f"当前：{player_list_str}\n15秒无人进则开局👇")
 
         try:
@@ -1114,21 +1577,16 @@ async def handle_join(callback: types.CallbackQuery):
 async def handle_grab_rp(callback: types.CallbackQuery):
     rp_id = callback.data.split(":")[1]
     uid = str(callback.from_user.id)
-    rp_key = f"redpack_meta:{rp_id}"
-    list_key = f"redpack_list:{rp_id}"
 
-    if not await redis.exists(rp_key):
+    # 去重、弹出、记录、入账在 Redis 端一次原子完成，连点也只能领一份
+    [(_, status, amt, claimed, info)] = await claim_redpacks(uid, callback.from_user.first_name, [rp_id])
+    if status == "expired":
         return await callback.answer("已过期", show_alert=True)
-    if await redis.hget(f"redpack_users:{rp_id}", uid):
+    if status == "dup":
         return await callback.answer("抢过了！", show_alert=True)
-
-    amt_str = await redis.lpop(list_key)
-    if not amt_str:
+    if status != "ok":
         return await callback.answer("抢光了！", show_alert=True)
 
-    amt = float(amt_str)
-    await redis.hset(f"redpack_users:{rp_id}", uid, f"{callback.from_user.first_name}|{amt}")
-    await update_balance(uid, amt)
     await callback.answer(f"抢到 {amt} 积分！", show_alert=True)
 
     text, markup = await build_redpack_panel(rp_id, is_pw=False)
@@ -1137,18 +1595,30 @@ async def handle_grab_rp(callback: types.CallbackQuery):
     except:
         pass
 
-    meta = await redis.hgetall(rp_key)
-    users_data = await redis.hgetall(f"redpack_users:{rp_id}")
-    sender_uid = meta.get("sender_uid")
-    sender_name = meta.get("sender_name", "某人")
+    sender_uid = info["sender_uid"]
+    sender_name = info["sender_name"]
     sender_mention = get_mention(sender_uid, sender_name) if sender_uid else safe_html(sender_name)
 
     announce_msg = await bot.send_message(callback.message.chat.id, f"🎉 {get_mention(uid, callback.from_user.first_name)} 领取了 {sender_mention} 的拼手气红包，获得 <b>{amt}</b> 积分！", message_thread_id=ALLOWED_THREAD_ID or None)
     asyncio.create_task(delete_msgs([announce_msg], 10))
 
-    if len(users_data) >= int(meta.get('count', 0)):
-        if meta.get('msg_id'):
-            asyncio.create_task(delete_msg_by_id(callback.message.chat.id, int(meta['msg_id']), delay=60))
+    if claimed >= int(info["count"]):
+        if info["msg_id"]:
+            asyncio.create_task(delete_msg_by_id(callback.message.chat.id, int(info["msg_id"]), delay=60))
+
+
+@router.callback_query(F.data.startswith("rain:"))
+async def handle_grab_rain(callback: types.CallbackQuery):
+    rain_id = callback.data.split(":")[1]
+    # 高并发场景：只回 toast，不逐条编辑面板、不发领取播报，面板由 rain 模块限速聚合刷新
+    status, amt = await grab_rain(rain_id, str(callback.from_user.id), callback.from_user.first_name)
+    if status == "ok":
+        return await callback.answer(f"🌧 抢到 {amt:g} 积分！")
+    if status == "dup":
+        return await callback.answer("这一波抢过了，等下一波！")
+    if status == "empty":
+        return await callback.answer("这一波抢光了，等下一波！")
+    await callback.answer("红包雨已结束", show_alert=True)
 
 
 @router.callback_query(F.data.startswith("ev_p:"))
@@ -1517,12 +1987,11 @@ async def handle_attack_defender(callback: types.CallbackQuery):
 
 @router.message(
     CleanTextFilter(),
+    F.text,
     # 这两个命令在 blackhole_router 中处理，必须放行到后续 router。
-    F.text.regexp(r"^/(?!dice_(?:maintain|compensate)\b)dice_[A-Za-z0-9_@]+"),
+    IngressFilter("command", exclude_cmds=("dice_maintain", "dice_compensate")),
 )
-async def cmd_unknown_dice(message: types.Message):
-    token = ((message.text or "").strip().split() or [""])[0]
-    cmd = token.lstrip("/").split("@", 1)[0]
-    if cmd in KNOWN_DICE_COMMANDS:
+async def cmd_unknown_dice(message: types.Message, ingress_cmd: str = ""):
+    if ingress_cmd in KNOWN_DICE_COMMANDS:
         return
     await reply_and_auto_delete(message, "❌ 未知命令，发送 /dice_help 查看可用命令。")
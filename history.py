@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+import logging
+
+from config import HISTORY_DB
+from sqlstore import SqliteStore
+
+# ==============================
+# 对局历史：结算时入队，后台批量写 SQLite（WAL，独立线程），事件循环只负责入队
+# ==============================
+
+HISTORY_BATCH = 200
+HISTORY_FLUSH_INTERVAL = 2
+HISTORY_QUEUE_LIMIT = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id    TEXT PRIMARY KEY,
+    chat_id    INTEGER NOT NULL,
+    ts         INTEGER NOT NULL,
+    direction  TEXT NOT NULL,
+    bet        REAL NOT NULL,
+    dice_count INTEGER NOT NULL,
+    tie_rounds INTEGER NOT NULL DEFAULT 0,
+    players    INTEGER NOT NULL,
+    forced     INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id      TEXT NOT NULL,
+    uid          TEXT NOT NULL,
+    ts           INTEGER NOT NULL,
+    rank         INTEGER NOT NULL,
+    profit_cents INTEGER NOT NULL,
+    score        INTEGER,
+    rolls        TEXT NOT NULL,
+    PRIMARY KEY (game_id, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_game_players_uid_ts ON game_players (uid, ts);
+CREATE TABLE IF NOT EXISTS game_pairs (
+    uid_a          TEXT NOT NULL,
+    uid_b          TEXT NOT NULL,
+    game_id        TEXT NOT NULL,
+    ts             INTEGER NOT NULL,
+    rank_a         INTEGER NOT NULL,
+    rank_b         INTEGER NOT NULL,
+    profit_a_cents INTEGER NOT NULL,
+    profit_b_cents INTEGER NOT NULL,
+    PRIMARY KEY (uid_a, uid_b, game_id)
+);
+CREATE INDEX IF NOT EXISTS idx_game_pairs_ab_ts ON game_pairs (uid_a, uid_b, ts);
+"""
+
+history_store = SqliteStore(HISTORY_DB, _SCHEMA)
+_queue: asyncio.Queue = asyncio.Queue(maxsize=HISTORY_QUEUE_LIMIT)
+
+
+def record_game_history(record: dict):
+    """结算时调用，只入队不落盘。record 含 game_id/chat_id/ts/direction/bet/dice_count/tie_rounds/forced
+    以及 players: [{uid, rank, profit_cents, score, rolls}, ...]"""
+    try:
+        _queue.put_nowait(record)
+    except asyncio.QueueFull:
+        logging.warning(f"[history] 写入队列已满，丢弃对局 {record.get('game_id')}")
+
+
+def _write_batch(conn, batch: list):
+    games, players, pairs = [], [], []
+    for r in batch:
+        games.append((r["game_id"], r["chat_id"], r["ts"], r["direction"], r["bet"],
+                      r["dice_count"], r["tie_rounds"], len(r["players"]), int(r["forced"])))
+        for p in r["players"]:
+            players.append((r["game_id"], p["uid"], r["ts"], p["rank"], p["profit_cents"], p["score"], p["rolls"]))
+        # 两两成对，uid_a < uid_b，交手查询直接命中 (uid_a, uid_b) 索引
+        for a, b in itertools.combinations(sorted(r["players"], key=lambda p: p["uid"]), 2):
+            pairs.append((a["uid"], b["uid"], r["game_id"], r["ts"], a["rank"], b["rank"],
+                          a["profit_cents"], b["profit_cents"]))
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", games)
+        conn.executemany("INSERT OR IGNORE INTO game_players VALUES (?, ?, ?, ?, ?, ?, ?)", players)
+        conn.executemany("INSERT OR IGNORE INTO game_pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", pairs)
+
+
+def _drain(limit: int) -> list:
+    batch = []
+    while len(batch) < limit:
+        try:
+            batch.append(_queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+
+async def history_writer_task():
+    """攒批写入：拿到第一条后等 HISTORY_FLUSH_INTERVAL 秒，再一次性写入至多 HISTORY_BATCH 局"""
+    while True:
+        first = await _queue.get()
+        await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+        batch = [first] + _drain(HISTORY_BATCH - 1)
+        try:
+            await history_store.run(_write_batch, batch)
+        except Exception as e:
+            logging.warning(f"[history] 批量写入失败 {len(batch)} 局: {e}")
+
+
+async def flush_game_history():
+    """停机前把队列里剩余的对局写完"""
+    while True:
+        batch = _drain(HISTORY_BATCH)
+        if not batch:
+            break
+        try:
+            await history_store.run(_write_batch, batch)
+        except Exception as e:
+            logging.warning(f"[history] 停机写入失败 {len(batch)} 局: {e}")
+            break
+    await history_store.close()
+
+
+async def query_user_history(uid: str, limit: int = 10) -> list:
+    """最近 N 局：[(ts, direction, bet, rank, players, profit_cents, score, tie_rounds), ...]，走 (uid, ts) 索引"""
+    return await history_store.query(
+        "SELECT gp.ts, g.direction, g.bet, gp.rank, g.players, gp.profit_cents, gp.score, g.tie_rounds "
+        "FROM game_players gp JOIN games g ON g.game_id = gp.game_id "
+        "WHERE gp.uid = ? ORDER BY gp.ts DESC LIMIT ?",
+        (uid, limit),
+    )
+
+
+async def query_user_totals(uid: str) -> tuple:
+    """(总局数, 第一名次数, 总盈亏分)"""
+    rows = await history_store.query(
+        "SELECT COUNT(*), COALESCE(SUM(rank = 1), 0), COALESCE(SUM(profit_cents), 0) FROM game_players WHERE uid = ?",
+        (uid,),
+    )
+    return rows[0]
+
+
+async def query_head_to_head(uid: str, other: str, limit: int = 5) -> tuple:
+    """交手统计，返回 (汇总, 最近 N 局)，均以 uid 视角；汇总 = (同局数, uid 名次更好, 对方名次更好, uid 盈亏分, 对方盈亏分)"""
+    swap = uid > other
+    a, b = (other, uid) if swap else (uid, other)
+    summary = (await history_store.query(
+        "SELECT COUNT(*), COALESCE(SUM(rank_a < rank_b), 0), COALESCE(SUM(rank_a > rank_b), 0), "
+        "COALESCE(SUM(profit_a_cents), 0), COALESCE(SUM(profit_b_cents), 0) "
+        "FROM game_pairs WHERE uid_a = ? AND uid_b = ?",
+        (a, b),
+    ))[0]
+    recent = await history_store.query(
+        "SELECT ts, rank_a, rank_b, profit_a_cents, profit_b_cents FROM game_pairs "
+        "WHERE uid_a = ? AND uid_b = ? ORDER BY ts DESC LIMIT ?",
+        (a, b, limit),
+    )
+    if swap:
+        games, a_better, b_better, a_cents, b_cents = summary
+        summary = (games, b_better, a_better, b_cents, a_cents)
+        recent = [(ts, rb, ra, pb, pa) for ts, ra, rb, pa, pb in recent]
+    return summary, recent
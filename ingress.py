@@ -0,0 +1,74 @@
+import re
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, types
+from aiogram.filters import BaseFilter
+
+from config import PATTERN
+from redpack import pw_hint_matches
+
+# 只订阅实际处理的更新类型，其余类型 Telegram 不再推送
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+_DICE_CMD_RE = re.compile(r"^/(dice_[A-Za-z0-9_]+)(?:@[A-Za-z0-9_]+)?(?:\s|$)")
+
+
+def classify_update(update: types.Update) -> dict | None:
+    """入口分类：每个更新只打一次标签（command / bet / dice / pw / callback）。
+
+    返回注入 handler 的 data；返回 None 表示闲聊，直接丢弃，不触发任何 Redis 调用。
+    口令按进程内口令表判断，该表经 pub/sub 与 Redis 索引保持同步。
+    """
+    if update.callback_query:
+        data = update.callback_query.data or ""
+        return {"ingress_tag": "callback", "callback_prefix": data.split(":", 1)[0]}
+
+    message = update.message
+    if not message:
+        return None
+    if message.dice:
+        return {"ingress_tag": "dice"}
+
+    text = message.text or message.caption
+    if not text:
+        return None
+    m = _DICE_CMD_RE.match(text)
+    if m:
+        return {"ingress_tag": "command", "ingress_cmd": m.group(1)}
+    if message.text:
+        bet = PATTERN.match(message.text)
+        if bet:
+            return {"ingress_tag": "bet", "bet_match": bet}
+        if pw_hint_matches(message.chat.id, message.text.strip()):
+            return {"ingress_tag": "pw"}
+    return None
+
+
+class IngressMiddleware(BaseMiddleware):
+    """挂在 dp.update 外层：Webhook 入口已分类的直接透传，轮询模式在此分类"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        if "ingress_tag" not in data:
+            tags = classify_update(event)
+            if tags is None:
+                return
+            data.update(tags)
+        return await handler(event, data)
+
+
+class IngressFilter(BaseFilter):
+    """按入口标签匹配 handler，替代重复的正则过滤"""
+
+    def __init__(self, tag: str, exclude_cmds: tuple = ()):
+        self.tag = tag
+        self.exclude_cmds = exclude_cmds
+
+    async def __call__(self, message: types.Message, ingress_tag: str = None, ingress_cmd: str = None) -> bool:
+        if ingress_tag != self.tag:
+            return False
+        return not (ingress_cmd and ingress_cmd in self.exclude_cmds)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from core import redis
+
+# 后台定时任务的主节点选举：多副本/重启重叠时，只有持有租约的进程执行任务
+LEASE_KEY = "leader:jobs"
+LEASE_TTL = 30
+LEASE_RENEW_INTERVAL = 10
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_is_leader = False
+
+# 快照导入期间的全局维护标记：所有群暂停处理，主节点的红包过期、红包雨 ticker 也暂停
+MAINTENANCE_ALL_KEY = "maintenance:all"
+
+# 仅当 key 仍归属本实例时才续期 / 释放，避免误伤新主节点
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_renew_script = redis.register_script(_RENEW_LUA)
+_release_script = redis.register_script(_RELEASE_LUA)
+
+
+def is_leader() -> bool:
+    return _is_leader
+
+
+async def globally_paused() -> bool:
+    return bool(await redis.exists(MAINTENANCE_ALL_KEY))
+
+
+async def _try_acquire_or_renew() -> bool:
+    if _is_leader:
+        return bool(await _renew_script(keys=[LEASE_KEY], args=[INSTANCE_ID, LEASE_TTL]))
+    return bool(await redis.set(LEASE_KEY, INSTANCE_ID, nx=True, ex=LEASE_TTL))
+
+
+async def leader_lease_task():
+    global _is_leader
+    while True:
+        try:
+            held = await _try_acquire_or_renew()
+        except Exception as e:
+            logging.warning(f"[leader] 租约续期异常: {e}")
+            held = False
+        if held != _is_leader:
+            if held:
+                logging.info(f"[leader] 本实例成为后台任务主节点 id={INSTANCE_ID}")
+            else:
+                logging.warning(f"[leader] 本实例失去主节点租约 id={INSTANCE_ID}")
+        _is_leader = held
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+
+async def release_leadership():
+    global _is_leader
+    if not _is_leader:
+        return
+    _is_leader = False
+    try:
+        await _release_script(keys=[LEASE_KEY], args=[INSTANCE_ID])
+    except Exception as e:
+        logging.warning(f"[leader] 释放租约失败: {e}")
+
+
+async def run_once(run_key: str, ttl: int = 86400 * 3) -> bool:
+    """单次运行幂等键：同一 run_key 在 ttl 内只有第一个调用者返回 True"""
+    return bool(await redis.set(f"job_run:{run_key}", INSTANCE_ID, nx=True, ex=ttl))
+
+
+async def release_run(run_key: str):
+    """执行失败时释放幂等键（仅限本实例持有的），让补跑或其他实例可以重试"""
+    try:
+        await _release_script(keys=[f"job_run:{run_key}"], args=[INSTANCE_ID])
+    except Exception as e:
+        logging.warning(f"[leader] 释放 {run_key} 失败: {e}")
+
+
+async def should_run(run_key: str, ttl: int = 86400 * 3) -> bool:
+    """定时任务执行前的统一闸门：必须是主节点，且本轮尚未被任何实例执行过"""
+    if not _is_leader:
+        logging.info(f"[leader] 非主节点，跳过 {run_key}")
+        return False
+    if not await run_once(run_key, ttl):
+        logging.info(f"[leader] {run_key} 已执行过，跳过")
+        return False
+    return True
@@ -0,0 +1,117 @@
+"""骰子点数精确分布与 N 人局胜/平/负概率表
+
+点数规则与 game_settle.calculate_score_with_details 一致：底数 + 同点加成，顺子 ×2，最后 % 10。
+1–5 颗骰子共 6^k 种结果全枚举（最多 7776 种），导入时读磁盘缓存，缓存缺失或过期就在内存里现算，不写文件。
+
+    python odds.py          # 构建步骤：重建缓存并与结算函数逐一核对
+"""
+import itertools
+import json
+import logging
+import os
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+# 修改 calculate_score_with_details 的规则后必须递增，旧缓存自动作废
+ODDS_RULES_VERSION = 2
+ODDS_CACHE = os.getenv("ODDS_CACHE", "odds_table.json").strip() or "odds_table.json"
+DICE_RANGE = range(1, 6)
+PLAYER_RANGE = range(2, 6)
+
+
+def _score_pmf_numpy(k: int) -> list:
+    faces = np.indices((6,) * k).reshape(k, -1).T + 1
+    counts = np.stack([(faces == f).sum(axis=1) for f in range(1, 7)], axis=1)
+    pair_bonus = np.clip(counts - 1, 0, None).sum(axis=1)
+    straight = ((counts > 0).sum(axis=1) == k) & (k > 2) & (faces.max(axis=1) - faces.min(axis=1) == k - 1)
+    total = (faces.sum(axis=1) + pair_bonus) * np.where(straight, 2, 1)
+    return (np.bincount(total % 10, minlength=10) / 6 ** k).tolist()
+
+
+def _score_pmf_reference(k: int) -> list:
+    from game_settle import calculate_score_with_details
+    hist = [0] * 10
+    for faces in itertools.product(range(1, 7), repeat=k):
+        hist[calculate_score_with_details(list(faces))[0]] += 1
+    return [c / 6 ** k for c in hist]
+
+
+def _player_odds(pmf: list, direction: str, n: int) -> list:
+    """单个玩家（同分布独立）在 n 人局首轮：[独占第一, 与人同分进加赛, 其余]
+
+    结算时任意一组同分都会加赛（不只是并列第一），所以「加赛」按本人与至少一人同分计算；
+    独占第一的玩家不会与任何人同分，两者互斥
+    """
+    win = tie = 0.0
+    below = 0.0
+    order = range(10) if direction == "大" else range(9, -1, -1)
+    # below = 比当前点数更差的概率，逐点累加
+    for s in order:
+        win += pmf[s] * below ** (n - 1)
+        tie += pmf[s] * (1 - (1 - pmf[s]) ** (n - 1))
+        below += pmf[s]
+    return [win, tie, max(0.0, 1 - win - tie)]
+
+
+def build_odds_tables() -> dict:
+    score_pmf = _score_pmf_numpy if _HAS_NUMPY else _score_pmf_reference
+    pmfs = {str(k): score_pmf(k) for k in DICE_RANGE}
+    players = {
+        direction: {k: {str(n): _player_odds(pmf, direction, n) for n in PLAYER_RANGE} for k, pmf in pmfs.items()}
+        for direction in ("大", "小")
+    }
+    return {"version": ODDS_RULES_VERSION, "score_pmf": pmfs, "players": players}
+
+
+def load_odds_tables() -> dict:
+    """只读：缓存有效就用缓存，否则内存里现算；写缓存是 save_odds_tables / python odds.py 的事"""
+    try:
+        with open(ODDS_CACHE, encoding="utf-8") as f:
+            tables = json.load(f)
+        if tables.get("version") == ODDS_RULES_VERSION:
+            return tables
+    except Exception:
+        pass
+    logging.info(f"[odds] 概率表缓存缺失或过期，本次在内存中计算（python odds.py 可重建 {ODDS_CACHE}）")
+    return build_odds_tables()
+
+
+def save_odds_tables(tables: dict):
+    with open(ODDS_CACHE, "w", encoding="utf-8") as f:
+        json.dump(tables, f, ensure_ascii=False)
+
+
+ODDS_TABLES = load_odds_tables()
+
+# 面板文案也一次性预生成，发面板时只做一次 dict 查找
+_ODDS_TEXT = {
+    (direction, int(k), int(n)): f"📐 {n}人局首轮：夺冠 {w:.1%} · 同分加赛 {t:.1%} · 落后 {l:.1%}"
+    for direction, by_dice in ODDS_TABLES["players"].items()
+    for k, by_n in by_dice.items()
+    for n, (w, t, l) in by_n.items()
+}
+
+
+def odds_line(direction: str, dice_count: int, players: int) -> str:
+    """下注面板上的概率提示；超出表范围返回空串"""
+    return _ODDS_TEXT.get((direction, int(dice_count), max(2, int(players))), "")
+
+
+if __name__ == "__main__":
+    tables = build_odds_tables()
+    save_odds_tables(tables)
+    ok = True
+    for k in DICE_RANGE:
+        ref = _score_pmf_reference(k)
+        diff = max(abs(a - b) for a, b in zip(ref, tables["score_pmf"][str(k)]))
+        ok &= diff < 1e-12
+        print(f"{k}颗：" + " ".join(f"{s}:{p:.3%}" for s, p in enumerate(ref)) + f"  误差 {diff:.1e}")
+    for direction in ("大", "小"):
+        for k in DICE_RANGE:
+            print(f"比{direction} {k}颗 | " + " | ".join(odds_line(direction, k, n) for n in PLAYER_RANGE))
+    print("核对通过" if ok else "核对失败：缓存与结算规则不一致")
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import time
+import uuid
+
+from aiogram import types
+
+from config import ALLOWED_THREAD_ID
+from core import bot, redis
+from utils import get_mention, safe_tg_call
+from redpack import split_redpack_cents, pack_shares, _TAKE_SHARE_LUA
+from balance import BACKUP_DIRTY_KEY
+from leader import is_leader, globally_paused
+
+# 红包雨：管理员发起，在时间窗口内分波次投放大量小额红包到共享池
+# 状态全部在 Redis：rain:{id} 记录当前波次与面板，ZSET rain_schedule（score = 下一波 / 结束时间）驱动主节点 ticker，
+# 重启或换主节点后直接接续；每波沿用普通红包的打包份额（redpack_meta / redpack_shares / redpack_users）
+RAIN_WAVE_SECS = 10        # 每波间隔
+RAIN_PANEL_INTERVAL = 3    # 聚合面板最短编辑间隔
+RAIN_FLUSH_INTERVAL = 2    # 待入账积分批量结算间隔，也是 ticker 周期
+RAIN_FLUSH_BATCH = 200
+RAIN_SCHEDULE_KEY = "rain_schedule"
+
+
+def rain_key(rain_id: str) -> str:
+    return f"rain:{rain_id}"
+
+
+def rain_credit_key(rain_id: str) -> str:
+    return f"rain_credit:{rain_id}"
+
+
+def rain_board_key(rain_id: str) -> str:
+    return f"rain_board:{rain_id}"
+
+
+def rain_names_key(rain_id: str) -> str:
+    return f"rain_names:{rain_id}"
+
+
+def rain_wave_keys(rp_id: str) -> list:
+    return [f"redpack_meta:{rp_id}", f"redpack_shares:{rp_id}", f"redpack_list:{rp_id}", f"redpack_users:{rp_id}"]
+
+
+# 抢一份：去重 -> 按下标取一份 -> 记录领取人 -> 记入待入账 -> 累计统计并标记面板待刷新
+# 每波第一位领取人负责给本波 users 与待入账 / 手气榜 / 名字表设置与 meta 相同的 TTL
+# KEYS = 波次 meta, shares, list, users, rain 汇总, 待入账哈希, 手气榜, 名字表；ARGV = uid, 名字
+_RAIN_CLAIM_LUA = _TAKE_SHARE_LUA + """
+local meta_key, shares_key, list_key, users_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local rain_key, credit_key, board_key, names_key = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local uid, name = ARGV[1], ARGV[2]
+if redis.call('EXISTS', meta_key) == 0 then
+    return {'expired', ''}
+end
+if redis.call('HEXISTS', users_key, uid) == 1 then
+    return {'dup', ''}
+end
+local amt = take_share(meta_key, shares_key, list_key)
+if not amt then
+    return {'empty', ''}
+end
+redis.call('HSET', users_key, uid, name .. '|' .. amt)
+redis.call('HINCRBYFLOAT', credit_key, uid, amt)
+redis.call('ZINCRBY', board_key, amt, uid)
+redis.call('HSET', names_key, uid, name)
+if redis.call('HLEN', users_key) == 1 then
+    local ttl = redis.call('TTL', meta_key)
+    for i = 4, 8 do
+        if i ~= 5 then
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+    end
+end
+redis.call('HINCRBY', rain_key, 'claimed', 1)
+redis.call('HINCRBY', rain_key, 'claimed_cents', math.floor(tonumber(amt) * 100 + 0.5))
+redis.call('HSET', rain_key, 'dirty', '1')
+return {'ok', amt}
+"""
+
+# 批量入账：把待入账哈希里的积分原子地搬进余额（与 get_or_init_balance 同样的 20000 初始化）
+# KEYS = 待入账哈希, 余额 key..., 备份脏集合；ARGV = 与余额 key 一一对应的 uid
+_RAIN_CREDIT_LUA = """
+local credited = 0
+for i = 1, #ARGV do
+    local amt = redis.call('HGET', KEYS[1], ARGV[i])
+    if amt then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        local bal_key = KEYS[i + 1]
+        if redis.call('EXISTS', bal_key) == 0 then
+            redis.call('SET', bal_key, '20000')
+        end
+        redis.call('INCRBYFLOAT', bal_key, amt)
+        redis.call('SADD', KEYS[#KEYS], ARGV[i])
+        credited = credited + 1
+    end
+end
+return credited
+"""
+
+_rain_claim_script = redis.register_script(_RAIN_CLAIM_LUA)
+_rain_credit_script = redis.register_script(_RAIN_CREDIT_LUA)
+
+
+def _split_cents(total_cents: int, parts: int) -> list:
+    base, rem = divmod(total_cents, parts)
+    return [base + (1 if i < rem else 0) for i in range(parts)]
+
+
+def rain_wave_plan(total_cents: int, count: int, waves: int) -> list:
+    """各波 (金额分, 份数)：先保证每份 1 分，剩余金额再均分到各波，避免某一波金额不够拆"""
+    wave_counts = _split_cents(count, waves)
+    extra = _split_cents(total_cents - count, waves)
+    return [(n + e, n) for n, e in zip(wave_counts, extra)]
+
+
+async def seed_rain_wave(rain_id: str, wave_idx: int, wave_cents: int, count: int, ttl: int) -> str:
+    """投放一波：整数分拆包后打包成一个份额字符串，与普通红包同一布局"""
+    rp_id = f"{rain_id}w{wave_idx}"
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(f"redpack_meta:{rp_id}", mapping={
+        "amount": f"{wave_cents / 100:.2f}", "count": str(count), "total_cents": str(wave_cents),
+        "taken": "0", "claimed_cents": "0", "rain_id": rain_id, "wave": str(wave_idx), "created_at": str(time.time()),
+    })
+    pipe.expire(f"redpack_meta:{rp_id}", ttl)
+    pipe.set(f"redpack_shares:{rp_id}", pack_shares(split_redpack_cents(wave_cents, count)), ex=ttl)
+    await pipe.execute()
+    return rp_id
+
+
+async def claim_rain(rain_id: str, rp_id: str, uid: str, name: str):
+    """返回 (status, amt)，status: ok / dup / empty / expired"""
+    keys = rain_wave_keys(rp_id) + [rain_key(rain_id), rain_credit_key(rain_id),
+                                    rain_board_key(rain_id), rain_names_key(rain_id)]
+    status, amt = await _rain_claim_script(keys=keys, args=[uid, name])
+    return status, float(amt) if amt else 0.0
+
+
+async def flush_rain_credits(rain_id: str) -> int:
+    credit_key = rain_credit_key(rain_id)
+    uids = await redis.hkeys(credit_key)
+    credited = 0
+    for i in range(0, len(uids), RAIN_FLUSH_BATCH):
+        batch = uids[i:i + RAIN_FLUSH_BATCH]
+        keys = [credit_key] + [f"user_balance:{u}" for u in batch] + [BACKUP_DIRTY_KEY]
+        credited += int(await _rain_credit_script(keys=keys, args=batch))
+    return credited
+
+
+async def recover_rain_credits():
+    """重启恢复：把上次进程未来得及入账的红包雨积分补发"""
+    async for key in redis.scan_iter("rain_credit:*"):
+        rain_id = key.split(":", 1)[1]
+        try:
+            n = await flush_rain_credits(rain_id)
+            if n:
+                logging.info(f"[rain] 重启补发红包雨积分 rain={rain_id} 人数={n}")
+        except Exception as e:
+            logging.warning(f"[rain] 重启补发失败 rain={rain_id}: {e}")
+
+
+def rain_markup(rain_id: str):
+    return types.InlineKeyboardMarkup(inline_keyboard=[[
+        types.InlineKeyboardButton(text="🌧 抢红包雨", callback_data=f"rain:{rain_id}")
+    ]])
+
+
+async def build_rain_panel(rain_id: str, finished: bool = False) -> str:
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(rain_key(rain_id))
+    pipe.zrevrange(rain_board_key(rain_id), 0, 4, withscores=True)
+    info, top = await pipe.execute()
+    if not info:
+        return ""
+    names = {}
+    if top:
+        names = dict(zip([u for u, _ in top], await redis.hmget(rain_names_key(rain_id), [u for u, _ in top])))
+
+    claimed = int(info.get("claimed", 0))
+    claimed_amount = int(info.get("claimed_cents", 0)) / 100
+    waves = int(info["waves"])
+    wave = int(info.get("wave", 0))
+    lines = [
+        "🌧 <b>红包雨" + ("已结束" if finished else "进行中！") + "</b>\n",
+        f"总额：<b>{info['amount']}</b> | 份数：<b>{info['count']}</b> | 共 <b>{waves}</b> 波",
+        f"已领：<b>{claimed}</b> 份，共 <b>{claimed_amount:g}</b> 积分",
+    ]
+    if not finished:
+        remaining = max(0, int(float(info["ends_at"]) - time.time()))
+        lines.append(f"当前第 <b>{min(wave + 1, waves)}</b> 波 | 剩余 <b>{remaining}</b> 秒")
+        lines.append("<i>每一波每人可抢 1 份，手慢无！</i>")
+    if top:
+        lines.append("\n🏆 <b>手气榜 TOP 5</b>")
+        for i, (u, amt) in enumerate(top):
+            lines.append(f"{i+1}. {get_mention(u, names.get(u) or '神秘玩家')} | <b>{amt:g}</b>")
+    return "\n".join(lines)
+
+
+async def start_rain(chat_id: int, amount: float, count: int, minutes: int) -> str:
+    """登记红包雨、投放第一波并发出面板；之后的波次、入账与面板刷新都由 rain_ticker 接手"""
+    rain_id = uuid.uuid4().hex[:8]
+    waves = max(1, minutes * 60 // RAIN_WAVE_SECS)
+    waves = min(waves, count)
+    now = time.time()
+    ttl = waves * RAIN_WAVE_SECS + 3600
+    await redis.hset(rain_key(rain_id), mapping={
+        "chat_id": str(chat_id), "amount": str(amount), "count": str(count),
+        "waves": str(waves), "wave": "0", "ends_at": str(now + waves * RAIN_WAVE_SECS),
+        "claimed": "0", "claimed_cents": "0", "dirty": "0", "panel_at": str(now),
+    })
+    await redis.expire(rain_key(rain_id), ttl)
+    wave_cents, wave_count = rain_wave_plan(int(round(amount * 100)), count, waves)[0]
+    rp_id = await seed_rain_wave(rain_id, 0, wave_cents, wave_count, ttl)
+    msg = await bot.send_message(chat_id, await build_rain_panel(rain_id), reply_markup=rain_markup(rain_id),
+                                 message_thread_id=ALLOWED_THREAD_ID or None)
+    await redis.hset(rain_key(rain_id), mapping={"wave_rp": rp_id, "msg_id": str(msg.message_id)})
+    await redis.zadd(RAIN_SCHEDULE_KEY, {rain_id: now + RAIN_WAVE_SECS})
+    return rain_id
+
+
+async def grab_rain(rain_id: str, uid: str, name: str):
+    """返回 (status, amt)，status 额外包含 closed（红包雨已结束）"""
+    rp_id = await redis.hget(rain_key(rain_id), "wave_rp")
+    if not rp_id:
+        return "closed", 0.0
+    return await claim_rain(rain_id, rp_id, uid, name)
+
+
+async def rain_ticker():
+    while True:
+        await asyncio.sleep(RAIN_FLUSH_INTERVAL)
+        if not is_leader():
+            continue
+        try:
+            # 快照导入期间不退款、不投放，避免与正在回写的 key 交错
+            if await globally_paused():
+                continue
+            await _rain_tick()
+        except Exception as e:
+            logging.warning(f"[rain] tick 异常: {e}")
+
+
+async def _rain_tick():
+    now = time.time()
+    for rain_id, due_at in await redis.zrange(RAIN_SCHEDULE_KEY, 0, -1, withscores=True):
+        try:
+            await flush_rain_credits(rain_id)
+            info = await redis.hgetall(rain_key(rain_id))
+            if not info:
+                await redis.zrem(RAIN_SCHEDULE_KEY, rain_id)
+                continue
+            if due_at <= now:
+                wave = int(info["wave"]) + 1
+                if wave >= int(info["waves"]):
+                    await _finish_rain(rain_id, info)
+                    continue
+                await _next_wave(rain_id, info, wave, due_at)
+            elif info.get("dirty") == "1" and now - float(info.get("panel_at", 0)) >= RAIN_PANEL_INTERVAL:
+                await _refresh_panel(rain_id, info)
+        except Exception as e:
+            logging.warning(f"[rain] 处理失败 rain={rain_id}: {e}")
+
+
+async def _next_wave(rain_id: str, info: dict, wave: int, due_at: float):
+    """投放下一波并清理上一波（未领完的份额是系统发放，不退款）"""
+    waves = int(info["waves"])
+    ttl = int(float(info["ends_at"]) - time.time()) + 3600
+    wave_cents, wave_count = rain_wave_plan(int(round(float(info["amount"]) * 100)), int(info["count"]), waves)[wave]
+    rp_id = await seed_rain_wave(rain_id, wave, wave_cents, wave_count, ttl)
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(rain_key(rain_id), mapping={"wave": str(wave), "wave_rp": rp_id, "dirty": "1"})
+    pipe.zadd(RAIN_SCHEDULE_KEY, {rain_id: due_at + RAIN_WAVE_SECS})
+    if info.get("wave_rp"):
+        pipe.delete(*rain_wave_keys(info["wave_rp"]))
+    await pipe.execute()
+
+
+async def _refresh_panel(rain_id: str, info: dict):
+    """聚合面板限速编辑：只在有人领取或换波后改，且间隔不小于 RAIN_PANEL_INTERVAL"""
+    await redis.hset(rain_key(rain_id), mapping={"dirty": "0", "panel_at": str(time.time())})
+    text = await build_rain_panel(rain_id)
+    if text:
+        await safe_tg_call(
+            lambda: bot.edit_message_text(text, chat_id=int(info["chat_id"]), message_id=int(info["msg_id"]),
+                                          reply_markup=rain_markup(rain_id)),
+            op="rain_panel",
+        )
+
+
+async def _finish_rain(rain_id: str, info: dict):
+    """收尾：ZREM 抢到处理权后关闭领取、补齐入账、刷新结算面板、清理最后一波"""
+    if not await redis.zrem(RAIN_SCHEDULE_KEY, rain_id):
+        return
+    await redis.hset(rain_key(rain_id), "wave_rp", "")
+    try:
+        await flush_rain_credits(rain_id)
+    except Exception as e:
+        logging.warning(f"[rain] 收尾入账失败 rain={rain_id}: {e}")
+    try:
+        text = await build_rain_panel(rain_id, finished=True)
+        if text and info.get("msg_id"):
+            await safe_tg_call(
+                lambda: bot.edit_message_text(text, chat_id=int(info["chat_id"]), message_id=int(info["msg_id"]),
+                                              reply_markup=None),
+                op="rain_panel_final",
+            )
+    except Exception as e:
+        logging.warning(f"[rain] 结算面板刷新失败 rain={rain_id}: {e}")
+    pipe = redis.pipeline(transaction=False)
+    if info.get("wave_rp"):
+        pipe.delete(*rain_wave_keys(info["wave_rp"]))
+    for key in (rain_key(rain_id), rain_board_key(rain_id), rain_names_key(rain_id)):
+        pipe.expire(key, 3600)
+    await pipe.execute()
+    logging.info(f"[rain] 红包雨结束 rain={rain_id} 已领={info.get('claimed', 0)}")
@@ -1,5 +1,7 @@
 import asyncio
+import json
 import logging
+import math
 import random
 import time
 
@@ -8,26 +10,304 @@ from aiogram import types
 from core import bot, redis
 from config import ALLOWED_THREAD_ID
 from utils import get_mention, safe_html, delete_msg_by_id, delete_msgs, pin_in_topic
-from balance import update_balance
-
-
-def generate_redpack_amounts(total_amount, count):
-    if count == 1:
-        return [round(total_amount, 2)]
-    amounts = []
-    rem_amount = total_amount
-    rem_count = count
-    for _ in range(count - 1):
-        max_val = (rem_amount / rem_count) * 2
-        amt = round(random.uniform(0.01, max_val), 2)
-        if amt < 0.01:
-            amt = 0.01
-        amounts.append(amt)
-        rem_amount -= amt
-        rem_count -= 1
-    amounts.append(round(rem_amount, 2))
-    random.shuffle(amounts)
-    return amounts
+from balance import update_balance, BACKUP_DIRTY_KEY
+from leader import is_leader, globally_paused
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+    logging.warning("numpy 未安装，红包拆分退回纯 Python 实现（pip install numpy 后 rebuild）")
+
+
+def pw_index_key(chat_id, pw: str) -> str:
+    """按群的口令索引：口令 -> 未挂起的红包 id 集合"""
+    return f"rp_pw_idx:{chat_id}:{pw}"
+
+
+def dice_suspended_key(chat_id) -> str:
+    """按群的已挂起「🎲」红包集合"""
+    return f"rp_dice_suspended:{chat_id}"
+
+
+# 进程内口令表：{chat_id: {口令: {rp_id}}}，供入口分类器零 Redis 判断文本是否可能是口令。
+# 以 Redis（active_pw_rps + redpack_meta）为准：启动时全量加载，之后各实例经 pub/sub 同步增删
+PW_EVENTS_CHANNEL = "rp_pw_events"
+PW_HINTS_RETRY = 5
+_pw_hints: dict = {}
+
+
+def pw_hint_add(chat_id, pw: str, rp_id: str):
+    _pw_hints.setdefault(str(chat_id), {}).setdefault(pw, set()).add(rp_id)
+
+
+def pw_hint_remove(chat_id, pw: str, rp_id: str):
+    chat_hints = _pw_hints.get(str(chat_id))
+    if not chat_hints or pw not in chat_hints:
+        return
+    chat_hints[pw].discard(rp_id)
+    if not chat_hints[pw]:
+        del chat_hints[pw]
+    if not chat_hints:
+        del _pw_hints[str(chat_id)]
+
+
+def pw_hint_matches(chat_id, text: str) -> bool:
+    chat_hints = _pw_hints.get(str(chat_id))
+    return bool(chat_hints) and text in chat_hints
+
+
+def apply_pw_event(raw: str):
+    """处理一条口令变更广播：["add"|"rem", chat_id, pw, rp_id]；"reload" 由监听循环处理"""
+    op, chat_id, pw, rp_id = json.loads(raw)
+    if op == "add":
+        pw_hint_add(chat_id, pw, rp_id)
+    elif op == "rem":
+        pw_hint_remove(chat_id, pw, rp_id)
+
+
+async def _publish_pw_event(*event):
+    try:
+        await redis.publish(PW_EVENTS_CHANNEL, json.dumps(event, ensure_ascii=False))
+    except Exception as e:
+        logging.warning(f"[redpack] 广播口令变更失败: {e}")
+
+
+async def load_pw_hints():
+    """从 Redis 全量重载进程内口令表"""
+    rp_ids = list(await redis.smembers("active_pw_rps"))
+    pipe = redis.pipeline(transaction=False)
+    for rp_id in rp_ids:
+        pipe.hmget(f"redpack_meta:{rp_id}", "pw", "chat_id")
+    hints = {}
+    for rp_id, (pw, cid) in zip(rp_ids, await pipe.execute()):
+        if pw and cid:
+            hints.setdefault(cid, {}).setdefault(pw, set()).add(rp_id)
+    _pw_hints.clear()
+    _pw_hints.update(hints)
+
+
+async def pw_hints_listener():
+    """订阅口令变更；先订阅再全量加载，断线重连后重新加载，保证不漏事件"""
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(PW_EVENTS_CHANNEL)
+            await load_pw_hints()
+            async for msg in pubsub.listen():
+                if msg.get("type") != "message":
+                    continue
+                if msg["data"] == "reload":
+                    await load_pw_hints()
+                else:
+                    apply_pw_event(msg["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"[redpack] 口令表同步中断，{PW_HINTS_RETRY}s 后重连: {e}")
+            await asyncio.sleep(PW_HINTS_RETRY)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+async def register_pw_redpack(chat_id, pw: str, rp_id: str):
+    await redis.sadd("active_pw_rps", rp_id)
+    await redis.sadd(pw_index_key(chat_id, pw), rp_id)
+    pw_hint_add(chat_id, pw, rp_id)
+    await _publish_pw_event("add", str(chat_id), pw, rp_id)
+
+
+async def unregister_pw_redpack(chat_id, pw: str, rp_id: str):
+    await redis.srem("active_pw_rps", rp_id)
+    await redis.srem(pw_index_key(chat_id, pw), rp_id)
+    if pw == "🎲":
+        await redis.srem(dice_suspended_key(chat_id), rp_id)
+    pw_hint_remove(chat_id, pw, rp_id)
+    await _publish_pw_event("rem", str(chat_id), pw, rp_id)
+
+
+async def rebuild_pw_indexes():
+    """启动或快照导入后从 active_pw_rps 重建按群索引（兼容升级前发出的红包），并通知各实例重载口令表"""
+    for rp_id in await redis.smembers("active_pw_rps"):
+        meta = await redis.hgetall(f"redpack_meta:{rp_id}")
+        if not meta:
+            await redis.srem("active_pw_rps", rp_id)
+            continue
+        pw, cid = meta.get("pw"), meta.get("chat_id")
+        if not pw or not cid:
+            continue
+        if pw == "🎲" and meta.get("suspended") == "1":
+            await redis.sadd(dice_suspended_key(cid), rp_id)
+        else:
+            await redis.sadd(pw_index_key(cid, pw), rp_id)
+            # 升级前发出的红包没有登记过期时间，补登（已登记的不覆盖）
+            await redis.zadd(REDPACK_EXPIRY_KEY, {rp_id: float(meta.get("created_at", time.time())) + REDPACK_LIFETIME}, nx=True)
+    await load_pw_hints()
+    try:
+        await redis.publish(PW_EVENTS_CHANNEL, "reload")
+    except Exception as e:
+        logging.warning(f"[redpack] 广播口令表重载失败: {e}")
+
+
+# 份额打包存储：每份金额以「分」为单位、定宽 SHARE_WIDTH 位十进制拼成一个字符串（redpack_shares:{rp_id}），
+# meta 里的 taken 是已领下标，claimed_cents 是已领总额；退款 = total_cents - claimed_cents，O(1)
+SHARE_WIDTH = 9
+
+# Lua 公共片段：按下标取下一份，返回 "元.分" 字符串；升级前的红包仍从 redpack_list 弹出
+_TAKE_SHARE_LUA = """
+local W = %d
+local function take_share(meta_key, shares_key, list_key)
+    if not redis.call('HGET', meta_key, 'total_cents') then
+        return redis.call('LPOP', list_key)
+    end
+    local taken = tonumber(redis.call('HGET', meta_key, 'taken') or '0')
+    if taken >= tonumber(redis.call('HGET', meta_key, 'count')) then
+        return false
+    end
+    local c = tonumber(redis.call('GETRANGE', shares_key, taken * W, taken * W + W - 1))
+    if not c then
+        return false
+    end
+    redis.call('HSET', meta_key, 'taken', taken + 1)
+    redis.call('HINCRBY', meta_key, 'claimed_cents', c)
+    return string.format('%%d.%%02d', math.floor(c / 100), c %% 100)
+end
+""" % SHARE_WIDTH
+
+# 原子领取：去重 -> 取下一份 -> 记录领取人 -> 入账余额 -> 返回剩余情况，一次往返完成
+# KEYS[1] = 领取人余额 key，KEYS[2] = 备份脏集合，之后每 4 个 key 为一个红包 (meta, shares, list, users)
+# ARGV = uid, 领取人名字, users 哈希 TTL（0 表示不设置）
+_CLAIM_LUA = _TAKE_SHARE_LUA + """
+local bal_key, dirty_key = KEYS[1], KEYS[2]
+local uid, name, users_ttl = ARGV[1], ARGV[2], tonumber(ARGV[3])
+local results = {}
+local balance = false
+for i = 3, #KEYS, 4 do
+    local meta_key, shares_key, list_key, users_key = KEYS[i], KEYS[i + 1], KEYS[i + 2], KEYS[i + 3]
+    local status, amt = 'ok', ''
+    if redis.call('EXISTS', meta_key) == 0 then
+        status = 'expired'
+    elseif redis.call('HGET', meta_key, 'suspended') == '1' then
+        status = 'suspended'
+    elseif redis.call('HEXISTS', users_key, uid) == 1 then
+        status = 'dup'
+    else
+        local share = take_share(meta_key, shares_key, list_key)
+        if not share then
+            status = 'empty'
+        else
+            amt = share
+            redis.call('HSET', users_key, uid, name .. '|' .. share)
+            if users_ttl > 0 then
+                redis.call('EXPIRE', users_key, users_ttl)
+            end
+            if redis.call('EXISTS', bal_key) == 0 then
+                redis.call('SET', bal_key, '20000')
+            end
+            balance = redis.call('INCRBYFLOAT', bal_key, share)
+            redis.call('SADD', dirty_key, uid)
+        end
+    end
+    local info = redis.call('HMGET', meta_key, 'count', 'sender_uid', 'sender_name', 'msg_id')
+    results[#results + 1] = {status, amt, redis.call('HLEN', users_key),
+                             info[1] or '0', info[2] or '', info[3] or '', info[4] or ''}
+end
+return {balance or '', results}
+"""
+
+# 收回剩余份额：把 taken 推到 count 关闭红包，删除份额，返回应退的分（升级前的红包按 list 剩余求和）
+# KEYS = meta, shares, list
+_DRAIN_LUA = """
+local total = redis.call('HGET', KEYS[1], 'total_cents')
+if not total then
+    local cents = 0
+    for _, a in ipairs(redis.call('LRANGE', KEYS[3], 0, -1)) do
+        cents = cents + math.floor(tonumber(a) * 100 + 0.5)
+    end
+    redis.call('DEL', KEYS[3])
+    return cents
+end
+local claimed = tonumber(redis.call('HGET', KEYS[1], 'claimed_cents') or '0')
+redis.call('HSET', KEYS[1], 'taken', redis.call('HGET', KEYS[1], 'count'))
+redis.call('DEL', KEYS[2])
+return tonumber(total) - claimed
+"""
+
+_claim_script = redis.register_script(_CLAIM_LUA)
+_drain_script = redis.register_script(_DRAIN_LUA)
+
+
+def _share_keys(rp_id: str) -> list:
+    return [f"redpack_meta:{rp_id}", f"redpack_shares:{rp_id}", f"redpack_list:{rp_id}"]
+
+
+async def claim_redpacks(uid: str, name: str, rp_ids: list, users_ttl: int = 0) -> list:
+    """原子领取一个或多个红包，返回 [(rp_id, status, amt, claimed, info), ...]
+
+    status: ok / dup / empty / expired / suspended；info 含 count、sender_uid、sender_name、msg_id
+    """
+    if not rp_ids:
+        return []
+    keys = [f"user_balance:{uid}", BACKUP_DIRTY_KEY]
+    for rp_id in rp_ids:
+        keys += _share_keys(rp_id) + [f"redpack_users:{rp_id}"]
+    _, rows = await _claim_script(keys=keys, args=[uid, name, users_ttl])
+    results = []
+    for rp_id, (status, amt, claimed, count, sender_uid, sender_name, msg_id) in zip(rp_ids, rows):
+        info = {"count": count, "sender_uid": sender_uid, "sender_name": sender_name or "某人", "msg_id": msg_id}
+        results.append((rp_id, status, float(amt) if amt else 0.0, int(claimed), info))
+    return results
+
+
+async def drain_redpack(rp_id: str, client=None) -> int:
+    """关闭红包并返回剩余未领的分，之后的领取只会拿到 empty"""
+    return await _drain_script(keys=_share_keys(rp_id), client=client)
+
+
+def split_redpack_cents(total_cents: int, count: int, min_cents: int = 1) -> list:
+    """整数分拆包：每份至少 min_cents，总和严格等于 total_cents。
+
+    在 min_cents 之上按 Dirichlet(1) 随机比例分配余额，向下取整后把差额补给小数部分最大的几份。
+    """
+    spare = total_cents - count * min_cents
+    if count <= 0 or spare < 0:
+        raise ValueError(f"无法拆分：{total_cents} 分拆 {count} 份，每份至少 {min_cents} 分")
+    if _HAS_NUMPY:
+        weights = np.random.default_rng().exponential(size=count)
+        raw = weights / weights.sum() * spare
+        cents = np.floor(raw).astype(np.int64)
+        short = spare - int(cents.sum())
+        if short:
+            cents[np.argsort(raw - cents)[-short:]] += 1
+        return (cents + min_cents).tolist()
+
+    weights = [random.expovariate(1.0) for _ in range(count)]
+    scale = spare / sum(weights)
+    raw = [w * scale for w in weights]
+    cents = [int(r) for r in raw]
+    short = spare - sum(cents)
+    for i in sorted(range(count), key=lambda i: raw[i] - cents[i], reverse=True)[:short]:
+        cents[i] += 1
+    return [c + min_cents for c in cents]
+
+
+def pack_shares(cents: list) -> str:
+    return "".join(f"{c:0{SHARE_WIDTH}d}" for c in cents)
+
+
+async def store_redpack_shares(rp_id: str, amount: float, count: int, ttl: int):
+    """拆包并以打包字符串写入，meta 记录 total_cents / taken / claimed_cents"""
+    total_cents = int(round(amount * 100))
+    cents = split_redpack_cents(total_cents, count)
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(f"redpack_meta:{rp_id}", mapping={"total_cents": str(total_cents), "taken": "0", "claimed_cents": "0"})
+    pipe.set(f"redpack_shares:{rp_id}", pack_shares(cents), ex=ttl)
+    pipe.expire(f"redpack_meta:{rp_id}", ttl)
+    await pipe.execute()
 
 
 async def build_redpack_panel(rp_id: str, is_pw: bool, remaining_mins: int = None, refund_info: str = None):
@@ -85,65 +365,120 @@ async def build_redpack_panel(rp_id: str, is_pw: bool, remaining_mins: int = Non
     return "\n".join(lines), markup
 
 
-# 构建单骰子专属【聚合看板】 - 彻底杜绝刷屏并对齐排版
+# ==============================
+# 「🎲」聚合看板：按群脏标记 + 合并渲染
+# ==============================
+
+# 同一群的看板最多每 DICE_PANEL_INTERVAL 秒编辑一次，期间的领取/倒计时变化合并进下一次渲染
+DICE_PANEL_INTERVAL = 2
+
+# 进程内看板状态：{chat_id: {"rps": {rp_id: {...}}, "stale": bool, "dirty": bool, "is_resume": bool, "task": Task}}
+# rps 是增量维护的渲染数据；stale=True 时下次渲染先从 Redis 全量重建（红包增删/挂起/恢复时）
+_dice_panels: dict = {}
+
+
+def _dice_panel_state(chat_id) -> dict:
+    key = str(chat_id)
+    state = _dice_panels.get(key)
+    if state is None:
+        state = _dice_panels[key] = {"rps": {}, "stale": True, "dirty": False, "is_resume": False, "task": None}
+    return state
+
+
+def _schedule_dice_panel(chat_id: int, state: dict):
+    state["dirty"] = True
+    if state["task"] is None or state["task"].done():
+        state["task"] = asyncio.create_task(_dice_panel_renderer(chat_id, state))
+
+
 async def refresh_dice_panel(chat_id: int, is_resume: bool = False):
-    active_rps = await redis.smembers("active_pw_rps")
-    dice_rps = []
-    for rp_id in active_rps:
+    """红包集合有变化：标记全量重建并安排一次合并渲染（不阻塞调用方）"""
+    state = _dice_panel_state(chat_id)
+    state["stale"] = True
+    if is_resume:
+        state["is_resume"] = True
+    _schedule_dice_panel(chat_id, state)
+
+
+def touch_dice_panel(chat_id: int):
+    """只需刷新倒计时等派生内容：沿用内存状态，不重读 Redis"""
+    _schedule_dice_panel(chat_id, _dice_panel_state(chat_id))
+
+
+def dice_panel_apply_claim(chat_id: int, rp_id: str, uid: str, name: str, amt: float, claimed: int):
+    """领取增量：直接改内存状态，抢空的包从看板移除，不触发全量重建"""
+    state = _dice_panel_state(chat_id)
+    rp = state["rps"].get(rp_id)
+    if rp is None or claimed != len(rp["claims"]) + 1:
+        # 内存状态与 Redis 计数对不上（漏掉了别处的变化），回退到全量重建
+        state["stale"] = True
+    elif claimed >= rp["count"]:
+        del state["rps"][rp_id]
+    else:
+        rp["claims"].append((uid, name, f"{amt:g}"))
+    _schedule_dice_panel(chat_id, state)
+
+
+def forget_dice_panel(chat_id):
+    """看板消息被外部删除（挂起/维护）后丢弃内存状态，下次渲染从 Redis 重建"""
+    state = _dice_panels.get(str(chat_id))
+    if state:
+        state["rps"].clear()
+        state["stale"] = True
+        state.pop("last_text", None)
+
+
+async def _load_dice_panel(chat_id: int, state: dict):
+    rps = {}
+    for rp_id in await redis.smembers(pw_index_key(chat_id, "🎲")):
         meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-        if meta and meta.get("chat_id") == str(chat_id) and meta.get("pw") == "🎲" and meta.get("suspended") != "1":
-            dice_rps.append((rp_id, meta))
+        if not meta:
+            await unregister_pw_redpack(chat_id, "🎲", rp_id)
+            continue
+        if meta.get("suspended") == "1":
+            continue
+        users_data = await redis.hgetall(f"redpack_users:{rp_id}")
+        count = int(meta["count"])
+        if len(users_data) >= count:
+            continue
+        rps[rp_id] = {
+            "count": count,
+            "amount": meta["amount"],
+            "sender_uid": meta.get("sender_uid", ""),
+            "sender_name": meta.get("sender_name", "某人"),
+            "created_at": float(meta.get("created_at", time.time())),
+            "claims": [(u, *val.rsplit("|", 1)) for u, val in users_data.items()],
+        }
+    state["rps"] = rps
+    state["stale"] = False
 
-    dice_rps.sort(key=lambda x: float(x[1].get('created_at', 0)))
 
-    # 没有活跃骰子红包：解钉+删除聚合面板（如有）
-    if len(dice_rps) == 0:
-        old_msg_id = await redis.get(f"dice_panel_msg:{chat_id}")
-        if old_msg_id:
-            try:
-                await bot.unpin_chat_message(chat_id=chat_id, message_id=int(old_msg_id))
-            except:
-                pass
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=int(old_msg_id))
-            except:
-                pass
-            await redis.delete(f"dice_panel_msg:{chat_id}")
-        return
+def _render_dice_panel(state: dict) -> str:
+    dice_rps = sorted(state["rps"].values(), key=lambda rp: rp["created_at"])
 
     header = "🧧 <b>「🎲」口令红包聚合看板</b>\n👇扔出 🎲 即可一键通吃👇\n"
-    if is_resume:
+    if state["is_resume"]:
         header = "🧧 <b>「🎲」口令红包已恢复！</b>\n<i>(因对局打断挂起重发)</i>\n👇扔出 🎲 即可一键通吃👇\n"
 
     lines = [header]
     min_remaining_mins = 5
 
-    for i, (rp_id, meta) in enumerate(dice_rps):
-        users_data = await redis.hgetall(f"redpack_users:{rp_id}")
-        count = int(meta['count'])
-        amount = meta['amount']
-
+    for rp in dice_rps:
         # 老板排面高亮
-        sender_uid = meta.get('sender_uid', '')
-        sender_name = meta.get('sender_name', '某人')
-        sender_mention = get_mention(sender_uid, sender_name) if sender_uid else safe_html(sender_name)
+        sender_uid = rp["sender_uid"]
+        sender_mention = get_mention(sender_uid, rp["sender_name"]) if sender_uid else safe_html(rp["sender_name"])
 
-        created_at = float(meta.get('created_at', time.time()))
-        elapsed_mins = int((time.time() - created_at) / 60)
+        elapsed_mins = int((time.time() - rp["created_at"]) / 60)
         rem_mins = max(0, 5 - elapsed_mins)
         if rem_mins < min_remaining_mins:
             min_remaining_mins = rem_mins
 
         # 抢包人排面高亮
-        claimed_strs = []
-        for u, val in users_data.items():
-            name, a = val.rsplit("|", 1)
-            claimed_strs.append(f"{get_mention(u, name)}({a})")
-
+        claimed_strs = [f"{get_mention(u, name)}({a})" for u, name, a in rp["claims"]]
         claimed_text = ", ".join(claimed_strs) if claimed_strs else "暂无"
-        rem_count = count - len(users_data)
+        rem_count = rp["count"] - len(rp["claims"])
 
-        lines.append(f"📦 {sender_mention} 的包 ({amount}分/{count}个) | 剩 <b>{rem_count}</b> 个")
+        lines.append(f"📦 {sender_mention} 的包 ({rp['amount']}分/{rp['count']}个) | 剩 <b>{rem_count}</b> 个")
         lines.append(f"└ 已领: {claimed_text}\n")
 
     if min_remaining_mins <= 0:
@@ -151,7 +486,44 @@ async def refresh_dice_panel(chat_id: int, is_resume: bool = False):
     else:
         lines.append(f"⏳ <i>最早的一个 {min_remaining_mins} 分钟后过期自动清理</i>")
 
-    panel_text = "\n".join(lines)
+    return "\n".join(lines)
+
+
+async def _send_dice_panel(chat_id: int, panel_text: str):
+    try:
+        msg = await bot.send_message(chat_id, panel_text, message_thread_id=ALLOWED_THREAD_ID or None)
+        await redis.set(f"dice_panel_msg:{chat_id}", str(msg.message_id))
+        try:
+            await pin_in_topic(chat_id, msg.message_id, disable_notification=True)
+        except:
+            pass
+    except Exception as e:
+        logging.warning(f"[dice_panel] 发送面板失败: {e}")
+
+
+async def _flush_dice_panel(chat_id: int, state: dict):
+    if state["stale"]:
+        await _load_dice_panel(chat_id, state)
+
+    # 没有活跃骰子红包：解钉+删除聚合面板（如有）
+    if not state["rps"]:
+        state["is_resume"] = False
+        old_msg_id = await redis.get(f"dice_panel_msg:{chat_id}")
+        if old_msg_id:
+            try:
+                await bot.unpin_chat_message(chat_id=chat_id, message_id=int(old_msg_id))
+            except:
+                pass
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=int(old_msg_id))
+            except:
+                pass
+            await redis.delete(f"dice_panel_msg:{chat_id}")
+        return
+
+    panel_text = _render_dice_panel(state)
+    if panel_text == state.get("last_text"):
+        return
 
     old_msg_id = await redis.get(f"dice_panel_msg:{chat_id}")
     if old_msg_id:
@@ -160,125 +532,203 @@ async def refresh_dice_panel(chat_id: int, is_resume: bool = False):
         except Exception as e:
             # 忽略 not modified 避免刷屏
             if "not modified" not in str(e).lower():
-                try:
-                    msg = await bot.send_message(chat_id, panel_text, message_thread_id=ALLOWED_THREAD_ID or None)
-                    await redis.set(f"dice_panel_msg:{chat_id}", str(msg.message_id))
-                    try:
-                        await pin_in_topic(chat_id, msg.message_id, disable_notification=True)
-                    except:
-                        pass
-                except Exception as e2:
-                    logging.warning(f"[dice_panel] 发送面板失败(fallback): {e2}")
+                await _send_dice_panel(chat_id, panel_text)
     else:
+        await _send_dice_panel(chat_id, panel_text)
+    state["last_text"] = panel_text
+
+
+async def _dice_panel_renderer(chat_id: int, state: dict):
+    """每群一个渲染协程：有脏标记就渲染一次，然后至少间隔 DICE_PANEL_INTERVAL 秒"""
+    while state["dirty"]:
+        state["dirty"] = False
         try:
-            msg = await bot.send_message(chat_id, panel_text, message_thread_id=ALLOWED_THREAD_ID or None)
-            await redis.set(f"dice_panel_msg:{chat_id}", str(msg.message_id))
-            try:
-                await pin_in_topic(chat_id, msg.message_id, disable_notification=True)
-            except:
-                pass
+            await _flush_dice_panel(chat_id, state)
         except Exception as e:
-            logging.warning(f"[dice_panel] 发送面板失败: {e}")
+            logging.warning(f"[dice_panel] 渲染异常 chat={chat_id}: {e}")
+        await asyncio.sleep(DICE_PANEL_INTERVAL)
+    if not state["rps"] and not state["dirty"]:
+        _dice_panels.pop(str(chat_id), None)
 
 
-async def redpack_expiry_watcher(chat_id: int, msg_id: int, rp_id: str, is_pw: bool, expected_epoch: str):
-    meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-    is_dice = is_pw and meta and meta.get("pw") == "🎲"
+# ==============================
+# 红包过期：全进程一个 ticker，由 ZSET rp_expiry（score = 过期时间戳）驱动
+# ==============================
 
-    for i in range(5):
-        await asyncio.sleep(60)
-        meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-        if not meta or meta.get("created_at") != expected_epoch or meta.get("suspended") == "1":
-            return
+REDPACK_EXPIRY_KEY = "rp_expiry"
+REDPACK_LIFETIME = 300
+REDPACK_TICK = 5
 
-        users_data = await redis.hgetall(f"redpack_users:{rp_id}")
-        if len(users_data) >= int(meta.get('count', 0)):
-            return
+# 已展示的剩余分钟数：{rp_id: 分钟}，只在分钟数变化时编辑面板
+_countdown_shown: dict = {}
 
-        remaining = 4 - i
-        if remaining > 0:
-            text, markup = await build_redpack_panel(rp_id, is_pw, remaining)
-            if msg_id:
-                try:
-                    await bot.edit_message_text(text, chat_id=chat_id, message_id=msg_id, reply_markup=markup)
-                except Exception:
-                    pass
-            if is_dice:
-                await refresh_dice_panel(chat_id)
 
-    # 过期退款 & 更新面板（不删消息）
-    meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-    if not meta or meta.get("created_at") != expected_epoch or meta.get("suspended") == "1":
-        return
+async def schedule_redpack_expiry(rp_id: str, created_at: float):
+    """登记（或在恢复时重置）红包过期时间；重启后 ticker 直接从 ZSET 继续，无需重建 watcher"""
+    await redis.zadd(REDPACK_EXPIRY_KEY, {rp_id: created_at + REDPACK_LIFETIME})
 
-    users_data = await redis.hgetall(f"redpack_users:{rp_id}")
-    if len(users_data) >= int(meta.get('count', 0)):
-        return
 
-    total_amount = float(meta['amount'])
-    claimed_amount = sum(float(v.rsplit("|", 1)[1]) for v in users_data.values())
-    refund = round(total_amount - claimed_amount, 2)
-    sender_uid = meta.get("sender_uid")
-    sender_name = meta.get("sender_name", "老板")
+async def cancel_redpack_expiry(rp_id: str):
+    await redis.zrem(REDPACK_EXPIRY_KEY, rp_id)
+    _countdown_shown.pop(rp_id, None)
 
-    if refund > 0 and sender_uid:
-        await update_balance(sender_uid, refund)
 
-    refund_info = f"已退回 <b>{refund}</b> 积分给 {get_mention(sender_uid, sender_name)}" if (refund > 0 and sender_uid) else None
+async def redpack_expiry_ticker():
+    while True:
+        await asyncio.sleep(REDPACK_TICK)
+        if not is_leader():
+            continue
+        try:
+            # 快照导入期间不退款、不投放，避免与正在回写的 key 交错
+            if await globally_paused():
+                continue
+            await _expiry_tick()
+        except Exception as e:
+            logging.warning(f"[rp_expiry] tick 异常: {e}")
 
-    # 先构建面板文本（Redis 数据还在），再清理数据
-    text, _ = await build_redpack_panel(rp_id, is_pw, 0, refund_info=refund_info)
-    await redis.delete(f"redpack_meta:{rp_id}")
-    await redis.delete(f"redpack_list:{rp_id}")
-    await redis.delete(f"redpack_users:{rp_id}")
-    await redis.srem("active_pw_rps", rp_id)
 
-    # 更新面板，不删除
-    if msg_id:
-        try:
-            await bot.edit_message_text(text, chat_id=chat_id, message_id=msg_id, reply_markup=None)
-        except:
-            pass
+async def _edit_panel(chat_id: int, msg_id: int, text: str, markup):
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=msg_id, reply_markup=markup)
+    except Exception:
+        pass
 
-    if is_dice:
-        await refresh_dice_panel(chat_id)
 
+async def _expiry_tick():
+    entries = await redis.zrange(REDPACK_EXPIRY_KEY, 0, -1, withscores=True)
+    if not entries:
+        _countdown_shown.clear()
+        return
 
-async def attempt_claim_pw_redpack(message: types.Message, text: str, uid: str, active_rps: list) -> bool:
+    pipe = redis.pipeline(transaction=False)
+    for rp_id, _ in entries:
+        pipe.hgetall(f"redpack_meta:{rp_id}")
+        pipe.hlen(f"redpack_users:{rp_id}")
+    rows = await pipe.execute()
+
+    now = time.time()
+    finished, due, countdown = [], [], []
+    for i, (rp_id, expire_at) in enumerate(entries):
+        meta, claimed = rows[2 * i], rows[2 * i + 1]
+        # 已删除 / 已挂起 / 已抢空：不再需要倒计时
+        if not meta or meta.get("suspended") == "1" or claimed >= int(meta.get("count", 0)):
+            finished.append(rp_id)
+        elif expire_at <= now:
+            due.append((rp_id, meta))
+        else:
+            remaining = math.ceil((expire_at - now) / 60)
+            shown = _countdown_shown.get(rp_id)
+            _countdown_shown[rp_id] = remaining
+            # 新红包发出时面板已显示 5 分钟，首次观察不重复编辑
+            if shown != remaining and (shown is not None or remaining < 5):
+                countdown.append((rp_id, meta, remaining))
+
+    if finished:
+        await redis.zrem(REDPACK_EXPIRY_KEY, *finished)
+        for rp_id in finished:
+            _countdown_shown.pop(rp_id, None)
+
+    edits = []
+    dice_chats = set()
+    for rp_id, meta, remaining in countdown:
+        is_pw = "pw" in meta
+        text, markup = await build_redpack_panel(rp_id, is_pw, remaining)
+        if text and meta.get("msg_id", "0") != "0":
+            edits.append(_edit_panel(int(meta["chat_id"]), int(meta["msg_id"]), text, markup))
+        if meta.get("pw") == "🎲":
+            dice_chats.add(int(meta["chat_id"]))
+    for cid in dice_chats:
+        touch_dice_panel(cid)
+
+    if due:
+        edits += await _expire_redpacks(due)
+    if edits:
+        await asyncio.gather(*edits)
+
+
+async def _expire_redpacks(due: list) -> list:
+    """批量过期：ZREM 抢到处理权，原子取走剩余份额后汇总退款，返回待执行的面板编辑"""
+    pipe = redis.pipeline(transaction=False)
+    for rp_id, _ in due:
+        pipe.zrem(REDPACK_EXPIRY_KEY, rp_id)
+    owned = [item for item, won in zip(due, await pipe.execute()) if won]
+
+    # 原子关闭并按计数器算出剩余：之后的领取只会拿到 empty，退款与剩余份额严格一致
+    pipe = redis.pipeline(transaction=False)
+    for rp_id, _ in owned:
+        await drain_redpack(rp_id, client=pipe)
+    drained = await pipe.execute()
+
+    refunds = {}
+    results = []
+    for (rp_id, meta), cents in zip(owned, drained):
+        _countdown_shown.pop(rp_id, None)
+        refund = round(int(cents) / 100, 2)
+        sender_uid = meta.get("sender_uid")
+        if refund > 0 and sender_uid:
+            refunds[sender_uid] = refunds.get(sender_uid, 0) + refund
+        results.append((rp_id, meta, refund))
+
+    for sender_uid, total in refunds.items():
+        await update_balance(sender_uid, round(total, 2))
+
+    edits = []
+    dice_chats = set()
+    cleanup = redis.pipeline(transaction=False)
+    for rp_id, meta, refund in results:
+        sender_uid = meta.get("sender_uid")
+        sender_name = meta.get("sender_name", "老板")
+        is_pw = "pw" in meta
+        chat_id = int(meta["chat_id"])
+        refund_info = f"已退回 <b>{refund}</b> 积分给 {get_mention(sender_uid, sender_name)}" if (refund > 0 and sender_uid) else None
+
+        # 先构建面板文本（Redis 数据还在），再清理数据
+        text, _ = await build_redpack_panel(rp_id, is_pw, 0, refund_info=refund_info)
+        cleanup.delete(f"redpack_meta:{rp_id}", f"redpack_users:{rp_id}")
+        if is_pw:
+            await unregister_pw_redpack(chat_id, meta.get("pw", ""), rp_id)
+            if meta.get("pw") == "🎲":
+                dice_chats.add(chat_id)
+
+        # 更新面板，不删除
+        if text and meta.get("msg_id", "0") != "0":
+            edits.append(_edit_panel(chat_id, int(meta["msg_id"]), text, None))
+        logging.info(f"[rp_expiry] 红包过期 rp_id={rp_id} 退款={refund}")
+    await cleanup.execute()
+
+    for cid in dice_chats:
+        await refresh_dice_panel(cid)
+    return edits
+
+
+async def attempt_claim_pw_redpack(message: types.Message, text: str, uid: str) -> bool:
     total_claimed = 0
     claimed_info = []
-    panels_to_update = {}
     is_dice_claim = (text == "🎲")
 
-    for rp_id in active_rps:
-        meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-        if not meta:
-            await redis.srem("active_pw_rps", rp_id)
+    # 只查本群该口令的索引，所有匹配红包在一次原子调用里完成领取
+    rp_ids = list(await redis.smembers(pw_index_key(message.chat.id, text)))
+    results = await claim_redpacks(uid, message.from_user.first_name, rp_ids, users_ttl=300)
+    for rp_id, status, amt, claimed, info in results:
+        if status in ("expired", "empty"):
+            await unregister_pw_redpack(message.chat.id, text, rp_id)
+            if is_dice_claim:
+                await refresh_dice_panel(message.chat.id)
             continue
-
-        if meta.get("pw") == text and meta.get("suspended") != "1" and meta.get("chat_id") == str(message.chat.id):
-            list_key = f"redpack_list:{rp_id}"
-            if await redis.hget(f"redpack_users:{rp_id}", uid):
-                continue
-
-            amt_str = await redis.lpop(list_key)
-            if not amt_str:
-                await redis.srem("active_pw_rps", rp_id)
-                continue
-
-            amt = float(amt_str)
-            await redis.hset(f"redpack_users:{rp_id}", uid, f"{message.from_user.first_name}|{amt}")
-            await redis.expire(f"redpack_users:{rp_id}", 300)
-
-            total_claimed += amt
-            claimed_info.append((rp_id, meta, amt))
-            panels_to_update[rp_id] = meta
+        if status != "ok":
+            continue
+        info["chat_id"] = str(message.chat.id)
+        info["claimed"] = claimed
+        total_claimed += amt
+        claimed_info.append((rp_id, info, amt))
+        if claimed >= int(info["count"]):
+            await unregister_pw_redpack(message.chat.id, text, rp_id)
 
     if total_claimed > 0:
-        await update_balance(uid, total_claimed)
-
         if is_dice_claim:
-            await refresh_dice_panel(message.chat.id)  # 提前更新聚合面板，不等个人面板/公告 API call
+            # 增量写入看板状态，由渲染协程合并刷新，不在领取路径上编辑置顶消息
+            for rp_id, info, amt in claimed_info:
+                dice_panel_apply_claim(message.chat.id, rp_id, uid, message.from_user.first_name, amt, info["claimed"])
 
         for rp_id, meta, amt in claimed_info:
             # 所有红包（含骰子）统一更新独立面板，不删除
@@ -295,32 +745,29 @@ async def attempt_claim_pw_redpack(message: types.Message, text: str, uid: str,
 
             announce_msg = await bot.send_message(message.chat.id, f"🎉 {get_mention(uid, message.from_user.first_name)} 领取了 {sender_mention} 的口令红包，获得 <b>{amt}</b> 积分！", message_thread_id=ALLOWED_THREAD_ID or None)
             asyncio.create_task(delete_msgs([announce_msg], 10))
-
-            users_data = await redis.hgetall(f"redpack_users:{rp_id}")
-            if len(users_data) >= int(meta.get('count', 0)):
-                await redis.srem("active_pw_rps", rp_id)
-                # 面板保留"已抢空"状态，不删除
-
-        if is_dice_claim:
-            await refresh_dice_panel(message.chat.id)
+            # 抢空的红包已在领取时注销，面板保留"已抢空"状态，不删除
         return True
     return False
 
 
 async def suspend_dice_redpacks(chat_id: int):
-    active_rps = await redis.smembers("active_pw_rps")
     suspended_count = 0
-    for rp_id in active_rps:
+    for rp_id in await redis.smembers(pw_index_key(chat_id, "🎲")):
         meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-        if meta and meta.get("chat_id") == str(chat_id) and meta.get("pw") == "🎲" and meta.get("suspended") != "1":
-            await redis.hset(f"redpack_meta:{rp_id}", "suspended", "1")
-            suspended_count += 1
+        if not meta:
+            await unregister_pw_redpack(chat_id, "🎲", rp_id)
+            continue
+        await redis.hset(f"redpack_meta:{rp_id}", "suspended", "1")
+        await cancel_redpack_expiry(rp_id)
+        await redis.smove(pw_index_key(chat_id, "🎲"), dice_suspended_key(chat_id), rp_id)
+        suspended_count += 1
 
     if suspended_count > 0:
         old_msg_id = await redis.get(f"dice_panel_msg:{chat_id}")
         if old_msg_id:
             asyncio.create_task(delete_msg_by_id(chat_id, int(old_msg_id)))
             await redis.delete(f"dice_panel_msg:{chat_id}")
+        forget_dice_panel(chat_id)
 
         msg = await bot.send_message(chat_id, f"⏸ <b>红包保护系统</b>\n因对局已开启，当前群内 <b>{suspended_count}</b> 个「🎲」红包已被自动挂起保护。\n将在赌桌清空后自动合并重发！", message_thread_id=ALLOWED_THREAD_ID or None)
         asyncio.create_task(delete_msgs([msg], 15))
@@ -331,14 +778,17 @@ async def resume_dice_redpacks(chat_id: int):
     if active_games:
         return
 
-    active_rps = await redis.smembers("active_pw_rps")
     resumed_count = 0
-    for rp_id in active_rps:
+    for rp_id in await redis.smembers(dice_suspended_key(chat_id)):
         meta = await redis.hgetall(f"redpack_meta:{rp_id}")
-        if meta and meta.get("chat_id") == str(chat_id) and meta.get("pw") == "🎲" and meta.get("suspended") == "1":
+        if not meta:
+            await unregister_pw_redpack(chat_id, "🎲", rp_id)
+            continue
+        if meta.get("suspended") == "1":
             users_data = await redis.hgetall(f"redpack_users:{rp_id}")
             rem_count = int(meta["count"]) - len(users_data)
             if rem_count <= 0:
+                await unregister_pw_redpack(chat_id, "🎲", rp_id)
                 continue
 
             new_epoch = str(time.time())
@@ -346,10 +796,11 @@ async def resume_dice_redpacks(chat_id: int):
             await redis.hset(f"redpack_meta:{rp_id}", "created_at", new_epoch)
             await redis.hset(f"redpack_meta:{rp_id}", "resumed", "1")
             await redis.expire(f"redpack_meta:{rp_id}", 320)
+            await redis.expire(f"redpack_shares:{rp_id}", 320)
             await redis.expire(f"redpack_list:{rp_id}", 320)
+            await redis.smove(dice_suspended_key(chat_id), pw_index_key(chat_id, "🎲"), rp_id)
+            await schedule_redpack_expiry(rp_id, float(new_epoch))
             resumed_count += 1
 
-            asyncio.create_task(redpack_expiry_watcher(chat_id, 0, rp_id, True, new_epoch))
-
     if resumed_count > 0:
         await refresh_dice_panel(chat_id, is_resume=True)
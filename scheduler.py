@@ -0,0 +1,201 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import time
+
+from config import TZ_BJ
+from core import redis
+from leader import is_leader, should_run, release_run
+
+# ==============================
+# 定时任务调度：所有任务共用一个定时堆，上次执行的时间点存 Redis，
+# 重启或换主节点后按各任务的补跑策略补执行错过的时间点；执行前统一过 should_run 闸门
+# ==============================
+
+LAST_RUN_KEY = "sched_last_run"
+# 堆顶再远也至少这么久醒一次，用来发现主节点切换
+SCHEDULER_TICK = 10
+
+# 补跑策略：skip 不补；latest 只补最近一次；all 逐个补窗口内所有错过的时间点
+CATCHUP_POLICIES = ("skip", "latest", "all")
+# 执行失败后按 delay * 2^n 重试，超过次数留给下次成为主节点时的补跑
+SCHEDULER_RETRY_DELAY = 60
+SCHEDULER_MAX_RETRIES = 3
+
+_JOBS: list = []
+# 定时堆：(触发时间戳, 序号, 时间点, 任务, 重试次数)；重试次数为 None 表示常规时间点，弹出后要排下一次
+_heap: list = []
+_seq = itertools.count()
+# 重任务（备份、收盘、战报）互斥执行，避免同一时刻扎堆打 Redis
+_heavy_lock = asyncio.Lock()
+
+
+def heavy_lock() -> asyncio.Lock:
+    """重任务互斥锁；快照导入等手动重操作也持有它，避免与备份、收盘并发"""
+    return _heavy_lock
+
+
+class Job:
+    def __init__(self, name: str, when, fn, key_fmt: str = "%Y%m%d", run_key=None, key_ttl: int = 86400 * 3,
+                 catchup: str = "skip", window: int = 0, jitter: int = 0, heavy: bool = False):
+        if catchup not in CATCHUP_POLICIES:
+            raise ValueError(catchup)
+        self.name = name
+        self.when = when
+        self.fn = fn
+        self.run_key = run_key or (lambda slot: f"{name}:{slot.strftime(key_fmt)}")
+        self.key_ttl = key_ttl
+        self.catchup = catchup
+        self.window = window
+        self.jitter = jitter
+        self.heavy = heavy
+        self.running = False
+        # 上一轮仍在执行时到点的时间点，等它结束后立即补上
+        self.deferred: list = []
+
+
+def scheduled(name: str, when, **kwargs):
+    """注册定时任务：fn(slot) 收到的是本次计划时间点（北京时间），而不是实际触发时间"""
+    def deco(fn):
+        _JOBS.append(Job(name, when, fn, **kwargs))
+        return fn
+    return deco
+
+
+def hourly(minute: int = 0):
+    def next_slot(after: datetime.datetime) -> datetime.datetime:
+        t = after.replace(minute=minute, second=0, microsecond=0)
+        return t if t > after else t + datetime.timedelta(hours=1)
+    return next_slot
+
+
+def daily(hour: int, minute: int = 0, second: int = 0):
+    def next_slot(after: datetime.datetime) -> datetime.datetime:
+        t = after.replace(hour=hour, minute=minute, second=second, microsecond=0)
+        return t if t > after else t + datetime.timedelta(days=1)
+    return next_slot
+
+
+def weekly(weekday: int, hour: int, minute: int = 0):
+    """weekday：0=周一"""
+    def next_slot(after: datetime.datetime) -> datetime.datetime:
+        t = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        t += datetime.timedelta(days=(weekday - after.weekday()) % 7)
+        return t if t > after else t + datetime.timedelta(days=7)
+    return next_slot
+
+
+def _defer(job: Job, slot: datetime.datetime, delay: float, attempt: int):
+    """把某个时间点重新排进定时堆（重试或等上一轮结束），不影响常规的下一次"""
+    heapq.heappush(_heap, (time.time() + delay, next(_seq), slot, job, attempt))
+
+
+async def _fire(job: Job, slot: datetime.datetime, attempt: int = 0):
+    if job.running:
+        logging.warning(f"[scheduler] {job.name} 上一轮仍在执行，{slot:%Y-%m-%d %H:%M} 延后到其结束后执行")
+        if slot not in job.deferred:
+            job.deferred.append(slot)
+        return
+    run_key = job.run_key(slot)
+    if not await should_run(run_key, ttl=job.key_ttl):
+        return
+    job.running = True
+    try:
+        if job.heavy:
+            async with _heavy_lock:
+                await job.fn(slot)
+        else:
+            await job.fn(slot)
+    except Exception as e:
+        # 失败不记执行时间，并释放幂等键，稍后重试这个时间点
+        logging.error(f"[scheduler] {job.name} 执行失败（{slot:%Y-%m-%d %H:%M}，第 {attempt + 1} 次）: {e}")
+        await release_run(run_key)
+        if attempt < SCHEDULER_MAX_RETRIES:
+            _defer(job, slot, SCHEDULER_RETRY_DELAY * 2 ** attempt, attempt + 1)
+        return
+    finally:
+        job.running = False
+        for deferred in job.deferred:
+            _defer(job, deferred, 0, 0)
+        job.deferred.clear()
+    try:
+        last = await redis.hget(LAST_RUN_KEY, job.name)
+        if not last or int(last) < slot.timestamp():
+            await redis.hset(LAST_RUN_KEY, job.name, int(slot.timestamp()))
+    except Exception as e:
+        logging.warning(f"[scheduler] 记录 {job.name} 执行时间失败: {e}")
+
+
+def _missed_slots(job: Job, last: datetime.datetime | None, now: datetime.datetime) -> list:
+    """补跑 last 之后、窗口内错过的时间点；从未记录过（首次部署）时不补跑"""
+    if job.catchup == "skip" or job.window <= 0 or last is None:
+        return []
+    start = max(last, now - datetime.timedelta(seconds=job.window))
+    slots = []
+    slot = job.when(start)
+    while slot <= now:
+        slots.append(slot)
+        slot = job.when(slot)
+    return slots[-1:] if job.catchup == "latest" else slots
+
+
+async def _catch_up():
+    """成为主节点时调用一次：按 Redis 里的上次执行时间补跑"""
+    now = datetime.datetime.now(TZ_BJ)
+    try:
+        last_runs = await redis.hgetall(LAST_RUN_KEY)
+    except Exception as e:
+        logging.warning(f"[scheduler] 读取上次执行时间失败，本次不补跑: {e}")
+        return
+    for job in _JOBS:
+        ts = last_runs.get(job.name)
+        if not ts:
+            # 首次部署：以当前时间为起点，不回放窗口内的历史时间点（战报、彩蛋会重复发奖）
+            try:
+                await redis.hsetnx(LAST_RUN_KEY, job.name, int(now.timestamp()))
+            except Exception as e:
+                logging.warning(f"[scheduler] 初始化 {job.name} 执行时间失败: {e}")
+            continue
+        last = datetime.datetime.fromtimestamp(int(ts), TZ_BJ)
+        slots = _missed_slots(job, last, now)
+        if not slots:
+            continue
+        logging.info(f"[scheduler] {job.name} 补跑 {len(slots)} 次：" + ", ".join(f"{s:%m-%d %H:%M}" for s in slots))
+
+        async def run_in_order(job=job, slots=slots):
+            for slot in slots:
+                await _fire(job, slot)
+        asyncio.create_task(run_in_order())
+
+
+def _push(job: Job, after: datetime.datetime):
+    slot = job.when(after)
+    fire_at = slot.timestamp() + (random.uniform(0, job.jitter) if job.jitter else 0)
+    heapq.heappush(_heap, (fire_at, next(_seq), slot, job, None))
+
+
+async def scheduler_task():
+    now = datetime.datetime.now(TZ_BJ)
+    for job in _JOBS:
+        _push(job, now)
+    logging.info(f"[scheduler] 已加载 {len(_JOBS)} 个定时任务：" + ", ".join(f"{e[3].name}@{e[2]:%m-%d %H:%M}" for e in sorted(_heap)))
+
+    was_leader = False
+    while True:
+        leader = is_leader()
+        if leader and not was_leader:
+            await _catch_up()
+        was_leader = leader
+
+        while _heap and _heap[0][0] <= time.time():
+            _, _, slot, job, attempt = heapq.heappop(_heap)
+            asyncio.create_task(_fire(job, slot, attempt or 0))
+            if attempt is None:
+                # 机器休眠等导致严重落后时直接跳到下一个未来时间点，不连发一串
+                _push(job, max(slot, datetime.datetime.now(TZ_BJ)))
+
+        wait = min(_heap[0][0] - time.time(), SCHEDULER_TICK) if _heap else SCHEDULER_TICK
+        await asyncio.sleep(max(0.0, wait))
@@ -0,0 +1,289 @@
+"""积分经济离线模拟器（NumPy 向量化 + 多进程多副本）
+
+按线上规则模拟一批玩家若干天的积分流动，输出每天的人均通胀与各来源的增发/销毁：
+    - 对局：process_round_end_or_settle 的名次收益曲线（2–5 人），点数按 odds.py 的精确分布抽样
+    - 连胜/连败：乐善好施（连赢 3 局扣最近 3 局均注 20%）/ 同舟共济（连败 3 局补 20%）
+    - 极端点数：比大 0 点/比小 9 点补偿，比大 9 点/比小 0 点回馈（含盈亏保护）
+    - Attack：加权随机，缴获 90%，10% 销毁
+    - 签到：100–1000 随机，连签 5 天额外 20000
+    - 节日彩蛋：直接调用 tasks.holiday_events 按真实日历发放
+    - 每日战报上榜奖励：每次上榜 +500
+
+用法：
+    python simulate.py --players 500 --days 30 --rounds 20 --replicas 8
+
+近似：同分加赛按随机名次处理（迭代加赛对同分玩家对称），20 颗强制平分与逃跑不建模；
+极端点数按首轮点数判定。每个副本独立随机种子，副本间并行，结果取均值。
+"""
+import argparse
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+os.environ.setdefault("BOT_TOKEN", "1:simulate")
+os.environ.setdefault("BOT_ID", "1")
+os.environ.setdefault("SUPER_ADMIN_ID", "1")
+os.environ.setdefault("ADMIN_IDS", "1")
+
+from config import TZ_BJ  # noqa: E402
+from odds import ODDS_TABLES  # noqa: E402
+
+INITIAL_BALANCE = 20000.0
+MAX_BET = 40000
+ATTACK_BET = 1000
+ATTACK_MAX = 20000
+CHECKIN_STREAK_BONUS = 20000
+LEADERBOARD_BONUS = 500
+
+# 每天的统计列（单位：积分，正数为增发，负数为销毁）
+FIELDS = ("supply", "checkin", "holiday", "board", "streak", "extreme", "attack_burn", "game_burn", "games", "broke")
+
+_SCORE_CDF = {int(k): np.cumsum(pmf) for k, pmf in ODDS_TABLES["score_pmf"].items()}
+
+
+def _half_int(x):
+    """与 game_settle.calc_half_int 一致：20% 四舍五入取整"""
+    return np.floor(x * 0.2 + 0.5)
+
+
+def _base_profits(total_cents, n: int):
+    """名次收益（分），与结算一致，含 Python 负数整除的 1 分误差"""
+    t = total_cents
+    cols = {
+        2: [t, -t],
+        3: [t, np.zeros_like(t), -t],
+        4: [t, t // 2, (-t) // 2, -t],
+        5: [t, t // 2, np.zeros_like(t), (-t) // 2, -t],
+    }[n]
+    return np.stack(cols, axis=1)
+
+
+class _State:
+    def __init__(self, players: int):
+        self.balance = np.full(players, INITIAL_BALANCE)
+        self.streak = np.zeros(players, dtype=np.int64)
+        self.streak_bets = np.zeros((players, 3))
+        self.checkin_streak = np.zeros(players, dtype=np.int64)
+        self.checkin_last = np.full(players, -2, dtype=np.int64)
+        self.day_profit = np.zeros(players)
+
+
+def _play_tables(rng, st: _State, seat, n: int, args, day: dict):
+    k = seat.shape[0]
+    dice = rng.integers(1, 6, size=k)
+    big = rng.random(k) < 0.5
+    bet = np.clip(np.round(rng.lognormal(np.log(args.bet_median), args.bet_sigma, size=k)), 1, MAX_BET)
+
+    # 任一玩家余额不足，这桌开不起来
+    ok = (st.balance[seat] >= bet[:, None]).all(axis=1)
+    seat, dice, big, bet = seat[ok], dice[ok], big[ok], bet[ok]
+    if not len(seat):
+        return
+    day["games"] += len(seat)
+
+    u = rng.random(seat.shape)
+    score = np.empty(seat.shape, dtype=np.int64)
+    for d, cdf in _SCORE_CDF.items():
+        mask = dice == d
+        score[mask] = np.minimum(np.searchsorted(cdf, u[mask], side="right"), 9)
+
+    # 同分随机定名次
+    key = np.where(big[:, None], score, -score) + rng.random(seat.shape) * 0.5
+    order = np.argsort(-key, axis=1)
+    profit_cents = np.empty(seat.shape, dtype=np.int64)
+    np.put_along_axis(profit_cents, order, _base_profits(np.round(bet * 100).astype(np.int64), n), axis=1)
+    day["game_burn"] += profit_cents.sum() / 100
+
+    uids = seat.ravel()
+    cents = profit_cents.ravel()
+    profit = cents / 100
+    bets = np.repeat(bet, n)
+    big_p = np.repeat(big, n)
+    score_p = score.ravel()
+    st.balance[uids] += profit
+    st.day_profit[uids] += profit
+
+    # ── 连胜/连败 ──
+    s = st.streak[uids]
+    win, loss = cents > 0, cents < 0
+    cont = (win & (s > 0)) | (loss & (s < 0))
+    new_s = np.where(win, np.where(s > 0, s + 1, 1), np.where(loss, np.where(s < 0, s - 1, -1), 0))
+    hist = st.streak_bets[uids]
+    hist = np.where(cont[:, None], np.column_stack([hist[:, 1:], bets]), np.column_stack([np.zeros((len(uids), 2)), bets]))
+    trig = np.abs(new_s) >= 3
+    bonus = np.where(trig, _half_int(hist.mean(axis=1)), 0)
+    adj = np.where(new_s >= 3, -bonus, np.where(new_s <= -3, bonus, 0))
+    st.balance[uids] += adj
+    day["streak"] += adj.sum()
+    new_s[trig] = 0
+    st.streak[uids] = new_s
+    st.streak_bets[uids] = np.where((trig | (new_s == 0))[:, None], 0, hist)
+
+    # ── 极端点数 ──
+    extreme_bonus = _half_int(bets)
+    unlucky = np.where(big_p, score_p == 0, score_p == 9) & (cents <= 0)
+    lucky = np.where(big_p, score_p == 9, score_p == 0) & (cents >= 0)
+    adj = np.where(unlucky, extreme_bonus, 0) - np.where(lucky, extreme_bonus, 0)
+    st.balance[uids] += adj
+    day["extreme"] += adj.sum()
+
+
+def _play_attacks(rng, st: _State, args, day: dict):
+    players = st.balance.size
+    m = int(players * args.attacks)
+    if m == 0:
+        return
+    c = rng.integers(0, players, size=m)
+    d = rng.integers(0, players, size=m)
+    steps = ATTACK_MAX // ATTACK_BET
+    c_total = ATTACK_BET * rng.integers(1, steps + 1, size=m).astype(float)
+    d_total = ATTACK_BET * rng.integers(1, steps + 1, size=m).astype(float)
+    d_total[rng.random(m) >= args.attack_respond] = 0
+    ok = (c != d) & (st.balance[c] >= c_total) & (st.balance[d] >= d_total)
+    c, d, c_total, d_total = c[ok], d[ok], c_total[ok], d_total[ok]
+    fought = d_total > 0  # 无人应战全额退回，净额为 0
+    c, d, c_total, d_total = c[fought], d[fought], c_total[fought], d_total[fought]
+
+    total = c_total + d_total
+    c_wins = rng.uniform(0, total) < c_total
+    winner = np.where(c_wins, c, d)
+    winner_invested = np.where(c_wins, c_total, d_total)
+    captured = np.floor((total - winner_invested) * 0.9)
+    np.add.at(st.balance, c, -c_total)
+    np.add.at(st.balance, d, -d_total)
+    np.add.at(st.balance, winner, winner_invested + captured)
+    day["attack_burn"] -= (total - winner_invested - captured).sum()
+
+
+def _checkin(rng, st: _State, args, day_idx: int, day: dict):
+    players = st.balance.size
+    who = np.flatnonzero(rng.random(players) < args.checkin)
+    streak = np.where(st.checkin_last[who] == day_idx - 1, st.checkin_streak[who] + 1, 1)
+    reward = rng.integers(100, 1001, size=len(who)).astype(float)
+    full = streak % 5 == 0
+    reward[full] += CHECKIN_STREAK_BONUS
+    streak[full] = 0
+    st.balance[who] += reward
+    st.checkin_streak[who] = streak
+    st.checkin_last[who] = day_idx
+    day["checkin"] += reward.sum()
+
+
+def _leaderboard(rng, st: _State, active, day: dict):
+    """昨日战报：净赚/净亏 TOP 5 + 三个称号（按活跃玩家随机近似），每次上榜 +500"""
+    profit = st.day_profit
+    winners = [u for u in np.argsort(-profit)[:5] if profit[u] > 0]
+    losers = [u for u in np.argsort(profit)[:5] if profit[u] < 0]
+    titles = list(rng.choice(active, size=min(3, len(active)), replace=False)) if len(active) else []
+    for uid in winners + losers + titles:
+        st.balance[uid] += LEADERBOARD_BONUS
+        day["board"] += LEADERBOARD_BONUS
+
+
+def _run_replica(job) -> np.ndarray:
+    args, holiday_grants, seed = job
+    rng = np.random.default_rng(seed)
+    st = _State(args.players)
+    mix = np.asarray(args.table_mix, dtype=float)
+    mix = mix / mix.sum()
+    out = np.zeros((args.days, len(FIELDS)))
+    for day_idx in range(args.days):
+        day = dict.fromkeys(FIELDS, 0.0)
+        st.day_profit[:] = 0
+        _checkin(rng, st, args, day_idx, day)
+
+        played = np.zeros(args.players, dtype=bool)
+        for _ in range(args.rounds):
+            ids = rng.permutation(np.flatnonzero(rng.random(args.players) < args.active))
+            played[ids] = True
+            pos = 0
+            for n, share in zip(range(2, 6), mix):
+                tables = int(len(ids) * share) // n
+                if tables:
+                    _play_tables(rng, st, ids[pos:pos + tables * n].reshape(tables, n), n, args, day)
+                    pos += tables * n
+
+        _play_attacks(rng, st, args, day)
+        grant = holiday_grants[day_idx]
+        if grant:
+            st.balance += grant
+            day["holiday"] += grant * args.players
+        _leaderboard(rng, st, np.flatnonzero(played), day)
+
+        day["supply"] = st.balance.sum()
+        day["broke"] = (st.balance < args.bet_median).mean()
+        out[day_idx] = [day[f] for f in FIELDS]
+    return out
+
+
+def _holiday_grants(start: datetime.date, days: int) -> list:
+    from tasks import holiday_events
+    grants = []
+    for i in range(days):
+        d = start + datetime.timedelta(days=i)
+        now = datetime.datetime(d.year, d.month, d.day, 12, tzinfo=TZ_BJ)
+        grants.append(sum(amt for _, amt in holiday_events(now)))
+    return grants
+
+
+def main():
+    parser = argparse.ArgumentParser(description="积分经济离线模拟")
+    parser.add_argument("--players", type=int, default=500, help="玩家数")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--start", default=None, help="起始日期 YYYYmmdd，决定节日彩蛋，默认今天")
+    parser.add_argument("--rounds", type=int, default=20, help="每天开局轮数")
+    parser.add_argument("--active", type=float, default=0.3, help="每轮入座玩家比例")
+    parser.add_argument("--table-mix", type=float, nargs=4, default=[0.6, 0.15, 0.1, 0.15],
+                        metavar=("P2", "P3", "P4", "P5"), help="入座玩家在 2/3/4/5 人桌的占比")
+    parser.add_argument("--bet-median", type=float, default=200, help="下注中位数（对数正态）")
+    parser.add_argument("--bet-sigma", type=float, default=1.0)
+    parser.add_argument("--checkin", type=float, default=0.5, help="每日签到率")
+    parser.add_argument("--attacks", type=float, default=0.02, help="每人每天发起 Attack 次数")
+    parser.add_argument("--attack-respond", type=float, default=0.6, help="Attack 应战率")
+    parser.add_argument("--replicas", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--csv", default=None, help="把每日均值写到 CSV")
+    args = parser.parse_args()
+
+    start = (datetime.datetime.strptime(args.start, "%Y%m%d").date() if args.start
+             else datetime.datetime.now(TZ_BJ).date())
+    grants = _holiday_grants(start, args.days)
+    seeds = np.random.SeedSequence(args.seed).spawn(args.replicas)
+    jobs = [(args, grants, s) for s in seeds]
+    with ProcessPoolExecutor(max_workers=min(args.workers, args.replicas)) as pool:
+        results = np.stack(list(pool.map(_run_replica, jobs)))
+    mean = results.mean(axis=0)
+    idx = {f: i for i, f in enumerate(FIELDS)}
+
+    total_games = int(results[:, :, idx["games"]].sum())
+    print(f"{args.replicas} 个副本 × {args.days} 天 × {args.players} 人，共模拟 {total_games} 局")
+    print(f"{'日期':<10} {'人均积分':>10} {'日通胀':>8} {'签到':>10} {'彩蛋':>10} {'上榜':>8} "
+          f"{'连胜败':>9} {'极端点':>9} {'Attack销毁':>11} {'局数':>7} {'破产率':>6}")
+    prev = INITIAL_BALANCE * args.players
+    rows = []
+    for i in range(args.days):
+        row = mean[i]
+        supply = row[idx["supply"]]
+        rate = supply / prev - 1
+        prev = supply
+        d = (start + datetime.timedelta(days=i)).strftime("%Y-%m-%d")
+        rows.append((d, supply / args.players, rate, *row[1:]))
+        print(f"{d:<10} {supply / args.players:>10.0f} {rate:>8.2%} {row[idx['checkin']]:>10.0f} "
+              f"{row[idx['holiday']]:>10.0f} {row[idx['board']]:>8.0f} {row[idx['streak']]:>9.0f} "
+              f"{row[idx['extreme']]:>9.0f} {row[idx['attack_burn']]:>11.0f} {row[idx['games']]:>7.0f} "
+              f"{row[idx['broke']]:>6.1%}")
+    final = mean[-1, idx["supply"]] / args.players
+    print(f"\n人均积分 {INITIAL_BALANCE:.0f} → {final:.0f}，日均通胀 {(final / INITIAL_BALANCE) ** (1 / args.days) - 1:.2%}")
+
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8") as f:
+            f.write("date,per_capita,inflation," + ",".join(FIELDS[1:]) + "\n")
+            for r in rows:
+                f.write(",".join(str(x) for x in r) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from config import SNAPSHOT_DB, TZ_BJ
+from core import redis
+from sqlstore import SqliteStore
+from balance import BACKUP_DIRTY_KEY
+from redpack import rebuild_pw_indexes
+from scheduler import heavy_lock
+from leader import MAINTENANCE_ALL_KEY
+
+# ==============================
+# 全量运行态快照：托管中的对局押注、未领红包份额、攻击押注、连胜、排行榜等
+# 按 key 族 SCAN + pipeline 分批读出，结构化写入 SQLite；导入同样按批 pipeline 回写
+# ==============================
+
+SNAPSHOT_BATCH = 500
+# 保留最近几份快照，更早的整份删除
+SNAPSHOT_KEEP = 6
+# 整点备份任务每隔几小时顺带导出一份
+SNAPSHOT_INTERVAL_HOURS = 6
+# 导入期间全局维护标记（MAINTENANCE_ALL_KEY）的 TTL：每批写入时续期，进程中途退出后自动解除
+SNAPSHOT_IMPORT_PAUSE_TTL = 600
+# 设置维护标记后等一会儿，让主节点上已开始的 ticker 本轮跑完
+SNAPSHOT_IMPORT_GRACE = 3
+
+# (SCAN 模式, 所属族)；只收有状态的 key，消息 ID、缓存、锁等可再生的 key 不进快照
+SNAPSHOT_FAMILIES = [
+    ("user_balance:*", "balance"),
+    ("user_data:*", "user"),
+    ("user_names", "user"),
+    ("user_stats:*", "user"),
+    ("user_recent:*", "user"),
+    ("checkin_lock:*", "user"),
+    ("game:*", "game"),
+    ("game_msgs:*", "game"),
+    ("chat_games:*", "game"),
+    ("user_game:*", "game"),
+    ("game_streak:*", "streak"),
+    ("game_streak_bets:*", "streak"),
+    ("redpack_meta:*", "redpack"),
+    ("redpack_shares:*", "redpack"),
+    ("redpack_list:*", "redpack"),
+    ("redpack_users:*", "redpack"),
+    ("rp_expiry", "redpack"),
+    ("rp_pw_idx:*", "redpack"),
+    ("active_pw_rps", "redpack"),
+    ("rain:*", "rain"),
+    ("rain_credit:*", "rain"),
+    ("rain_board:*", "rain"),
+    ("rain_names:*", "rain"),
+    ("rain_schedule", "rain"),
+    ("attack:*", "attack"),
+    ("active_attack_by:*", "attack"),
+    ("active_attack_target:*", "attack"),
+    ("rank_*", "rank"),
+    ("active_groups", "misc"),
+]
+
+# rank_* 下的展示缓存与消息 ID，重启后会自动重建
+_SKIP_PREFIXES = ("rank_cache:", "rank_msg:", "rank_view_gen:")
+# 导入时不覆盖：活跃群取并集，不丢快照之后加入的群
+_IMPORT_MERGE_KEYS = ("active_groups",)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    sid      INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts       INTEGER NOT NULL,
+    keys     INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS snap_keys (
+    sid    INTEGER NOT NULL,
+    key    TEXT NOT NULL,
+    family TEXT NOT NULL,
+    type   TEXT NOT NULL,
+    pttl   INTEGER NOT NULL,
+    PRIMARY KEY (sid, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snap_strings (
+    sid   INTEGER NOT NULL,
+    key   TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sid, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snap_hashes (
+    sid   INTEGER NOT NULL,
+    key   TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sid, key, field)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snap_lists (
+    sid   INTEGER NOT NULL,
+    key   TEXT NOT NULL,
+    idx   INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sid, key, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snap_sets (
+    sid    INTEGER NOT NULL,
+    key    TEXT NOT NULL,
+    member TEXT NOT NULL,
+    PRIMARY KEY (sid, key, member)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snap_zsets (
+    sid    INTEGER NOT NULL,
+    key    TEXT NOT NULL,
+    member TEXT NOT NULL,
+    score  REAL NOT NULL,
+    PRIMARY KEY (sid, key, member)
+) WITHOUT ROWID;
+"""
+
+_VALUE_TABLES = ("snap_strings", "snap_hashes", "snap_lists", "snap_sets", "snap_zsets")
+
+snapshot_store = SqliteStore(SNAPSHOT_DB, _SCHEMA)
+
+
+async def _scan_family_keys():
+    """按族依次 SCAN，产出 (key, family)；同一 key 只产出一次"""
+    seen = set()
+    for pattern, family in SNAPSHOT_FAMILIES:
+        async for key in redis.scan_iter(pattern, count=SNAPSHOT_BATCH):
+            if key in seen or key.startswith(_SKIP_PREFIXES):
+                continue
+            seen.add(key)
+            yield key, family
+
+
+async def _read_snapshot_batch(keys: list) -> dict:
+    """两次 pipeline：先 TYPE + PTTL，再按类型整值读取；读取间隙已过期的 key 跳过"""
+    pipe = redis.pipeline(transaction=False)
+    for key, _ in keys:
+        pipe.type(key)
+        pipe.pttl(key)
+    meta = await pipe.execute()
+
+    typed = []
+    pipe = redis.pipeline(transaction=False)
+    for i, (key, family) in enumerate(keys):
+        kind, pttl = meta[2 * i], meta[2 * i + 1]
+        if kind == "string":
+            pipe.get(key)
+        elif kind == "hash":
+            pipe.hgetall(key)
+        elif kind == "list":
+            pipe.lrange(key, 0, -1)
+        elif kind == "set":
+            pipe.smembers(key)
+        elif kind == "zset":
+            pipe.zrange(key, 0, -1, withscores=True)
+        else:
+            continue
+        typed.append((key, family, kind, pttl))
+    values = await pipe.execute() if typed else []
+
+    rows = {"keys": [], "snap_strings": [], "snap_hashes": [], "snap_lists": [], "snap_sets": [], "snap_zsets": []}
+    for (key, family, kind, pttl), value in zip(typed, values):
+        if value is None or (kind != "string" and not value):
+            continue
+        rows["keys"].append((key, family, kind, pttl if pttl and pttl > 0 else -1))
+        if kind == "string":
+            rows["snap_strings"].append((key, value))
+        elif kind == "hash":
+            rows["snap_hashes"].extend((key, f, v) for f, v in value.items())
+        elif kind == "list":
+            rows["snap_lists"].extend((key, idx, v) for idx, v in enumerate(value))
+        elif kind == "set":
+            rows["snap_sets"].extend((key, m) for m in value)
+        else:
+            rows["snap_zsets"].extend((key, m, s) for m, s in value)
+    return rows
+
+
+def _begin_snapshot(conn) -> int:
+    with conn:
+        return conn.execute("INSERT INTO snapshots (ts) VALUES (?)", (int(time.time()),)).lastrowid
+
+
+def _write_snapshot_batch(conn, sid: int, rows: dict) -> int:
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO snap_keys VALUES (?, ?, ?, ?, ?)",
+                         [(sid, *r) for r in rows["keys"]])
+        conn.executemany("INSERT OR REPLACE INTO snap_strings VALUES (?, ?, ?)",
+                         [(sid, *r) for r in rows["snap_strings"]])
+        conn.executemany("INSERT OR REPLACE INTO snap_hashes VALUES (?, ?, ?, ?)",
+                         [(sid, *r) for r in rows["snap_hashes"]])
+        conn.executemany("INSERT OR REPLACE INTO snap_lists VALUES (?, ?, ?, ?)",
+                         [(sid, *r) for r in rows["snap_lists"]])
+        conn.executemany("INSERT OR REPLACE INTO snap_sets VALUES (?, ?, ?)",
+                         [(sid, *r) for r in rows["snap_sets"]])
+        conn.executemany("INSERT OR REPLACE INTO snap_zsets VALUES (?, ?, ?, ?)",
+                         [(sid, *r) for r in rows["snap_zsets"]])
+    return len(rows["keys"])
+
+
+def _finish_snapshot(conn, sid: int, keys: int):
+    with conn:
+        conn.execute("UPDATE snapshots SET keys = ?, complete = 1 WHERE sid = ?", (keys, sid))
+
+
+def _prune_snapshots(conn, keep: int):
+    """只保留最近 keep 份完整快照；中途失败的残缺快照一并清掉"""
+    with conn:
+        rows = conn.execute(
+            "SELECT sid FROM snapshots WHERE complete = 1 ORDER BY sid DESC LIMIT ?", (keep,)
+        ).fetchall()
+        if not rows:
+            return
+        oldest = rows[-1][0]
+        stale = [r[0] for r in conn.execute(
+            "SELECT sid FROM snapshots WHERE sid < ? OR complete = 0 AND sid < ?",
+            (oldest, rows[0][0]),
+        ).fetchall()]
+        for table in ("snap_keys",) + _VALUE_TABLES:
+            conn.executemany(f"DELETE FROM {table} WHERE sid = ?", [(s,) for s in stale])
+        conn.executemany("DELETE FROM snapshots WHERE sid = ?", [(s,) for s in stale])
+
+
+async def export_snapshot() -> tuple:
+    """导出一份全量运行态快照，返回 (快照号, key 数)。
+    每批之间让出事件循环，Redis 侧只有 SCAN 与 pipeline 读，不会长时间阻塞；
+    各批读取时刻不同，不是严格的同一时间点，以 key 为单位保证自身完整"""
+    sid = await snapshot_store.run(_begin_snapshot)
+    total = 0
+    batch = []
+    async for item in _scan_family_keys():
+        batch.append(item)
+        if len(batch) >= SNAPSHOT_BATCH:
+            total += await snapshot_store.run(_write_snapshot_batch, sid, await _read_snapshot_batch(batch))
+            batch = []
+    if batch:
+        total += await snapshot_store.run(_write_snapshot_batch, sid, await _read_snapshot_batch(batch))
+    await snapshot_store.run(_finish_snapshot, sid, total)
+    await snapshot_store.run(_prune_snapshots, SNAPSHOT_KEEP)
+    logging.info(f"✅ 运行态快照完成：#{sid}，{total} 个 key")
+    return sid, total
+
+
+async def get_snapshot(sid: int) -> tuple | None:
+    rows = await snapshot_store.query("SELECT sid, ts, keys FROM snapshots WHERE sid = ? AND complete = 1", (sid,))
+    return rows[0] if rows else None
+
+
+async def list_snapshots(limit: int = 10) -> list:
+    """[(sid, ts, keys), ...]，新的在前，只列完整快照"""
+    return await snapshot_store.query(
+        "SELECT sid, ts, keys FROM snapshots WHERE complete = 1 ORDER BY sid DESC LIMIT ?", (limit,)
+    )
+
+
+async def snapshot_family_counts(sid: int) -> list:
+    """[(family, keys), ...]"""
+    return await snapshot_store.query(
+        "SELECT family, COUNT(*) FROM snap_keys WHERE sid = ? GROUP BY family ORDER BY family", (sid,)
+    )
+
+
+def _load_snapshot_batch(conn, sid: int, after: str, limit: int) -> tuple:
+    """按 key 顺序取一批，返回 (本批最后一个 key, [(key, type, pttl, value), ...])，value 已按类型还原"""
+    metas = conn.execute(
+        "SELECT key, type, pttl FROM snap_keys WHERE sid = ? AND key > ? ORDER BY key LIMIT ?",
+        (sid, after, limit),
+    ).fetchall()
+    if not metas:
+        return None, []
+    lo, hi = metas[0][0], metas[-1][0]
+    values = {}
+    for key, value in conn.execute(
+        "SELECT key, value FROM snap_strings WHERE sid = ? AND key BETWEEN ? AND ?", (sid, lo, hi)
+    ):
+        values[key] = value
+    for key, field, value in conn.execute(
+        "SELECT key, field, value FROM snap_hashes WHERE sid = ? AND key BETWEEN ? AND ?", (sid, lo, hi)
+    ):
+        values.setdefault(key, {})[field] = value
+    for key, value in conn.execute(
+        "SELECT key, value FROM snap_lists WHERE sid = ? AND key BETWEEN ? AND ? ORDER BY key, idx", (sid, lo, hi)
+    ):
+        values.setdefault(key, []).append(value)
+    for key, member in conn.execute(
+        "SELECT key, member FROM snap_sets WHERE sid = ? AND key BETWEEN ? AND ?", (sid, lo, hi)
+    ):
+        values.setdefault(key, []).append(member)
+    for key, member, score in conn.execute(
+        "SELECT key, member, score FROM snap_zsets WHERE sid = ? AND key BETWEEN ? AND ?", (sid, lo, hi)
+    ):
+        values.setdefault(key, {})[member] = score
+    return hi, [(key, kind, pttl, values[key]) for key, kind, pttl in metas if key in values]
+
+
+async def import_snapshot(sid: int, progress=None) -> int:
+    """把快照按批 pipeline 写回：每个 key 先 DEL 再整值写入并恢复剩余 TTL。
+    只覆盖快照里有的 key，快照之后新建的 key 保持不动。progress(done) 每批回调一次。
+    先拿重任务锁，再设全局维护（所有群与红包过期、红包雨 ticker 暂停）；写回的余额 uid 记入备份脏集合，结束后重建口令索引"""
+    async with heavy_lock():
+        await redis.set(MAINTENANCE_ALL_KEY, "1", ex=SNAPSHOT_IMPORT_PAUSE_TTL)
+        try:
+            await asyncio.sleep(SNAPSHOT_IMPORT_GRACE)
+            done = await _import_snapshot_keys(sid, progress)
+            await redis.expire(MAINTENANCE_ALL_KEY, SNAPSHOT_IMPORT_PAUSE_TTL)
+            await rebuild_pw_indexes()
+        finally:
+            await redis.delete(MAINTENANCE_ALL_KEY)
+    logging.info(f"♻️ 运行态快照 #{sid} 已导入 {done} 个 key")
+    return done
+
+
+async def _import_snapshot_keys(sid: int, progress) -> int:
+    done = 0
+    after = ""
+    while True:
+        last, batch = await snapshot_store.run(_load_snapshot_batch, sid, after, SNAPSHOT_BATCH)
+        if last is None:
+            break
+        pipe = redis.pipeline(transaction=False)
+        # 每批续期维护标记，大快照写到一半也不会提前解除暂停
+        pipe.expire(MAINTENANCE_ALL_KEY, SNAPSHOT_IMPORT_PAUSE_TTL)
+        for key, kind, pttl, value in batch:
+            if key in _IMPORT_MERGE_KEYS:
+                pipe.sadd(key, *value)
+                continue
+            pipe.delete(key)
+            if kind == "string":
+                pipe.set(key, value)
+            elif kind == "hash":
+                pipe.hset(key, mapping=value)
+            elif kind == "list":
+                pipe.rpush(key, *value)
+            elif kind == "set":
+                pipe.sadd(key, *value)
+            else:
+                pipe.zadd(key, value)
+            if pttl > 0:
+                pipe.pexpire(key, pttl)
+            if key.startswith("user_balance:"):
+                pipe.sadd(BACKUP_DIRTY_KEY, key.split(":", 1)[1])
+        await pipe.execute()
+        done += len(batch)
+        after = last
+        if progress:
+            await progress(done)
+    return done
+
+
+def format_snapshot(snap: tuple) -> str:
+    sid, ts, keys = snap
+    t = datetime.datetime.fromtimestamp(ts, TZ_BJ).strftime("%Y-%m-%d %H:%M")
+    return f"#{sid} {t}（{keys} 个 key）"
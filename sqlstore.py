@@ -0,0 +1,50 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SqliteStore:
+    """SQLite 单线程执行器：连接只在专属 worker 线程里创建和使用，事件循环只 await 结果。
+
+    WAL 模式下读写互不阻塞；所有写入走 executemany 批量提交。
+    """
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        self.schema = schema
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite:{path}")
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    async def run(self, fn, *args):
+        """在 worker 线程里执行 fn(conn, *args)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connect(), *args))
+
+    async def executemany(self, sql: str, rows: list):
+        def _write(conn):
+            with conn:
+                conn.executemany(sql, rows)
+        await self.run(_write)
+
+    async def query(self, sql: str, params: tuple = ()) -> list:
+        def _read(conn):
+            return conn.execute(sql, params).fetchall()
+        return await self.run(_read)
+
+    async def close(self):
+        def _close(conn):
+            conn.close()
+            self._conn = None
+        if self._conn is not None:
+            await self.run(_close)
+        self._executor.shutdown(wait=False)
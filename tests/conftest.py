@@ -0,0 +1,10 @@
+import os
+import sys
+
+# config.py 导入时强制检查这些环境变量；测试只用到纯逻辑，不连 Telegram / Redis
+os.environ.setdefault("BOT_TOKEN", "123456:TEST-TOKEN")
+os.environ.setdefault("BOT_ID", "123456")
+os.environ.setdefault("SUPER_ADMIN_ID", "1")
+os.environ.setdefault("ADMIN_IDS", "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,37 @@
+import datetime
+import sqlite3
+
+from archive import _SCHEMA, _archive_since, _closed_candidates, _period_start
+
+
+def test_period_start():
+    d = datetime.date(2026, 10, 15)  # 周四
+    assert _period_start("daily", d) == d
+    assert _period_start("weekly", d) == datetime.date(2026, 10, 12)
+    assert _period_start("monthly", d) == datetime.date(2026, 10, 1)
+
+
+def test_closed_candidates_excludes_current_periods():
+    today = datetime.date(2026, 10, 15)
+    got = set(_closed_candidates(today))
+    assert ("daily", "20261014") in got and ("daily", "20261015") not in got
+    assert ("monthly", "202609") in got and ("monthly", "202610") not in got
+    assert ("weekly", today.strftime("%Y-%W")) not in got
+
+
+def test_closed_candidates_skip_periods_before_deploy():
+    today = datetime.date(2026, 10, 15)
+    # 月中上线：9 月、上线当周、上线日之前的日榜都不完整
+    got = set(_closed_candidates(today, since=datetime.date(2026, 10, 8)))
+    assert got == {("daily", f"202610{d:02d}") for d in range(8, 15)}
+    # 再过一周：上线后第一个完整周可以归档
+    got = set(_closed_candidates(datetime.date(2026, 10, 20), since=datetime.date(2026, 10, 8)))
+    assert ("weekly", datetime.date(2026, 10, 13).strftime("%Y-%W")) in got
+    assert ("weekly", datetime.date(2026, 10, 8).strftime("%Y-%W")) not in got
+
+
+def test_archive_since_recorded_once():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(_SCHEMA)
+    assert _archive_since(conn, "20261008") == "20261008"
+    assert _archive_since(conn, "20261020") == "20261008"
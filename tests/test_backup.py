@@ -0,0 +1,50 @@
+import asyncio
+
+import backup
+from backup import merge_restore_uids
+
+
+def _row(uid, bal, name="n", last_checkin="", streak=0):
+    return (uid, bal, name, last_checkin, streak)
+
+
+def test_merge_restore_uids():
+    rows = [_row("1", 10), _row("3", 30), _row("5", 50)]
+    merged = list(merge_restore_uids(rows, ["2", "3", "6"]))
+    assert merged == [("create", rows[0]), ("keep", "2"), ("both", rows[1]), ("create", rows[2]), ("keep", "6")]
+
+
+def test_merge_restore_uids_empty_sides():
+    rows = [_row("1", 10)]
+    assert list(merge_restore_uids(rows, [])) == [("create", rows[0])]
+    assert list(merge_restore_uids([], ["1"])) == [("keep", "1")]
+
+
+class _FakeRedis:
+    def __init__(self, uids):
+        self.uids = uids
+
+    async def scan_iter(self, pattern, count=None):
+        for uid in self.uids:
+            yield f"user_balance:{uid}"
+
+
+def test_diff_restore_point(monkeypatch):
+    backup_rows = [_row("a", 100.0), _row("b", 200.0), _row("c", 300.0)]
+    live = {"b": _row("b", 250.0), "c": _row("c", 300.0), "d": _row("d", 1.0)}
+
+    async def load(version):
+        return backup_rows
+
+    async def read(uids):
+        return [live[u] for u in uids]
+
+    monkeypatch.setattr(backup, "redis", _FakeRedis(["d", "c", "b"]))
+    monkeypatch.setattr(backup, "load_restore_point", load)
+    monkeypatch.setattr(backup, "_read_backup_batch", read)
+    result = asyncio.run(backup.diff_restore_point(1))
+
+    assert (result["create"], result["keep"], result["changed"], result["same"]) == (1, 1, 1, 1)
+    # 新增 a 带来 +100，覆盖 b 带来 -50
+    assert result["delta"] == 50.0
+    assert result["top"] == [("b", 250.0, 200.0)]
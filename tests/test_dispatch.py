@@ -0,0 +1,46 @@
+import asyncio
+
+from aiohttp.test_utils import make_mocked_request
+
+from dispatch import QueuedRequestHandler, UpdateDeduplicator
+
+
+def _stats(handler, path, headers=None):
+    return asyncio.run(handler.handle_stats(make_mocked_request("GET", path, headers=headers or {})))
+
+
+def test_stats_requires_secret_token():
+    handler = QueuedRequestHandler(dispatcher=None, bot=None, secret_token="s3cret")
+    assert _stats(handler, "/stats").status == 401
+    assert _stats(handler, "/stats?token=wrong").status == 401
+    assert _stats(handler, "/stats?token=s3cret").status == 200
+    assert _stats(handler, "/stats", {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}).status == 200
+
+
+def test_dedup_window_edges():
+    dedup = UpdateDeduplicator(window=4)
+    assert not dedup.contains(100)
+    dedup.add(100)
+    assert dedup.contains(100)
+    assert not dedup.contains(101)
+    dedup.add(103)
+    # 窗口内：100..103，只记录过 100 与 103
+    assert dedup.contains(100) and dedup.contains(103)
+    assert not dedup.contains(101) and not dedup.contains(102)
+    dedup.add(101)
+    assert dedup.contains(101)
+    # 最新 id 前进到 104 后，100 落到窗口外：不再判为重投
+    dedup.add(104)
+    assert not dedup.contains(100)
+    assert dedup.contains(101) and dedup.contains(104)
+
+
+def test_dedup_large_jump_resets_window():
+    dedup = UpdateDeduplicator(window=4)
+    dedup.add(1)
+    dedup.add(50)
+    assert dedup.contains(50)
+    assert not dedup.contains(49) and not dedup.contains(1)
+    # 窗口外的 add 不改变状态
+    dedup.add(1)
+    assert not dedup.contains(47)
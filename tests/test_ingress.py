@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from aiogram import types
+
+import redpack
+from ingress import classify_update
+from redpack import apply_pw_event, load_pw_hints, pw_hint_add
+
+
+class _NoRedis:
+    """任何 Redis 访问都记下来，用于断言入口分类零 Redis"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        raise AssertionError(f"unexpected redis.{name}")
+
+
+@pytest.fixture
+def no_redis(monkeypatch):
+    fake = _NoRedis()
+    monkeypatch.setattr(redpack, "redis", fake)
+    monkeypatch.setattr(redpack, "_pw_hints", {})
+    return fake
+
+
+def _update(**message):
+    base = {"message_id": 1, "date": 0, "chat": {"id": -100, "type": "supergroup"},
+            "from": {"id": 7, "is_bot": False, "first_name": "u"}}
+    return types.Update.model_validate({"update_id": 1, "message": {**base, **message}})
+
+
+def test_command_and_bet(no_redis):
+    assert classify_update(_update(text="/dice_me@bot")) == {"ingress_tag": "command", "ingress_cmd": "dice_me"}
+    assert classify_update(_update(text="大 100"))["ingress_tag"] == "bet"
+    assert no_redis.calls == []
+
+
+def test_password_matches_local_table(no_redis):
+    pw_hint_add(-100, "芝麻开门", "rp1")
+    assert classify_update(_update(text=" 芝麻开门 ")) == {"ingress_tag": "pw"}
+    # 别的群的口令不算
+    pw_hint_add(-200, "开门", "rp2")
+    assert classify_update(_update(text="开门")) is None
+    assert no_redis.calls == []
+
+
+def test_chatter_dropped_without_redis(no_redis):
+    assert classify_update(_update(text="hello")) is None
+    # 只有图片说明的消息不参与口令匹配
+    pw_hint_add(-100, "芝麻开门", "rp1")
+    assert classify_update(_update(caption="芝麻开门", photo=[])) is None
+    assert no_redis.calls == []
+
+
+def test_callback(no_redis):
+    update = types.Update.model_validate({"update_id": 2, "callback_query": {
+        "id": "q", "from": {"id": 7, "is_bot": False, "first_name": "u"}, "chat_instance": "c", "data": "rp:abc"}})
+    assert classify_update(update) == {"ingress_tag": "callback", "callback_prefix": "rp"}
+
+
+def test_pw_events_sync_table(no_redis):
+    apply_pw_event('["add", "-100", "芝麻开门", "rp1"]')
+    apply_pw_event('["add", "-100", "芝麻开门", "rp2"]')
+    apply_pw_event('["rem", "-100", "芝麻开门", "rp1"]')
+    assert classify_update(_update(text="芝麻开门")) == {"ingress_tag": "pw"}
+    apply_pw_event('["rem", "-100", "芝麻开门", "rp2"]')
+    assert classify_update(_update(text="芝麻开门")) is None
+
+
+class _FakePipe:
+    def __init__(self, metas):
+        self.metas = metas
+        self.ops = []
+
+    def hmget(self, key, *fields):
+        self.ops.append(key.split(":", 1)[1])
+
+    async def execute(self):
+        return [self.metas.get(rp_id, (None, None)) for rp_id in self.ops]
+
+
+class _FakeRedis:
+    def __init__(self, metas):
+        self.metas = metas
+
+    async def smembers(self, key):
+        return set(self.metas) | {"gone"}
+
+    def pipeline(self, transaction=True):
+        return _FakePipe(self.metas)
+
+
+def test_load_pw_hints_replaces_table(monkeypatch):
+    monkeypatch.setattr(redpack, "_pw_hints", {"-1": {"旧口令": {"old"}}})
+    monkeypatch.setattr(redpack, "redis", _FakeRedis({"rp1": ("芝麻开门", "-100"), "rp2": ("🎲", "-100")}))
+    asyncio.run(load_pw_hints())
+    assert redpack._pw_hints == {"-100": {"芝麻开门": {"rp1"}, "🎲": {"rp2"}}}
@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram import types
+
+import bot as bot_app
+import handlers
+
+
+class _FakeRedis:
+    def __init__(self, data):
+        self.data = dict(data)
+
+    async def exists(self, *keys):
+        return sum(k in self.data for k in keys)
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, **kwargs):
+        self.data[key] = value
+
+    async def delete(self, *keys):
+        for k in keys:
+            self.data.pop(k, None)
+
+    async def hkeys(self, key):
+        return []
+
+    async def lpush(self, key, value):
+        pass
+
+    async def ltrim(self, key, start, end):
+        pass
+
+
+class _FakeBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        return _Msg()
+
+    async def unpin_chat_message(self, **kwargs):
+        pass
+
+    async def delete_message(self, **kwargs):
+        pass
+
+
+class _Msg:
+    message_id = 99
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+def _message(text, uid=1):
+    return types.Message.model_validate({
+        "message_id": 1, "date": 0, "text": text,
+        "chat": {"id": -100, "type": "supergroup"},
+        "from": {"id": uid, "is_bot": False, "first_name": "u"},
+    })
+
+
+def _setup(monkeypatch, data):
+    fake = _FakeRedis(data)
+    for mod in (bot_app, handlers):
+        monkeypatch.setattr(mod, "redis", fake)
+    monkeypatch.setattr(bot_app, "bot", _FakeBot())
+    monkeypatch.setattr(bot_app, "delete_msgs", _noop)
+    monkeypatch.setattr(bot_app, "pin_in_topic", _noop)
+    monkeypatch.setattr(bot_app, "_compensation_cleanup", _noop)
+    return fake
+
+
+def test_compensate_clears_maintenance(monkeypatch):
+    fake = _setup(monkeypatch, {"maintenance:-100": "1"})
+
+    async def run():
+        await bot_app.blackhole_router.propagate_event("message", _message("/dice_compensate"), bot=_FakeBot())
+        await asyncio.sleep(0)
+    asyncio.run(run())
+    assert "maintenance:-100" not in fake.data
+    assert fake.data["compensation_pin:-100"].startswith("99:")
+
+
+def test_pw_claim_paused_during_import(monkeypatch):
+    _setup(monkeypatch, {"maintenance:all": "1"})
+    claims = []
+
+    async def fake_claim(message, text, uid):
+        claims.append(text)
+    monkeypatch.setattr(bot_app, "attempt_claim_pw_redpack", fake_claim)
+    asyncio.run(bot_app.handle_pw_redpack_text(_message("芝麻开门", uid=7)))
+    assert claims == []
@@ -0,0 +1,48 @@
+import itertools
+import os
+
+import pytest
+
+import odds
+from odds import DICE_RANGE, _player_odds, _score_pmf_reference
+
+
+@pytest.mark.parametrize("k", list(DICE_RANGE))
+def test_numpy_pmf_matches_settlement(k):
+    pytest.importorskip("numpy")
+    ref = _score_pmf_reference(k)
+    assert max(abs(a - b) for a, b in zip(ref, odds._score_pmf_numpy(k))) < 1e-12
+    assert abs(sum(ref) - 1) < 1e-12
+
+
+def _enumerate_odds(pmf, direction, n):
+    """逐个组合枚举：玩家 0 独占第一 / 与人同分 / 其余"""
+    win = tie = 0.0
+    better = (lambda a, b: a > b) if direction == "大" else (lambda a, b: a < b)
+    for scores in itertools.product(range(10), repeat=n):
+        p = 1.0
+        for s in scores:
+            p *= pmf[s]
+        me, others = scores[0], scores[1:]
+        if all(better(me, o) for o in others):
+            win += p
+        elif me in others:
+            tie += p
+    return [win, tie, 1 - win - tie]
+
+
+@pytest.mark.parametrize("direction", ["大", "小"])
+@pytest.mark.parametrize("n", [2, 3, 4])
+def test_player_odds_match_enumeration(direction, n):
+    pmf = _score_pmf_reference(2)
+    got = _player_odds(pmf, direction, n)
+    want = _enumerate_odds(pmf, direction, n)
+    assert max(abs(a - b) for a, b in zip(got, want)) < 1e-12
+
+
+def test_load_does_not_write_cache(tmp_path, monkeypatch):
+    cache = tmp_path / "odds_table.json"
+    monkeypatch.setattr(odds, "ODDS_CACHE", str(cache))
+    tables = odds.load_odds_tables()
+    assert tables["version"] == odds.ODDS_RULES_VERSION
+    assert not os.path.exists(cache)
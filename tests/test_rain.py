@@ -0,0 +1,16 @@
+from rain import rain_wave_plan
+
+
+def test_wave_plan_conserves_total_and_count():
+    plan = rain_wave_plan(100000, 3001, 60)
+    assert len(plan) == 60
+    assert sum(c for c, _ in plan) == 100000
+    assert sum(n for _, n in plan) == 3001
+    # 每波至少够每份 1 分
+    assert all(c >= n > 0 for c, n in plan)
+
+
+def test_wave_plan_minimum_amount():
+    plan = rain_wave_plan(500, 500, 7)
+    assert all(c == n for c, n in plan)
+    assert sum(n for _, n in plan) == 500
@@ -0,0 +1,64 @@
+import asyncio
+import random
+
+import balance
+from balance import merged_top, rank_key
+
+
+class _Pipe:
+    def __init__(self, r):
+        self.r, self.calls = r, []
+
+    def zscore(self, key, member):
+        self.calls.append((key, member))
+
+    async def execute(self):
+        return [self.r.z.get(k, {}).get(m) for k, m in self.calls]
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.z = {}
+
+    def _range(self, key, start, end, desc, withscores):
+        items = sorted(self.z.get(key, {}).items(), key=lambda x: (x[1], x[0]), reverse=desc)
+        items = items[start:] if end == -1 else items[start:end + 1]
+        return items if withscores else [u for u, _ in items]
+
+    async def zrange(self, key, start, end, withscores=False):
+        return self._range(key, start, end, False, withscores)
+
+    async def zrevrange(self, key, start, end, withscores=False):
+        return self._range(key, start, end, True, withscores)
+
+    def pipeline(self, transaction=True):
+        return _Pipe(self)
+
+
+def _brute(fake, sources, k, desc):
+    total = {}
+    for b in sources:
+        for uid, s in fake.z.get(rank_key("points", b), {}).items():
+            total[uid] = total.get(uid, 0) + s
+    return sorted(total.values(), reverse=desc)[:k]
+
+
+def test_merged_top_matches_full_union(monkeypatch):
+    rnd = random.Random(7)
+    fake = _FakeRedis()
+    monkeypatch.setattr(balance, "redis", fake)
+    sources = ["view:weekly:2026-02", "daily:20260110"]
+    fake.z[rank_key("points", sources[0])] = {f"u{i}": float(rnd.randint(-500, 500)) for i in range(200)}
+    # 当天玩家一部分是老玩家、一部分是新玩家
+    fake.z[rank_key("points", sources[1])] = {f"u{i}": float(rnd.randint(-800, 800)) for i in range(190, 230, 3)}
+    for desc in (True, False):
+        got = asyncio.run(merged_top("points", sources, 10, desc=desc))
+        assert [s for _, s in got] == _brute(fake, sources, 10, desc)
+
+
+def test_merged_top_single_source(monkeypatch):
+    fake = _FakeRedis()
+    monkeypatch.setattr(balance, "redis", fake)
+    fake.z[rank_key("points", "daily:20260110")] = {"a": 5.0, "b": -3.0, "c": 9.0}
+    got = asyncio.run(merged_top("points", ["daily:20260110"], 2))
+    assert got == [("c", 9.0), ("a", 5.0)]
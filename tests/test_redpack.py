@@ -0,0 +1,34 @@
+import pytest
+
+import redpack
+from redpack import SHARE_WIDTH, pack_shares, split_redpack_cents
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def impl(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(redpack, "_HAS_NUMPY", request.param)
+
+
+@pytest.mark.parametrize("total, count, min_cents", [
+    (1, 1, 1), (50, 50, 1), (10000, 7, 1), (20000000, 50, 1), (1000, 10, 100), (12345, 3, 0),
+])
+def test_split_sums_exactly(impl, total, count, min_cents):
+    for _ in range(50):
+        cents = split_redpack_cents(total, count, min_cents)
+        assert len(cents) == count
+        assert sum(cents) == total
+        assert all(isinstance(c, int) and c >= min_cents for c in cents)
+
+
+@pytest.mark.parametrize("total, count", [(49, 50), (0, 1), (100, 0)])
+def test_split_rejects_impossible(impl, total, count):
+    with pytest.raises(ValueError):
+        split_redpack_cents(total, count)
+
+
+def test_pack_shares_fixed_width():
+    packed = pack_shares([1, 20000000, 305])
+    assert len(packed) == 3 * SHARE_WIDTH
+    assert [int(packed[i:i + SHARE_WIDTH]) for i in range(0, len(packed), SHARE_WIDTH)] == [1, 20000000, 305]
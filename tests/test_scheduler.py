@@ -0,0 +1,205 @@
+import asyncio
+import datetime
+import time
+
+import scheduler
+from config import TZ_BJ
+from scheduler import Job, daily, hourly, _missed_slots
+
+
+def _dt(*args):
+    return datetime.datetime(*args, tzinfo=TZ_BJ)
+
+
+async def _noop(slot):
+    pass
+
+
+def test_first_boot_does_not_replay():
+    job = Job("daily_report", daily(0, 1), _noop, catchup="all", window=86400 * 3)
+    assert _missed_slots(job, None, _dt(2026, 1, 10, 8, 0)) == []
+
+
+def test_catchup_all_after_last_run():
+    job = Job("daily_report", daily(0, 1), _noop, catchup="all", window=86400 * 3)
+    slots = _missed_slots(job, _dt(2026, 1, 8, 0, 1), _dt(2026, 1, 10, 8, 0))
+    assert slots == [_dt(2026, 1, 9, 0, 1), _dt(2026, 1, 10, 0, 1)]
+
+
+def test_catchup_window_limits_old_last_run():
+    job = Job("daily_report", daily(0, 1), _noop, catchup="all", window=86400 * 3)
+    slots = _missed_slots(job, _dt(2025, 12, 1, 0, 1), _dt(2026, 1, 10, 8, 0))
+    assert slots == [_dt(2026, 1, 8, 0, 1), _dt(2026, 1, 9, 0, 1), _dt(2026, 1, 10, 0, 1)]
+
+
+def test_catchup_latest_and_skip():
+    last = _dt(2026, 1, 10, 5, 0)
+    now = _dt(2026, 1, 10, 8, 30)
+    latest = Job("backup", hourly(), _noop, catchup="latest", window=3600 * 6)
+    assert _missed_slots(latest, last, now) == [_dt(2026, 1, 10, 8, 0)]
+    skip = Job("backup", hourly(), _noop, catchup="skip", window=3600 * 6)
+    assert _missed_slots(skip, last, now) == []
+
+
+def test_nothing_missed_when_up_to_date():
+    job = Job("noon_event", daily(12, 0), _noop, catchup="latest", window=5 * 3600)
+    assert _missed_slots(job, _dt(2026, 1, 10, 12, 0), _dt(2026, 1, 10, 13, 0)) == []
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.h = {}
+
+    async def hgetall(self, key):
+        return dict(self.h.get(key, {}))
+
+    async def hsetnx(self, key, field, value):
+        self.h.setdefault(key, {}).setdefault(field, str(value))
+
+    async def hget(self, key, field):
+        return self.h.get(key, {}).get(field)
+
+    async def hset(self, key, field, value):
+        self.h.setdefault(key, {})[field] = str(value)
+
+
+def test_first_boot_seeds_last_run(monkeypatch):
+    fake = _FakeRedis()
+    fired = []
+
+    async def fn(slot):
+        fired.append(slot)
+
+    job = Job("noon_event", daily(12, 0), fn, catchup="latest", window=86400)
+    monkeypatch.setattr(scheduler, "redis", fake)
+    monkeypatch.setattr(scheduler, "_JOBS", [job])
+
+    async def run():
+        await scheduler._catch_up()
+        await asyncio.sleep(0)
+    asyncio.run(run())
+
+    assert fired == []
+    assert "noon_event" in fake.h[scheduler.LAST_RUN_KEY]
+
+
+def test_failed_run_releases_key_and_keeps_last_run(monkeypatch):
+    fake = _FakeRedis()
+    released = []
+
+    async def boom(slot):
+        raise RuntimeError("boom")
+
+    async def allow(run_key, ttl):
+        return True
+
+    async def release(run_key):
+        released.append(run_key)
+
+    job = Job("backup", hourly(), boom, key_fmt="%Y%m%d%H")
+    monkeypatch.setattr(scheduler, "_heap", [])
+    monkeypatch.setattr(scheduler, "redis", fake)
+    monkeypatch.setattr(scheduler, "should_run", allow)
+    monkeypatch.setattr(scheduler, "release_run", release)
+    asyncio.run(scheduler._fire(job, _dt(2026, 1, 10, 8, 0)))
+
+    assert released == ["backup:2026011008"]
+    assert scheduler.LAST_RUN_KEY not in fake.h
+    assert not job.running
+
+
+def _fire_env(monkeypatch):
+    fake = _FakeRedis()
+    keys = set()
+
+    async def should_run(run_key, ttl):
+        if run_key in keys:
+            return False
+        keys.add(run_key)
+        return True
+
+    async def release(run_key):
+        keys.discard(run_key)
+
+    monkeypatch.setattr(scheduler, "_heap", [])
+    monkeypatch.setattr(scheduler, "redis", fake)
+    monkeypatch.setattr(scheduler, "should_run", should_run)
+    monkeypatch.setattr(scheduler, "release_run", release)
+    return fake
+
+
+async def _drain_heap():
+    """把定时堆里已排上的重试/延后项依次执行（忽略等待时间）"""
+    while scheduler._heap:
+        _, _, slot, job, attempt = scheduler._heap.pop(0)
+        await scheduler._fire(job, slot, attempt)
+
+
+def test_failed_slot_is_retried(monkeypatch):
+    fake = _fire_env(monkeypatch)
+    calls = []
+
+    async def flaky(slot):
+        calls.append(slot)
+        if len(calls) < 3:
+            raise RuntimeError("redis down")
+
+    slot = _dt(2026, 1, 10, 0, 0, 30)
+    job = Job("rank_fold", daily(0, 0, 30), flaky, heavy=True)
+
+    async def run():
+        await scheduler._fire(job, slot)
+        retry_at, _, retry_slot, _, attempt = scheduler._heap[0]
+        assert retry_slot == slot and attempt == 1
+        assert retry_at - time.time() > scheduler.SCHEDULER_RETRY_DELAY - 5
+        await _drain_heap()
+    asyncio.run(run())
+
+    assert calls == [slot] * 3
+    assert fake.h[scheduler.LAST_RUN_KEY]["rank_fold"] == str(int(slot.timestamp()))
+
+
+def test_retries_give_up_after_limit(monkeypatch):
+    _fire_env(monkeypatch)
+    calls = []
+
+    async def boom(slot):
+        calls.append(slot)
+        raise RuntimeError("boom")
+
+    job = Job("backup", hourly(), boom, key_fmt="%Y%m%d%H")
+
+    async def run():
+        await scheduler._fire(job, _dt(2026, 1, 10, 8, 0))
+        await _drain_heap()
+    asyncio.run(run())
+    assert len(calls) == scheduler.SCHEDULER_MAX_RETRIES + 1
+
+
+def test_overlapping_slot_runs_after_previous(monkeypatch):
+    fake = _fire_env(monkeypatch)
+    started = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def slow(slot):
+            started.append(slot)
+            if len(started) == 1:
+                await gate.wait()
+
+        job = Job("daily_report", daily(0, 1), slow)
+        first, second = _dt(2026, 1, 9, 0, 1), _dt(2026, 1, 10, 0, 1)
+        task = asyncio.create_task(scheduler._fire(job, first))
+        await asyncio.sleep(0)
+        await scheduler._fire(job, second)
+        assert started == [first] and job.deferred == [second]
+        gate.set()
+        await task
+        assert not job.deferred
+        await _drain_heap()
+        return first, second
+    first, second = asyncio.run(run())
+
+    assert started == [first, second]
+    assert fake.h[scheduler.LAST_RUN_KEY]["daily_report"] == str(int(second.timestamp()))
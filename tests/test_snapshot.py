@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import rain
+import redpack
+import snapshot
+from leader import MAINTENANCE_ALL_KEY
+from scheduler import heavy_lock
+
+
+class _FakePipe:
+    def __init__(self, r):
+        self.r = r
+        self.ops = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.ops.append((name, args[0] if args else None))
+
+    async def execute(self):
+        self.r.batches.append((self.ops, MAINTENANCE_ALL_KEY in self.r.data))
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.batches = []
+        self.lock_held_at_set = None
+
+    async def set(self, key, value, ex=None):
+        self.lock_held_at_set = heavy_lock().locked()
+        self.data[key] = value
+
+    async def expire(self, key, ttl):
+        pass
+
+    async def delete(self, *keys):
+        for k in keys:
+            self.data.pop(k, None)
+
+    def pipeline(self, transaction=True):
+        return _FakePipe(self)
+
+
+def test_import_holds_lock_and_refreshes_pause(monkeypatch):
+    fake = _FakeRedis()
+    batches = iter([
+        ("b", [("a", "string", -1, "1"), ("b", "set", 5000, ["x"])]),
+        ("user_balance:7", [("user_balance:7", "string", -1, "10")]),
+        (None, []),
+    ])
+
+    async def fake_run(fn, *args):
+        return next(batches)
+
+    async def noop():
+        pass
+    monkeypatch.setattr(snapshot, "redis", fake)
+    monkeypatch.setattr(snapshot.snapshot_store, "run", fake_run)
+    monkeypatch.setattr(snapshot, "rebuild_pw_indexes", noop)
+    monkeypatch.setattr(snapshot, "SNAPSHOT_IMPORT_GRACE", 0)
+
+    assert asyncio.run(snapshot.import_snapshot(1)) == 3
+    assert fake.lock_held_at_set is True
+    assert len(fake.batches) == 2
+    for ops, paused in fake.batches:
+        assert paused
+        assert ("expire", MAINTENANCE_ALL_KEY) in ops
+    assert ("sadd", snapshot.BACKUP_DIRTY_KEY) in fake.batches[1][0]
+    assert MAINTENANCE_ALL_KEY not in fake.data
+
+
+@pytest.mark.parametrize("module, loop, tick, interval", [
+    (redpack, "redpack_expiry_ticker", "_expiry_tick", "REDPACK_TICK"),
+    (rain, "rain_ticker", "_rain_tick", "RAIN_FLUSH_INTERVAL"),
+])
+def test_tickers_pause_during_import(monkeypatch, module, loop, tick, interval):
+    ticks = []
+
+    async def paused():
+        return True
+
+    async def fake_tick():
+        ticks.append(1)
+    monkeypatch.setattr(module, interval, 0)
+    monkeypatch.setattr(module, "is_leader", lambda: True)
+    monkeypatch.setattr(module, "globally_paused", paused)
+    monkeypatch.setattr(module, tick, fake_tick)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(getattr(module, loop)(), 0.05)
+    asyncio.run(run())
+    assert ticks == []